@@ -249,6 +249,33 @@ example5.fillna(0)
 example4.fillna(example4.mean())
 
 
+# O `fillna(example4.mean())` passa duas vezes pelos dados: uma para as médias e outra para copiar o `DataFrame` com os valores trocados. Em bases grandes, vale separar as etapas. Abaixo, o `Imputador` calcula em uma única passada, pedaço a pedaço, o valor de preenchimento de cada coluna (`'mean'`, `'median'` ou `'mode'`, ou a média por grupo com `por=`). O `aplica` depois preenche os faltantes direto nos vetores `float`, sem copiar a tabela quando `inplace=True`. Os valores ajustados em uma base podem ser aplicados em outra. O `Imputador` fica em `imputacao.py`, compartilhado com a Lista 03. A mediana usa o esboço KLL do módulo `medianas.py`, que guarda no máximo algo como `3 * k` valores por coluna.
+
+# In[ ]:
+
+
+from imputacao import Imputador
+
+
+# In[ ]:
+
+
+imputador = Imputador('mean').ajusta(example4)
+imputador.aplica(example4)
+
+
+# In[ ]:
+
+
+pd.testing.assert_frame_equal(example4.fillna(example4.mean()), imputador.aplica(example4))
+pd.testing.assert_frame_equal(example4.fillna(example4.median()), Imputador('median').ajusta(example4).aplica(example4))
+
+# ajustado em uma base, aplicado em outra, no lugar
+outra = pd.DataFrame([[np.nan, np.nan, np.nan, 1.0]])
+imputador.aplica(outra, inplace=True)
+pd.testing.assert_frame_equal(pd.DataFrame([[1.5, 5.5, 8.0, 1.0]]), outra)
+
+
 # &gt; ** Takeaway: ** Existem várias maneiras de lidar com valores ausentes em seus conjuntos de dados. A estratégia específica que você usa (removê-los, substituí-los ou mesmo como você os substitui) deve ser ditada pelas particularidades desses dados. Você desenvolverá um senso melhor de como lidar com os valores ausentes quanto mais você manipular e interagir com os conjuntos de dados.
 
 # ## Removendo dados duplicados
@@ -292,6 +319,214 @@ example6.drop_duplicates()
 example6.drop_duplicates(['letters'])
 
 
+# Quando os dados chegam em lotes (um arquivo por dia, por exemplo), `drop_duplicates` só enxerga o lote atual, e concatenar todo o histórico a cada lote custa O(n²). O `Deduplicador` abaixo resume cada linha das colunas-chave em uma impressão de 64 bits com `pd.util.hash_pandas_object` e lembra das impressões já vistas em vetores ordenados que são fundidos geometricamente. Cada lote devolve apenas as linhas novas, em tempo proporcional ao tamanho do lote. Duas linhas diferentes só se confundem se as impressões colidirem, o que tem probabilidade da ordem de 2⁻⁶⁴ por par.
+# 
+# Com `pasta`, quando mais de `limite` impressões estão em memória, elas são despejadas em um arquivo `.npy` lido por `mmap`. Arquivos de tamanhos parecidos são intercalados no disco, um pedaço por vez, como as execuções em memória; assim, cada consulta olha só O(log n) arquivos. Um filtro de Bloom em memória evita consultar o disco para as linhas realmente novas. Ele é dimensionado para `itens_esperados` impressões (ou `limite`, se não informado) com a taxa de `falsos_positivos` pedida, e é refeito com o dobro da capacidade quando o disco passa disso. Os arquivos são exatos, então um falso positivo do Bloom custa só uma busca a mais. Ao reabrir a mesma pasta, o histórico despejado continua valendo.
+
+# In[ ]:
+
+
+import glob
+import math
+import os
+
+
+class FiltroBloom:
+
+    def __init__(self, bits=1 << 23, funcoes=4):
+        if bits & (bits - 1):
+            raise ValueError('o número de bits precisa ser uma potência de 2')
+        self.bits = bits
+        self.funcoes = funcoes
+        self.vetor = np.zeros(bits // 8, dtype=np.uint8)
+
+    @classmethod
+    def para(cls, itens, falsos_positivos=0.01):
+        # m = -n ln p / (ln 2)², arredondado para uma potência de 2, e k = (m / n) ln 2
+        itens = max(int(itens), 1)
+        bits = max(1 << 10, 1 << math.ceil(math.log2(-itens * math.log(falsos_positivos) / math.log(2) ** 2)))
+        return cls(bits, funcoes=max(1, min(16, round(bits / itens * math.log(2)))))
+
+    def _posicoes(self, impressoes):
+        # hashing duplo: as duas metades da impressão de 64 bits geram as `funcoes` posições
+        h1 = impressoes & np.uint64(0xFFFFFFFF)
+        h2 = (impressoes >> np.uint64(32)) | np.uint64(1)
+        mascara = np.uint64(self.bits - 1)
+        return [(h1 + np.uint64(i) * h2) & mascara for i in range(self.funcoes)]
+
+    def adiciona(self, impressoes):
+        for posicoes in self._posicoes(impressoes):
+            np.bitwise_or.at(self.vetor, posicoes >> np.uint64(3),
+                             np.left_shift(1, posicoes & np.uint64(7)).astype(np.uint8))
+
+    def contem(self, impressoes):
+        # falsos positivos são possíveis, falsos negativos não
+        resultado = np.ones(len(impressoes), dtype=bool)
+        for posicoes in self._posicoes(impressoes):
+            resultado &= (self.vetor[posicoes >> np.uint64(3)] >> (posicoes & np.uint64(7)).astype(np.uint8)) & 1 == 1
+        return resultado
+
+
+def _contidos(ordenados, impressoes):
+    posicoes = np.searchsorted(ordenados, impressoes)
+    achados = posicoes < len(ordenados)
+    achados[achados] = ordenados[posicoes[achados]] == impressoes[achados]
+    return achados
+
+
+def _funde_no_disco(a, b, caminho, pedaco=1 << 20):
+    # intercala dois vetores ordenados direto no arquivo, um pedaço por vez: cada valor vai para
+    # a sua posição mais quantos valores do outro vetor vêm antes dele
+    saida = np.lib.format.open_memmap(caminho, mode='w+', dtype=a.dtype, shape=(len(a) + len(b),))
+    for origem, outro, lado in [(a, b, 'left'), (b, a, 'right')]:
+        for ini in range(0, len(origem), pedaco):
+            parte = np.asarray(origem[ini:ini + pedaco])
+            saida[np.searchsorted(outro, parte, lado) + np.arange(ini, ini + len(parte))] = parte
+    saida.flush()
+
+
+class Deduplicador:
+
+    def __init__(self, colunas=None, pasta=None, limite=1_000_000, itens_esperados=None, falsos_positivos=0.01):
+        self.colunas = colunas
+        self.pasta = pasta
+        self.limite = limite
+        self.falsos_positivos = falsos_positivos
+        # execuções ordenadas em memória, com tamanhos que crescem geometricamente
+        self.execucoes = []
+        self.despejadas = []
+        self.bloom = None
+        if pasta is not None:
+            os.makedirs(pasta, exist_ok=True)
+            # o que já foi despejado em outra sessão continua valendo
+            self._arquivos = sorted(glob.glob(os.path.join(pasta, 'vistos_*.npy')))
+            self.despejadas = [np.load(caminho, mmap_mode='r') for caminho in self._arquivos]
+            self._proximo = 1 + max([int(os.path.basename(c)[7:-4]) for c in self._arquivos], default=-1)
+            self._refaz_bloom(max(itens_esperados or limite, self._despejados()))
+
+    def _despejados(self):
+        return sum(len(d) for d in self.despejadas)
+
+    def _refaz_bloom(self, capacidade):
+        # o Bloom é dimensionado para `capacidade` impressões; se o disco passar disso, ele é refeito
+        self.capacidade = capacidade
+        self.bloom = FiltroBloom.para(capacidade, self.falsos_positivos)
+        for despejada in self.despejadas:
+            for ini in range(0, len(despejada), 1 << 20):
+                self.bloom.adiciona(np.asarray(despejada[ini:ini + (1 << 20)]))
+
+    def impressoes(self, lote):
+        chaves = lote if self.colunas is None else lote[self.colunas]
+        return pd.util.hash_pandas_object(chaves, index=False).to_numpy()
+
+    def _vistas(self, impressoes):
+        vistas = np.zeros(len(impressoes), dtype=bool)
+        for execucao in self.execucoes:
+            vistas |= _contidos(execucao, impressoes)
+        if self.despejadas:
+            # o disco só é consultado quando o Bloom não descarta a impressão
+            candidatas = np.flatnonzero(~vistas & self.bloom.contem(impressoes))
+            for despejada in self.despejadas:
+                vistas[candidatas] |= _contidos(despejada, impressoes[candidatas])
+        return vistas
+
+    def _guarda(self, impressoes):
+        execucao = np.sort(impressoes)
+        while self.execucoes and len(self.execucoes[-1]) <= len(execucao):
+            execucao = np.sort(np.concatenate([self.execucoes.pop(), execucao]), kind='stable')
+        self.execucoes.append(execucao)
+        if self.pasta is not None and sum(len(e) for e in self.execucoes) > self.limite:
+            self.despeja()
+
+    def _novo_arquivo(self):
+        caminho = os.path.join(self.pasta, f'vistos_{self._proximo:06d}.npy')
+        self._proximo += 1
+        return caminho
+
+    def despeja(self):
+        # grava as impressões em memória como uma nova execução ordenada no disco
+        if self.pasta is None or not self.execucoes:
+            return
+        todas = np.sort(np.concatenate(self.execucoes), kind='stable')
+        caminho = self._novo_arquivo()
+        np.save(caminho, todas)
+        self.execucoes = []
+        self.despejadas.append(np.load(caminho, mmap_mode='r'))
+        self._arquivos.append(caminho)
+        # como na memória, arquivos de tamanhos parecidos são fundidos: ficam O(log n) arquivos
+        while len(self.despejadas) > 1 and len(self.despejadas[-2]) <= 2 * len(self.despejadas[-1]):
+            caminho = self._novo_arquivo()
+            temporario = caminho + '.parcial'
+            _funde_no_disco(self.despejadas[-2], self.despejadas[-1], temporario)
+            os.replace(temporario, caminho)
+            antigos = self._arquivos[-2:]
+            del self.despejadas[-2:], self._arquivos[-2:]
+            for antigo in antigos:
+                os.remove(antigo)
+            self.despejadas.append(np.load(caminho, mmap_mode='r'))
+            self._arquivos.append(caminho)
+        if self._despejados() > self.capacidade:
+            self._refaz_bloom(max(2 * self.capacidade, self._despejados()))
+        else:
+            self.bloom.adiciona(todas)
+
+    def novas(self, lote):
+        # máscara das linhas ainda não vistas (nem no histórico, nem antes no próprio lote)
+        impressoes = self.impressoes(lote)
+        novas = ~pd.Series(impressoes).duplicated().to_numpy()
+        novas[novas] = ~self._vistas(impressoes[novas])
+        self._guarda(impressoes[novas])
+        return novas
+
+    def filtra(self, lote):
+        return lote[self.novas(lote)]
+
+    def __len__(self):
+        return sum(len(e) for e in self.execucoes) + self._despejados()
+
+
+# In[ ]:
+
+
+Deduplicador(['letters']).filtra(example6)
+
+
+# In[ ]:
+
+
+import tempfile
+
+pd.testing.assert_frame_equal(example6.drop_duplicates(), Deduplicador().filtra(example6))
+pd.testing.assert_frame_equal(example6.drop_duplicates(['letters']), Deduplicador(['letters']).filtra(example6))
+assert (Deduplicador().novas(example6) == ~example6.duplicated()).all()
+
+# o histórico vale entre lotes, em memória ou despejado no disco
+rng = np.random.default_rng(0)
+lotes = [pd.DataFrame({'a': rng.integers(0, 5000, 2000), 'b': rng.integers(0, 3, 2000)}) for _ in range(30)]
+with tempfile.TemporaryDirectory() as pasta:
+    for deduplicador in [Deduplicador(), Deduplicador(pasta=pasta, limite=500)]:
+        saida = pd.concat([deduplicador.filtra(lote) for lote in lotes])
+        pd.testing.assert_frame_equal(pd.concat(lotes).drop_duplicates(), saida)
+
+    # os arquivos despejados são fundidos: poucos arquivos, todos ordenados e sem repetições
+    assert 1 <= len(deduplicador.despejadas) <= math.log2(len(saida) / 500) + 2
+    assert len(glob.glob(os.path.join(pasta, '*'))) == len(deduplicador.despejadas)
+    for despejada in deduplicador.despejadas:
+        assert (despejada[1:] > despejada[:-1]).all()
+
+    # o Bloom acompanha o tamanho do histórico: poucos falsos positivos para impressões novas
+    desconhecidas = rng.integers(0, np.iinfo(np.int64).max, 100_000, dtype=np.int64).astype(np.uint64)
+    assert deduplicador.bloom.contem(desconhecidas).mean() < 2 * deduplicador.falsos_positivos
+
+    # reabrindo a pasta, nada do que foi visto volta como novo
+    deduplicador.despeja()
+    reaberto = Deduplicador(pasta=pasta)
+    assert len(reaberto) == len(saida)
+    assert reaberto.filtra(pd.concat(lotes)).empty
+    # os arquivos lidos por mmap são fechados antes de a pasta ser apagada
+    del deduplicador, reaberto, despejada
+
+
 # In[25]:
 
 
@@ -413,6 +648,149 @@ df6
 pd.merge(df1, df6, left_on="employee", right_on="name")
 
 
+# #### Reaproveitando a tabela de hash
+# A cada chamada, o `merge` monta uma tabela de hash com a chave de um dos lados. Quando a mesma tabela de dimensão (grupo → supervisor, funcionário → salário) é juntada com muitos lotes de dados, podemos montar esse índice uma única vez. Abaixo, `IndiceJuncao` guarda, para cada chave da tabela da direita, as linhas em que ela aparece. A função `junta` só consulta esse índice, o que serve para junções um para um, muitos para um e muitos para muitos. Se a tabela da direita já estiver ordenada pela chave, `ordenado=True` troca o hash por busca binária (sort-merge). Como no `merge`, chaves faltantes (`NaN`, `None`) casam entre si: elas formam um grupo próprio no índice.
+
+# In[ ]:
+
+
+class IndiceJuncao:
+
+    def __init__(self, direita, chave, ordenado=False):
+        # lado de construção da junção: montado uma vez e reaproveitado por vários lotes
+        self.direita = direita
+        self.chave = chave
+        self.ordenado = ordenado
+        valores = direita[chave].to_numpy()
+        # como no merge, chaves faltantes (NaN, None) casam entre si
+        faltantes = pd.isna(valores)
+        if ordenado:
+            # modo sort-merge: a tabela já vem ordenada pela chave e a busca é binária;
+            # os faltantes ficam no fim, como no sort_values
+            self.presentes = len(valores) - np.count_nonzero(faltantes)
+            valores = valores[:self.presentes]
+            if faltantes[:self.presentes].any() or (len(valores) > 1 and not (valores[1:] >= valores[:-1]).all()):
+                raise ValueError(f'a coluna {chave!r} não está ordenada')
+            self.valores = valores
+            self.unica = ((len(valores) < 2 or bool((valores[1:] != valores[:-1]).all()))
+                          and len(direita) - self.presentes <= 1)
+            return
+        codigos, unicos = pd.factorize(valores)
+        self.unicos = pd.Index(unicos)
+        # os faltantes formam um grupo a mais, logo depois das chaves presentes
+        codigos[faltantes] = len(unicos)
+        contagens = np.bincount(codigos, minlength=len(unicos) + 1)
+        # a posição extra no fim atende o código -1 (chave ausente) com contagem zero
+        self.contagens = np.append(contagens, 0)
+        self.inicios = np.append(np.cumsum(contagens) - contagens, 0)
+        self.ordem = np.argsort(codigos, kind='stable')
+        self.unica = bool((contagens <= 1).all())
+
+    def sonda(self, chaves):
+        # para cada chave, as linhas da direita com a mesma chave (em formato CSR)
+        chaves = np.asarray(chaves)
+        faltantes = pd.isna(chaves)
+        if self.ordenado:
+            inicios = np.full(len(chaves), self.presentes)
+            contagens = np.full(len(chaves), len(self.direita) - self.presentes)
+            presentes = chaves[~faltantes]
+            inicios[~faltantes] = np.searchsorted(self.valores, presentes, 'left')
+            contagens[~faltantes] = np.searchsorted(self.valores, presentes, 'right') - inicios[~faltantes]
+        else:
+            codigos = self.unicos.get_indexer(chaves)
+            codigos[faltantes] = len(self.unicos)
+            inicios, contagens = self.inicios[codigos], self.contagens[codigos]
+        esquerda = np.repeat(np.arange(len(chaves)), contagens)
+        deslocamentos = np.arange(len(esquerda)) - np.repeat(np.cumsum(contagens) - contagens, contagens)
+        direita = np.repeat(inicios, contagens) + deslocamentos
+        if not self.ordenado:
+            direita = self.ordem[direita]
+        return esquerda, direita, contagens
+
+    def __repr__(self):
+        modo = 'ordenado' if self.ordenado else 'hash'
+        return f'IndiceJuncao({self.chave!r}, {len(self.direita)} linhas, {modo})'
+
+
+def _pega(coluna, posicoes, preenche):
+    valores = coluna.to_numpy() if isinstance(coluna.dtype, np.dtype) else coluna.array
+    return pd.api.extensions.take(valores, posicoes, allow_fill=preenche)
+
+
+def junta(esquerda, indice, on=None, left_on=None, how='inner', suffixes=('_x', '_y'), validate=None):
+    if how not in ('inner', 'left'):
+        raise ValueError(f'tipo de junção não suportado: {how!r}')
+    chave = left_on or on or indice.chave
+    if validate in ('1:1', 'one_to_one', 'm:1', 'many_to_one') and not indice.unica:
+        raise pd.errors.MergeError(f'a chave {indice.chave!r} se repete na tabela da direita')
+    if validate in ('1:1', 'one_to_one') and esquerda[chave].duplicated().any():
+        raise pd.errors.MergeError(f'a chave {chave!r} se repete na tabela da esquerda')
+
+    linhas_esquerda, linhas_direita, contagens = indice.sonda(esquerda[chave].to_numpy())
+    if how == 'left':
+        # linhas sem par entram uma vez, com -1 (faltante) do lado direito
+        sem_par = np.flatnonzero(contagens == 0)
+        linhas_esquerda = np.concatenate([linhas_esquerda, sem_par])
+        linhas_direita = np.concatenate([linhas_direita, np.full(len(sem_par), -1)])
+        ordem = np.argsort(linhas_esquerda, kind='stable')
+        linhas_esquerda, linhas_direita = linhas_esquerda[ordem], linhas_direita[ordem]
+
+    # como no merge: com a mesma chave dos dois lados, ela aparece uma vez só
+    direita = [nome for nome in indice.direita.columns if not (nome == indice.chave == chave)]
+    comuns = set(esquerda.columns) & set(direita)
+    dados = {}
+    for nome in esquerda.columns:
+        dados[nome + suffixes[0] if nome in comuns else nome] = _pega(esquerda[nome], linhas_esquerda, False)
+    for nome in direita:
+        dados[nome + suffixes[1] if nome in comuns else nome] = _pega(indice.direita[nome], linhas_direita, how == 'left')
+    return pd.DataFrame(dados)
+
+
+# In[ ]:
+
+
+supervisores = IndiceJuncao(df4, 'group')
+for lote in [df3.iloc[:2], df3.iloc[2:]]:
+    print(junta(lote, supervisores, validate='m:1'))
+
+
+# In[ ]:
+
+
+pd.testing.assert_frame_equal(pd.merge(df1, df2), junta(df1, IndiceJuncao(df2, 'employee'), validate='1:1'))
+pd.testing.assert_frame_equal(pd.merge(df3, df4, on='group'), junta(df3, supervisores, on='group'))
+pd.testing.assert_frame_equal(pd.merge(df1, df5, on='group'), junta(df1, IndiceJuncao(df5, 'group')))
+pd.testing.assert_frame_equal(pd.merge(df1, df6, left_on='employee', right_on='name'),
+                              junta(df1, IndiceJuncao(df6, 'name'), left_on='employee'))
+
+# sort-merge: a direita já ordenada pela chave
+habilidades = IndiceJuncao(df5.sort_values('group', kind='stable'), 'group', ordenado=True)
+pd.testing.assert_frame_equal(pd.merge(df1, df5.sort_values('group', kind='stable'), on='group'),
+                              junta(df1, habilidades))
+
+# left join e colunas repetidas
+novos = pd.DataFrame({'employee': ['Ana', 'Gary'], 'salary': [1, 2]})
+pd.testing.assert_frame_equal(pd.merge(novos, df6, how='left', left_on='employee', right_on='name'),
+                              junta(novos, IndiceJuncao(df6, 'name'), left_on='employee', how='left'))
+
+try:
+    junta(df1, IndiceJuncao(df5, 'group'), validate='m:1')
+    assert False
+except pd.errors.MergeError:
+    pass
+
+# chaves faltantes casam entre si, como no merge
+pedidos = pd.DataFrame({'cliente': ['a', np.nan, None, 'b', 'c'], 'valor': [1, 2, 3, 4, 5]})
+clientes = pd.DataFrame({'cliente': [np.nan, 'a', 'b', np.nan], 'cidade': ['X', 'Y', 'Z', 'W']})
+ordenados = clientes.sort_values('cliente', kind='stable', ignore_index=True)
+for direita, ordenado in [(clientes, False), (ordenados, True)]:
+    indice = IndiceJuncao(direita, 'cliente', ordenado=ordenado)
+    for how in ['inner', 'left']:
+        pd.testing.assert_frame_equal(pd.merge(pedidos, direita, on='cliente', how=how),
+                                      junta(pedidos, indice, how=how))
+    assert not indice.unica
+
+
 # ### Concatenação em NumPy
 # A concatenação em pandas é construída a partir da funcionalidade de concatenação para matrizes NumPy. Esta é a aparência da concatenação NumPy:
 #  - Para matrizes unidimensionais:
@@ -536,6 +914,114 @@ pd.concat([df10, df11], join_axes=[df10.columns])
 df9.append(df9)
 
 
+# Tanto o `append` quanto o `pd.concat` copiam todas as linhas já existentes a cada chamada. Anexar lotes em um laço, `tabela = pd.concat([tabela, lote])`, custa portanto O(n²). O `ConstrutorTabela` abaixo guarda cada coluna em um vetor NumPy com folga. Quando a folga acaba, a capacidade é multiplicada por `fator`, então cada linha é copiada poucas vezes e o custo total fica linear. O `DataFrame` só é montado no `finaliza`, apontando para os próprios vetores, sem cópia.
+
+# In[ ]:
+
+
+class ConstrutorTabela:
+
+    def __init__(self, capacidade=1024, fator=2, preserva_indice=False):
+        self.capacidade = capacidade
+        self.fator = fator
+        self.preserva_indice = preserva_indice
+        self.n = 0
+        self.nomes = None
+        self.buffers = {}
+
+    def _reserva(self, extra):
+        # crescimento geométrico: cada linha é copiada O(1) vezes em média
+        necessario = self.n + extra
+        if necessario <= self.capacidade and self.buffers:
+            return
+        while self.capacidade < necessario:
+            self.capacidade *= self.fator
+        for nome, buffer in self.buffers.items():
+            novo = np.empty(self.capacidade, dtype=buffer.dtype)
+            novo[:self.n] = buffer[:self.n]
+            self.buffers[nome] = novo
+
+    def _guarda(self, nome, valores):
+        buffer = self.buffers.get(nome)
+        if buffer is None:
+            buffer = self.buffers[nome] = np.empty(self.capacidade, dtype=valores.dtype)
+        tipo = np.result_type(buffer.dtype, valores.dtype)
+        if tipo != buffer.dtype:
+            # um lote com tipo mais largo (int -> float, por exemplo) promove a coluna inteira
+            buffer = self.buffers[nome] = buffer.astype(tipo)
+        buffer[self.n:self.n + len(valores)] = valores
+
+    def anexa(self, lote):
+        # o lote pode ser um DataFrame ou, mais barato, um dicionário nome -> vetor
+        if isinstance(lote, pd.DataFrame):
+            nomes = list(lote.columns)
+            valores = [lote[nome].to_numpy() for nome in nomes]
+            indice = lote.index.to_numpy()
+        else:
+            nomes = list(lote)
+            valores = [np.asarray(lote[nome]) for nome in nomes]
+            indice = None
+        if self.nomes is None:
+            self.nomes = nomes
+        elif nomes != self.nomes:
+            raise ValueError(f'colunas do lote {nomes} diferem das da tabela {self.nomes}')
+        tamanho = len(valores[0]) if valores else 0
+        if any(len(coluna) != tamanho for coluna in valores):
+            raise ValueError('as colunas do lote têm tamanhos diferentes')
+        self._reserva(tamanho)
+        for nome, coluna in zip(nomes, valores):
+            self._guarda(nome, coluna)
+        if self.preserva_indice:
+            self._guarda(None, np.arange(self.n, self.n + tamanho) if indice is None else indice)
+        self.n += tamanho
+        return self
+
+    def finaliza(self):
+        # os DataFrames apontam para os próprios buffers: nada é copiado
+        if self.nomes is None:
+            return pd.DataFrame()
+        dados = {nome: self.buffers[nome][:self.n] for nome in self.nomes}
+        indice = pd.Index(self.buffers[None][:self.n]) if self.preserva_indice else None
+        return pd.DataFrame(dados, index=indice, copy=False)
+
+    def __len__(self):
+        return self.n
+
+
+# In[ ]:
+
+
+construtor = ConstrutorTabela(capacidade=2)
+for lote in [df9, df9, {'A': ['x'], 'B': ['y']}]:
+    construtor.anexa(lote)
+construtor.finaliza()
+
+
+# In[ ]:
+
+
+from numpy.testing import assert_array_almost_equal
+
+pd.testing.assert_frame_equal(pd.concat([df9, df9, pd.DataFrame({'A': ['x'], 'B': ['y']})], ignore_index=True),
+                              construtor.finaliza())
+assert np.shares_memory(construtor.finaliza()['A'].to_numpy(), construtor.buffers['A'])
+
+com_indice = ConstrutorTabela(preserva_indice=True).anexa(df9).anexa(df9)
+pd.testing.assert_frame_equal(pd.concat([df9, df9]), com_indice.finaliza())
+
+lotes = [{'x': np.arange(i, i + 3), 'y': np.full(3, 0.5)} for i in range(0, 3000, 3)]
+construtor = ConstrutorTabela()
+for lote in lotes:
+    construtor.anexa(lote)
+pd.testing.assert_frame_equal(pd.concat([pd.DataFrame(lote) for lote in lotes], ignore_index=True),
+                              construtor.finaliza())
+assert construtor.capacidade < 2 * len(construtor)
+
+# um lote com tipo mais largo promove a coluna
+promovida = ConstrutorTabela().anexa({'x': [1, 2]}).anexa({'x': [1.5]}).finaliza()
+assert_array_almost_equal([1, 2, 1.5], promovida['x'])
+
+
 # ** Ponto importante **: Ao contrário dos métodos `append ()` e `extend ()` das listas Python, o método `append ()` no pandas não modifica o objeto original. Em vez disso, ele cria um novo objeto com os dados combinados.
 # 
 # &gt; ** Conclusão: ** uma grande parte do valor que você pode fornecer como cientista de dados vem da conexão de vários conjuntos de dados, muitas vezes díspares, para encontrar novos insights. Aprender como juntar e mesclar dados é, portanto, uma parte essencial do seu conjunto de habilidades.
@@ -646,11 +1132,193 @@ df.groupby(['MEDV'])['AGE'].mean()
 
 
 # Você também pode aplicar uma função lambda a cada elemento de uma coluna `DataFrame` usando o método `apply`. Por exemplo, digamos que você queira criar uma nova coluna que sinalize uma linha se mais de 50 por cento das casas ocupadas pelo proprietário forem construídas antes de 1940:
+# 
+# O `apply` chama a função Python uma vez por linha, o que fica lento quando há muitas linhas e dezenas de colunas derivadas. A classe `Derivadas` recebe as colunas derivadas como expressões: limiares (`AGE > 50`), faixas (`faixa(RM, [4, 5, 6, 7, 8])`, como o `pd.cut`), aritmética e combinações com `and`, `or` e `not`. Cada expressão é compilada uma vez com `ast` para operações vetorizadas do NumPy, e uma derivada pode usar as anteriores (usar uma definida depois, ou a própria, é um `ValueError`). O cálculo percorre as colunas-fonte em blocos, uma única vez, e avalia todas as derivadas em cada bloco enquanto ele ainda está no cache. O resultado fica guardado junto com o carimbo de versão das colunas de que depende (`versoes.py`), e só é recalculado quando alguma delas muda. Conferir o carimbo não percorre os dados, então um acerto no cache sai bem mais barato que recalcular. Escritas no lugar, como `df.loc[...] = ...`, não trocam o vetor da coluna e devem ser marcadas com `marca_escrita(df, colunas)`.
+
+# In[ ]:
+
+
+import ast
+import weakref
+
+from versoes import carimbo, marca_escrita, vale
+
+
+def _faixa(valores, bordas):
+    # como pd.cut(valores, bordas, labels=False): intervalos (a, b], -1 fora das bordas
+    bordas = np.asarray(bordas)
+    codigos = np.searchsorted(bordas, valores, side='left') - 1
+    codigos[~((valores > bordas[0]) & (valores <= bordas[-1]))] = -1
+    return codigos
+
+
+FUNCOES_DERIVADAS = {'abs': np.abs, 'log': np.log, 'sqrt': np.sqrt, 'onde': np.where,
+                     'isnan': np.isnan, 'faixa': _faixa}
+
+_NOS_PERMITIDOS = (ast.Expression, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare, ast.Call, ast.Name,
+                   ast.Constant, ast.List, ast.Tuple, ast.Load, ast.boolop, ast.operator, ast.unaryop, ast.cmpop)
+
+
+class _Vetoriza(ast.NodeTransformer):
+    # and/or/not e comparações encadeadas viram &, | e ~, que valem elemento a elemento
+
+    def visit_BoolOp(self, no):
+        self.generic_visit(no)
+        operador = ast.BitAnd() if isinstance(no.op, ast.And) else ast.BitOr()
+        resultado = no.values[0]
+        for valor in no.values[1:]:
+            resultado = ast.BinOp(resultado, operador, valor)
+        return resultado
+
+    def visit_UnaryOp(self, no):
+        self.generic_visit(no)
+        if isinstance(no.op, ast.Not):
+            return ast.UnaryOp(ast.Invert(), no.operand)
+        return no
+
+    def visit_Compare(self, no):
+        self.generic_visit(no)
+        esquerda, resultado = no.left, None
+        for operador, direita in zip(no.ops, no.comparators):
+            comparacao = ast.Compare(esquerda, [operador], [direita])
+            resultado = comparacao if resultado is None else ast.BinOp(resultado, ast.BitAnd(), comparacao)
+            esquerda = direita
+        return resultado
+
+
+class Derivadas:
+
+    def __init__(self, definicoes, tamanho_bloco=1 << 16):
+        self.definicoes = dict(definicoes)
+        self.tamanho_bloco = tamanho_bloco
+        self.codigos, self.fontes = {}, {}
+        for nome, expressao in self.definicoes.items():
+            arvore = ast.parse(expressao, mode='eval')
+            for no in ast.walk(arvore):
+                if not isinstance(no, _NOS_PERMITIDOS):
+                    raise ValueError(f'{nome}: construção não suportada: {type(no).__name__}')
+                if isinstance(no, ast.Call) and not (isinstance(no.func, ast.Name) and no.func.id in FUNCOES_DERIVADAS):
+                    raise ValueError(f'{nome}: função não suportada: {ast.unparse(no.func)}')
+            arvore = ast.fix_missing_locations(_Vetoriza().visit(arvore))
+            self.codigos[nome] = compile(arvore, f'<{nome}>', 'eval')
+            # colunas do DataFrame de que a derivada depende, passando pelas derivadas anteriores
+            fontes = set()
+            for no in ast.walk(arvore):
+                if isinstance(no, ast.Name) and no.id not in FUNCOES_DERIVADAS:
+                    if no.id in self.definicoes and no.id not in self.fontes:
+                        # a própria derivada ou uma definida depois: ainda não há valores para ela
+                        raise ValueError(f'{nome}: {no.id!r} precisa ser definida antes de {nome!r}')
+                    fontes |= self.fontes.get(no.id, {no.id})
+            self.fontes[nome] = fontes
+
+    def _desatualizadas(self, df):
+        # conferir o carimbo das colunas-fonte não percorre os dados
+        desatualizadas, carimbos = [], {}
+        for nome, expressao in self.definicoes.items():
+            guardada = _DERIVADAS_CALCULADAS.get((id(df), nome, expressao))
+            if guardada is None or not vale(guardada[0], df):
+                desatualizadas.append(nome)
+                carimbos[nome] = carimbo(df, sorted(self.fontes[nome]))
+        return desatualizadas, carimbos
+
+    def calcula(self, df):
+        desatualizadas, carimbos = self._desatualizadas(df)
+        if desatualizadas:
+            # uma única passada em blocos: cada bloco das colunas-fonte é lido uma vez
+            # e todas as derivadas desatualizadas são calculadas enquanto ele está no cache
+            fontes = sorted(set().union(*(self.fontes[nome] for nome in desatualizadas)) - set(self.definicoes))
+            colunas = {coluna: df[coluna].to_numpy() for coluna in fontes}
+            saidas = {}
+            for inicio in range(0, max(len(df), 1), self.tamanho_bloco):
+                fim = min(inicio + self.tamanho_bloco, len(df))
+                nomes = dict(FUNCOES_DERIVADAS)
+                nomes.update({coluna: valores[inicio:fim] for coluna, valores in colunas.items()})
+                for nome in self.definicoes:
+                    if nome not in desatualizadas:
+                        nomes[nome] = _DERIVADAS_CALCULADAS[(id(df), nome, self.definicoes[nome])][1][inicio:fim]
+                        continue
+                    bloco = np.broadcast_to(eval(self.codigos[nome], {'__builtins__': {}}, nomes), (fim - inicio,))
+                    nomes[nome] = bloco
+                    if nome not in saidas:
+                        saidas[nome] = np.empty(len(df), dtype=bloco.dtype)
+                    elif not np.can_cast(bloco.dtype, saidas[nome].dtype, 'same_kind'):
+                        saidas[nome] = saidas[nome].astype(np.result_type(saidas[nome], bloco))
+                    saidas[nome][inicio:fim] = bloco
+            for nome, valores in saidas.items():
+                chave = (id(df), nome, self.definicoes[nome])
+                if chave not in _DERIVADAS_CALCULADAS:
+                    weakref.finalize(df, _DERIVADAS_CALCULADAS.pop, chave, None)
+                _DERIVADAS_CALCULADAS[chave] = (carimbos[nome], valores)
+        return {nome: _DERIVADAS_CALCULADAS[(id(df), nome, expressao)][1]
+                for nome, expressao in self.definicoes.items()}
+
+    def aplica(self, df, inplace=False):
+        calculadas = self.calcula(df)
+        if not inplace:
+            return df.assign(**calculadas)
+        for nome, valores in calculadas.items():
+            df[nome] = valores
+        return df
+
+
+_DERIVADAS_CALCULADAS = {}
+
 
 # In[59]:
 
 
-df['AGE_50'] = df['AGE'].apply(lambda x: x>50)
+derivadas = Derivadas({'AGE_50': 'AGE > 50'})
+derivadas.aplica(df, inplace=True)
+
+
+# In[ ]:
+
+
+pd.testing.assert_series_equal(df['AGE'].apply(lambda x: x>50), df['AGE_50'], check_names=False)
+
+mais = Derivadas({'AGE_50': 'AGE > 50',
+                  'VELHA_POLUIDA': 'AGE_50 and NOX > 0.6',
+                  'MEIA_IDADE': '30 <= AGE < 60',
+                  'NOVA': 'not AGE_50',
+                  'RM_FAIXA': 'faixa(RM, [4, 5, 6, 7, 8])',
+                  'IMPOSTO_POR_QUARTO': 'TAX / RM'}, tamanho_bloco=100)
+calculadas = mais.calcula(df)
+assert (calculadas['VELHA_POLUIDA'] == ((df['AGE'] > 50) & (df['NOX'] > 0.6))).all()
+assert (calculadas['MEIA_IDADE'] == ((df['AGE'] >= 30) & (df['AGE'] < 60))).all()
+assert (calculadas['NOVA'] == (df['AGE'] <= 50)).all()
+assert (calculadas['RM_FAIXA'] == pd.cut(df['RM'], [4, 5, 6, 7, 8], labels=False).fillna(-1)).all()
+assert np.allclose(calculadas['IMPOSTO_POR_QUARTO'], df['TAX'] / df['RM'])
+
+# sem mudanças nas fontes, nada é recalculado; mudando NOX, o resultado acompanha
+assert all(mais.calcula(df)[nome] is valores for nome, valores in calculadas.items())
+copia = df.copy()
+copia['NOX'] = copia['NOX'] / 2
+antes = mais.calcula(copia)
+assert (antes['VELHA_POLUIDA'] == ((copia['AGE'] > 50) & (copia['NOX'] > 0.6))).all()
+# escritas no lugar não trocam o vetor: marcadas com `marca_escrita`, refazem só as derivadas de AGE
+copia.loc[0:200, 'AGE'] = 0
+marca_escrita(copia, ['AGE'])
+recalculadas = mais.calcula(copia)
+assert (recalculadas['NOVA'] == (copia['AGE'] <= 50)).all()
+assert (recalculadas['VELHA_POLUIDA'] == ((copia['AGE'] > 50) & (copia['NOX'] > 0.6))).all()
+assert recalculadas['RM_FAIXA'] is antes['RM_FAIXA'] and recalculadas['NOVA'] is not antes['NOVA']
+
+# uma derivada só pode usar as que vêm antes dela
+for definicoes in [{'B': 'A and AGE > 3', 'A': 'AGE > 50'}, {'A': 'A + 1'}]:
+    try:
+        Derivadas(definicoes)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError(definicoes)
+
+for proibida in ['__import__("os")', 'AGE.values', 'len(AGE)']:
+    try:
+        Derivadas({'x': proibida})
+    except ValueError:
+        pass
+    else:
+        raise AssertionError(proibida)
 
 
 # Depois de aplicado, você também verá quantos valores retornaram verdadeiros e quantos falsos usando o método `value_counts`:
@@ -669,6 +1337,36 @@ df['AGE_50'].value_counts()
 df.groupby(['AGE_50'])['MEDV'].mean()
 
 
+# O `groupby` é genérico: ele monta uma tabela hash com as chaves e calcula a agregação pedida. Quando só precisamos de contagem, soma ou média de uma coluna, podemos fazer tudo com `np.bincount`. Se as chaves são inteiros pequenos e densos (como `RAD`, um índice de 1 a 24), a própria chave é usada como posição de um vetor, sem hash e sem ordenação. Caso contrário (como `AGE`, que é `float`), as chaves são codificadas com `pd.factorize` antes do `bincount`. As funções `agrupa` e `agrupa_coluna`, do módulo `agrupamento.py`, retornam `count`, `sum` e `mean` de uma vez.
+
+# In[ ]:
+
+
+from agrupamento import agrupa, agrupa_coluna
+
+
+# In[ ]:
+
+
+agrupa_coluna(df, 'AGE_50', 'MEDV')['mean']
+
+
+# In[ ]:
+
+
+# RAD é float no DataFrame; como inteiro, a chave vira posição de vetor (sem factorize)
+agrupa(df['RAD'].astype(int).to_numpy(), df['MEDV'].to_numpy(), nome_chave='RAD')
+
+
+# In[ ]:
+
+
+assert_array_almost_equal(df.groupby(['AGE'])['MEDV'].mean(), agrupa_coluna(df, 'AGE', 'MEDV')['mean'])
+assert_array_almost_equal(df.groupby(['MEDV'])['AGE'].mean(), agrupa_coluna(df, 'MEDV', 'AGE')['mean'])
+assert_array_almost_equal(df.groupby(['RAD'])['MEDV'].mean(),
+                          agrupa(df['RAD'].astype(int).to_numpy(), df['MEDV'].to_numpy())['mean'])
+
+
 # Você também pode agrupar por mais de uma variável, como AGE_50 (aquela que você acabou de criar), CHAS (se uma cidade está no rio Charles) e RAD (um índice que mede o acesso às rodovias radiais da área de Boston) e, em seguida, avalie cada grupo para o preço médio médio de uma casa nesse grupo:
 
 # In[62]:
@@ -695,6 +1393,39 @@ groupby_twovar
 groupby_twovar.unstack()
 
 
+# Com várias chaves, o `groupby` monta um `MultiIndex` para o formato alto, e o `unstack` depois o desfaz para chegar ao formato largo. A função `agrupa_chaves`, também do módulo `agrupamento.py`, estende a `agrupa` para várias chaves e devolve um `Agrupamento`. Cada coluna-chave é codificada uma única vez, como na `agrupa`. Os códigos são combinados em um só inteiro em base mista com `np.ravel_multi_index`, e contagem e soma saem de dois `np.bincount`. Quando as chaves têm poucos valores, o resultado já é um vetor N-D com um eixo por chave (`matriz`), e o `pivo` é só um `reshape` dele. Se o número de combinações possíveis é grande demais para isso, apenas as combinações presentes ganham uma posição.
+
+# In[ ]:
+
+
+from agrupamento import agrupa_chaves
+
+
+# In[ ]:
+
+
+agrupamento = agrupa_chaves(df, ['AGE_50', 'RAD', 'CHAS'], 'MEDV')
+agrupamento.pivo()
+
+
+# In[ ]:
+
+
+pd.testing.assert_series_equal(groupby_twovar, agrupamento.serie(), check_names=False)
+pd.testing.assert_frame_equal(groupby_twovar.unstack(), agrupamento.pivo())
+pd.testing.assert_frame_equal(groupby_twovar.unstack(0), agrupamento.pivo(eixo=0))
+assert agrupamento.matriz().shape == (2, df['RAD'].nunique(), 2)
+assert agrupamento.matriz('count').sum() == len(df)
+
+# chaves inteiras densas e combinações esparsas
+com_rad_int = df.assign(RAD=df['RAD'].astype(int))
+pd.testing.assert_series_equal(com_rad_int.groupby(['RAD', 'CHAS'])['MEDV'].sum(),
+                               agrupa_chaves(com_rad_int, ['RAD', 'CHAS'], 'MEDV').serie('sum'), check_names=False)
+esparso = agrupa_chaves(df, ['ZN', 'INDUS', 'DIS'], 'DIS')
+assert esparso.grupos is not None
+pd.testing.assert_series_equal(df.groupby(['ZN', 'INDUS', 'DIS'])['DIS'].mean(), esparso.serie(), check_names=False)
+
+
 # ### Exercício 3:
 
 # In[65]:
@@ -751,14 +1482,260 @@ df['CHAS'].value_counts().plot(kind='bar')
 df.corr(method='pearson')
 
 
+# O `corr` do pandas percorre cada par de colunas separadamente. Com milhares de colunas, isso domina o tempo da análise, e o notebook ainda chama `corr` mais de uma vez sobre o mesmo `DataFrame`. A classe `Correlacao` guarda as estatísticas suficientes da correlação de Pearson: contagens, somas, somas de quadrados e produtos cruzados. Com elas, a matriz inteira sai de um único produto `X.T @ X`, que o BLAS já executa em paralelo. As linhas são processadas em blocos de `tamanho_bloco`, e cada novo lote só soma às estatísticas com `atualiza`. Quando há `NaN`, uma máscara de presença entra nos produtos e cada par usa só as linhas em que as duas colunas existem, como no `corr`. A função `correlacao` guarda o resultado por `DataFrame` junto de um carimbo de versão das colunas (`versoes.py`) e só recalcula se alguma delas mudar. Conferir o carimbo não percorre os dados: ele compara o vetor de cada coluna por identidade e um contador de escritas no lugar. Escritas como `df.loc[...] = ...` não trocam o vetor, então devem ser marcadas com `marca_escrita(df, colunas)`.
+
+# In[ ]:
+
+
+class Correlacao:
+
+    def __init__(self, colunas, tamanho_bloco=1 << 16):
+        self.colunas = list(colunas)
+        self.tamanho_bloco = tamanho_bloco
+        p = len(self.colunas)
+        self.deslocamento = None
+        # estatísticas suficientes, todas somáveis entre lotes
+        self.contagens = np.zeros((p, p))
+        self.somas = np.zeros((p, p))
+        self.quadrados = np.zeros((p, p))
+        self.produtos = np.zeros((p, p))
+        self._matriz = None
+
+    @classmethod
+    def de(cls, df, colunas=None, **kwargs):
+        if colunas is None:
+            colunas = df.select_dtypes(include=['number', 'bool']).columns
+        return cls(colunas, **kwargs).atualiza(df)
+
+    def atualiza(self, lote):
+        # as colunas viram uma matriz uma única vez; cada bloco é só uma fatia dela
+        x = lote[self.colunas].to_numpy(dtype=np.float64)
+        for inicio in range(0, len(x), self.tamanho_bloco):
+            self._acumula(x[inicio:inicio + self.tamanho_bloco])
+        self._matriz = None
+        return self
+
+    def _acumula(self, x):
+        if self.deslocamento is None:
+            # centrar em torno da média do primeiro bloco evita o cancelamento de Σx² − (Σx)²/n
+            validos = (~np.isnan(x)).sum(axis=0)
+            self.deslocamento = np.divide(np.nansum(x, axis=0), validos,
+                                          out=np.zeros(x.shape[1]), where=validos > 0)
+        x = x - self.deslocamento
+        faltantes = np.isnan(x)
+        if not faltantes.any():
+            self.contagens += len(x)
+            self.somas += x.sum(axis=0)[:, None]
+            self.quadrados += (x * x).sum(axis=0)[:, None]
+            self.produtos += x.T @ x
+            return
+        # NaN par a par: cada soma só conta as linhas em que as duas colunas existem
+        presentes = (~faltantes).astype(np.float64)
+        x[faltantes] = 0
+        self.contagens += presentes.T @ presentes
+        self.somas += x.T @ presentes
+        self.quadrados += (x * x).T @ presentes
+        self.produtos += x.T @ x
+
+    def _correlacoes(self, linhas):
+        n = self.contagens[linhas]
+        somas, somas_t = self.somas[linhas], self.somas[:, linhas].T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = self.produtos[linhas] - somas * somas_t / n
+            var = self.quadrados[linhas] - somas ** 2 / n
+            var_t = self.quadrados[:, linhas].T - somas_t ** 2 / n
+            r = cov / np.sqrt(var * var_t)
+        r[(n < 2) | (var <= 0) | (var_t <= 0)] = np.nan
+        return np.clip(r, -1, 1)
+
+    def matriz(self):
+        if self._matriz is None:
+            r = self._correlacoes(slice(None))
+            diagonal = np.diagonal(r).copy()
+            np.fill_diagonal(r, np.where(np.isnan(diagonal), np.nan, 1.0))
+            self._matriz = pd.DataFrame(r, index=self.colunas, columns=self.colunas)
+        return self._matriz
+
+    def mais_correlacionadas(self, alvo, k=5, absoluta=True):
+        # só a linha do alvo é calculada, e só os k maiores são ordenados
+        i = self.colunas.index(alvo)
+        r = self._correlacoes(i)
+        r[i] = np.nan
+        chave = np.abs(r) if absoluta else r.copy()
+        chave[np.isnan(chave)] = -np.inf
+        k = min(k, len(r) - 1)
+        melhores = np.argpartition(-chave, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.intp)
+        melhores = melhores[np.argsort(-chave[melhores], kind='stable')]
+        return pd.Series(r[melhores], index=[self.colunas[j] for j in melhores], name=alvo)
+
+
+_CORRELACOES = {}
+
+
+def _escolhe_colunas(df, colunas):
+    # retorna (colunas, carimbadas, nomes); sem colunas pedidas usamos as numéricas, e o
+    # carimbo cobre todas as colunas do DataFrame, pois trocar uma delas pode mudar a escolha
+    if colunas is None:
+        return list(df.select_dtypes(include=['number', 'bool']).columns), list(df.columns), df.columns
+    return list(colunas), list(colunas), None
+
+
+def _calculada_vale(calculada, df):
+    # uma coluna nova troca o objeto `df.columns`; o resto é o carimbo, sem olhar os dados
+    return (calculada[1] is None or calculada[1] is df.columns) and vale(calculada[0], df)
+
+
+def correlacao(df, colunas=None):
+    chave = (id(df), None if colunas is None else tuple(colunas))
+    calculada = _CORRELACOES.get(chave)
+    if chave not in _CORRELACOES:
+        weakref.finalize(df, _CORRELACOES.pop, chave, None)
+    if calculada is None or not _calculada_vale(calculada, df):
+        colunas, carimbadas, nomes = _escolhe_colunas(df, colunas)
+        calculada = _CORRELACOES[chave] = (carimbo(df, carimbadas), nomes, Correlacao.de(df, colunas))
+    return calculada[2]
+
+
+# In[ ]:
+
+
+correlacao(df).matriz()
+
+
+# In[ ]:
+
+
+pd.testing.assert_frame_equal(df.corr(method='pearson'), correlacao(df).matriz())
+assert correlacao(df) is correlacao(df)
+
+# escritas no lugar não trocam o vetor da coluna: marcadas, invalidam a correlação guardada
+editado = df.copy()
+antes = correlacao(editado)
+editado.loc[0:200, 'AGE'] = 0
+marca_escrita(editado, ['AGE'])
+assert correlacao(editado) is not antes
+pd.testing.assert_frame_equal(editado.corr(method='pearson'), correlacao(editado).matriz())
+
+# NaN par a par e atualização em lotes
+rng = np.random.default_rng(0)
+com_faltantes = df.select_dtypes(include=['number', 'bool']).astype(float)
+com_faltantes = com_faltantes.mask(rng.random(com_faltantes.shape) < 0.1)
+incremental = Correlacao(com_faltantes.columns, tamanho_bloco=64)
+for inicio in range(0, len(com_faltantes), 100):
+    incremental.atualiza(com_faltantes.iloc[inicio:inicio + 100])
+pd.testing.assert_frame_equal(com_faltantes.corr(), incremental.matriz())
+
+mais = incremental.mais_correlacionadas('MEDV', k=3)
+esperado = com_faltantes.corr()['MEDV'].drop('MEDV')
+pd.testing.assert_series_equal(esperado[esperado.abs().sort_values(ascending=False).index[:3]], mais)
+
+
 # Suponha que você queira apenas examinar as correlações entre todas as colunas e apenas uma variável. Vamos examinar apenas a correlação entre todas as outras variáveis ​​e a porcentagem de casas ocupadas pelos proprietários construídas antes de 1940 (AGE). Faremos isso acessando a coluna por número de índice:
+# 
+# Calcular a matriz inteira para usar só uma linha dela custa O(n·p²). A função `correlacoes_com` calcula apenas as correlações de cada coluna com os alvos pedidos, em O(n·p) por alvo. Vários alvos saem de um único produto de matrizes, e o resultado fica guardado enquanto o carimbo das colunas continuar valendo. Já `ranking` ordena pelo valor absoluto por padrão, e com `k` usa `np.argpartition` para ordenar só os `k` primeiros em vez da série inteira.
+
+
+# In[ ]:
+
+
+def _pearson_contra(x, y):
+    # correlações de cada coluna de x com cada coluna de y: O(n·p·t), sem a matriz p × p
+    presentes_x, presentes_y = ~np.isnan(x), ~np.isnan(y)
+    if presentes_x.all() and presentes_y.all():
+        x = x - x.mean(axis=0)
+        y = y - y.mean(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r = (x.T @ y) / np.sqrt(np.outer((x * x).sum(axis=0), (y * y).sum(axis=0)))
+        r[~np.isfinite(r)] = np.nan
+        return np.clip(r, -1, 1)
+    # NaN par a par, com as mesmas somas mascaradas da classe Correlacao
+    x = np.where(presentes_x, x - np.nanmean(x, axis=0), 0)
+    y = np.where(presentes_y, y - np.nanmean(y, axis=0), 0)
+    px, py = presentes_x.astype(np.float64), presentes_y.astype(np.float64)
+    n = px.T @ py
+    sx, sy = x.T @ py, px.T @ y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = x.T @ y - sx * sy / n
+        var_x = (x * x).T @ py - sx ** 2 / n
+        var_y = px.T @ (y * y) - sy ** 2 / n
+        r = cov / np.sqrt(var_x * var_y)
+    r[(n < 2) | (var_x <= 0) | (var_y <= 0)] = np.nan
+    return np.clip(r, -1, 1)
+
+
+_CORRELACOES_COM = {}
+
+
+def correlacoes_com(df, alvos, colunas=None):
+    unico = isinstance(alvos, str)
+    alvos = [alvos] if unico else list(alvos)
+    chave = (id(df), tuple(alvos), None if colunas is None else tuple(colunas))
+    calculada = _CORRELACOES_COM.get(chave)
+    if chave not in _CORRELACOES_COM:
+        weakref.finalize(df, _CORRELACOES_COM.pop, chave, None)
+    if calculada is None or not _calculada_vale(calculada, df):
+        colunas, carimbadas, nomes = _escolhe_colunas(df, colunas)
+        # todos os alvos no mesmo produto de matrizes
+        r = _pearson_contra(df[colunas].to_numpy(dtype=np.float64), df[alvos].to_numpy(dtype=np.float64))
+        calculada = _CORRELACOES_COM[chave] = (carimbo(df, list(dict.fromkeys(carimbadas + alvos))), nomes,
+                                               pd.DataFrame(r, index=colunas, columns=alvos))
+    return calculada[2][alvos[0]] if unico else calculada[2]
+
+
+def ranking(correlacoes, k=None, absoluta=True):
+    # ordem decrescente, sem o próprio alvo; com k, só os k primeiros são ordenados
+    correlacoes = correlacoes.drop(correlacoes.name, errors='ignore')
+    valores = correlacoes.to_numpy()
+    chave = np.abs(valores) if absoluta else valores.copy()
+    chave[np.isnan(chave)] = -np.inf
+    if k is None or k >= len(chave):
+        posicoes = np.argsort(-chave, kind='stable')
+    elif k <= 0:
+        posicoes = np.empty(0, dtype=np.intp)
+    else:
+        posicoes = np.argpartition(-chave, k - 1)[:k]
+        posicoes = posicoes[np.argsort(-chave[posicoes], kind='stable')]
+    return correlacoes.iloc[posicoes]
+
 
 # In[71]:
 
 
+corr_with_homevalue = correlacoes_com(df, df.columns[-1])
+ranking(corr_with_homevalue, absoluta=False)
+
+
+# In[ ]:
+
+
+por_alvo = correlacoes_com(df, [df.columns[-1], 'MEDV'])
+ranking(por_alvo['MEDV'], k=5)
+
+
+# In[ ]:
+
+
 corr = df.corr(method='pearson')
-corr_with_homevalue = corr.iloc[-1]
-corr_with_homevalue[corr_with_homevalue.argsort()[::-1]]
+pd.testing.assert_frame_equal(corr.iloc[:, [-1, corr.columns.get_loc('MEDV')]], por_alvo)
+esperada = corr.iloc[-1]
+esperada = esperada[esperada.argsort()[::-1]].drop(esperada.name)
+pd.testing.assert_series_equal(esperada, ranking(corr_with_homevalue, absoluta=False))
+melhores = ranking(por_alvo['MEDV'], k=5)
+pd.testing.assert_series_equal(corr['MEDV'][melhores.index], melhores)
+assert_array_almost_equal(corr['MEDV'].drop('MEDV').abs().nlargest(5), melhores.abs())
+assert correlacoes_com(df, df.columns[-1]) is corr_with_homevalue
+
+# escritas no lugar, marcadas com `marca_escrita`, invalidam as correlações guardadas
+editado = df.copy()
+antes = correlacoes_com(editado, 'MEDV')
+editado.loc[0:200, 'AGE'] = 0
+marca_escrita(editado, ['AGE'])
+assert correlacoes_com(editado, 'MEDV') is not antes
+pd.testing.assert_series_equal(editado.corr()['MEDV'], correlacoes_com(editado, 'MEDV'))
+
+com_faltantes = df.select_dtypes(include=['number', 'bool']).astype(float)
+com_faltantes = com_faltantes.mask(np.random.default_rng(1).random(com_faltantes.shape) < 0.1)
+pd.testing.assert_frame_equal(com_faltantes.corr()[['AGE', 'MEDV']], correlacoes_com(com_faltantes, ['AGE', 'MEDV']))
 
 
 # Com as correlações organizadas em ordem decrescente, é fácil começar a ver alguns padrões. Correlacionar AGE com uma variável que criamos a partir de AGE é uma correlação trivial. No entanto, é interessante notar que a porcentagem do estoque de moradias mais antigas nas comunidades está fortemente correlacionada com a poluição do ar (NOX) e a proporção de acres de negócios não varejistas por cidade (INDUS); pelo menos em 1978 na área metropolitana de Boston, as cidades mais antigas são mais industriais.
@@ -769,7 +1746,7 @@ corr_with_homevalue[corr_with_homevalue.argsort()[::-1]]
 
 
 import seaborn as sns
-sns.heatmap(df.corr(),cmap=sns.cubehelix_palette(20, light=0.95, dark=0.15))
+sns.heatmap(correlacao(df).matriz(),cmap=sns.cubehelix_palette(20, light=0.95, dark=0.15))
 
 
 # Os histogramas são outra ferramenta valiosa para investigar seus dados. Por exemplo, qual é a distribuição geral dos preços das casas ocupadas pelos proprietários na área de Boston?
@@ -840,6 +1817,3 @@ sns.pairplot(df[['RM', 'AGE', 'LSTAT', 'DIS', 'MEDV']], kind="reg", plot_kws={'l
 
 # In[ ]:
 
-
-
-
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Agrupamentos com `np.bincount`, compartilhados pelos cadernos.
+#
+# Quando as chaves são inteiras e densas (o intervalo entre a menor e a maior
+# não é muito maior do que o número de linhas), a própria chave é a posição
+# de um vetor, sem tabela hash e sem ordenação. Caso contrário, as chaves são
+# codificadas com `pd.factorize` antes do `bincount`. Como no `groupby`,
+# chaves e valores faltantes são ignorados e as chaves saem ordenadas.
+# `agrupa_chaves` faz o mesmo para várias chaves: os códigos de cada uma são
+# combinados em um único inteiro, e o `Agrupamento` resultante devolve a
+# matriz N-D, o formato alto (`serie`) ou o largo (`pivo`).
+
+import numpy as np
+import pandas as pd
+
+
+def _codifica_chaves(chaves, razao_densa=4):
+    if chaves.dtype.kind in 'iub' and len(chaves) > 0:
+        menor = int(chaves.min())
+        amplitude = int(chaves.max()) - menor + 1
+        if amplitude <= razao_densa * len(chaves) + 1024:
+            codigos = chaves.astype(np.intp) - menor
+            return codigos, np.arange(menor, menor + amplitude).astype(chaves.dtype), True
+    codigos, rotulos = pd.factorize(chaves, sort=True)
+    return codigos, np.asarray(rotulos), False
+
+
+def agrupa(chaves, valores=None, nome_chave=None):
+    chaves = np.asarray(chaves)
+    codigos, rotulos, densa = _codifica_chaves(chaves)
+    validos = codigos >= 0
+    if valores is None:
+        valores = np.ones(len(chaves), dtype=np.int64)
+    valores = np.asarray(valores)
+    if valores.dtype.kind == 'f':
+        validos &= ~np.isnan(valores)
+    if not validos.all():
+        codigos, valores = codigos[validos], valores[validos]
+    contagem = np.bincount(codigos, minlength=len(rotulos))
+    soma = np.bincount(codigos, weights=valores, minlength=len(rotulos))
+    if valores.dtype.kind in 'iub':
+        soma = soma.astype(np.int64)
+    if densa:
+        presentes = contagem > 0
+        rotulos, contagem, soma = rotulos[presentes], contagem[presentes], soma[presentes]
+    resultado = pd.DataFrame({'count': contagem, 'sum': soma},
+                             index=pd.Index(rotulos, name=nome_chave))
+    resultado['mean'] = resultado['sum'] / resultado['count']
+    return resultado
+
+
+def agrupa_coluna(df, chave, coluna=None):
+    valores = None if coluna is None else df[coluna].to_numpy()
+    return agrupa(df[chave].to_numpy(), valores, nome_chave=chave)
+
+
+class Agrupamento:
+
+    def __init__(self, nomes, rotulos, grupos, contagem, soma):
+        self.nomes = nomes
+        self.rotulos = rotulos
+        self.forma = tuple(len(r) for r in rotulos)
+        # grupos=None: uma posição para cada combinação de rótulos (matriz densa);
+        # senão, os códigos de cada chave para os grupos presentes
+        self.grupos = grupos
+        self.contagem = contagem
+        self.soma = soma
+
+    def _estatistica(self, estatistica):
+        if estatistica == 'count':
+            return self.contagem
+        if estatistica == 'sum':
+            return self.soma
+        if estatistica == 'mean':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return self.soma / self.contagem
+        raise ValueError(f'estatística desconhecida: {estatistica}')
+
+    def matriz(self, estatistica='mean'):
+        # vetor N-D com um eixo por chave; combinações ausentes ficam com NaN (ou 0 na contagem)
+        if self.grupos is not None:
+            raise ValueError('combinações demais para uma matriz densa; use serie ou pivo')
+        valores = self._estatistica(estatistica)
+        if estatistica != 'count':
+            valores = np.where(self.contagem > 0, valores, np.nan)
+        return valores.reshape(self.forma)
+
+    def serie(self, estatistica='mean'):
+        # formato "alto", como o groupby: só as combinações presentes
+        if self.grupos is None:
+            presentes = np.flatnonzero(self.contagem)
+            posicoes = np.unravel_index(presentes, self.forma)
+        else:
+            presentes = slice(None)
+            posicoes = self.grupos
+        indice = pd.MultiIndex.from_arrays([r[p] for r, p in zip(self.rotulos, posicoes)], names=self.nomes)
+        return pd.Series(self._estatistica(estatistica)[presentes], index=indice)
+
+    def pivo(self, estatistica='mean', eixo=-1):
+        # formato "largo", como o unstack, sem montar o MultiIndex do formato alto
+        if self.grupos is not None:
+            return self.serie(estatistica).unstack(eixo)
+        eixo = eixo % len(self.forma)
+        valores = np.moveaxis(self.matriz(estatistica), eixo, -1)
+        contagem = np.moveaxis(self.contagem.reshape(self.forma), eixo, -1)
+        valores = valores.reshape(-1, self.forma[eixo])
+        contagem = contagem.reshape(-1, self.forma[eixo])
+        linhas, colunas = contagem.any(axis=1), contagem.any(axis=0)
+        outros = [r for i, r in enumerate(self.rotulos) if i != eixo]
+        nomes = [n for i, n in enumerate(self.nomes) if i != eixo]
+        if len(outros) == 1:
+            indice = pd.Index(outros[0], name=nomes[0])
+        else:
+            indice = pd.MultiIndex.from_product(outros, names=nomes)
+        return pd.DataFrame(valores[linhas][:, colunas], index=indice[linhas],
+                            columns=pd.Index(self.rotulos[eixo][colunas], name=self.nomes[eixo]))
+
+
+def agrupa_chaves(df, chaves, coluna=None, razao_densa=4):
+    # cada chave é codificada uma vez; os códigos viram um único inteiro em base mista
+    codigos, rotulos = [], []
+    validos = np.ones(len(df), dtype=bool)
+    for chave in chaves:
+        codigo, rotulo, densa = _codifica_chaves(df[chave].to_numpy())
+        if not densa:
+            # só o factorize marca chaves ausentes com -1
+            validos &= codigo >= 0
+        codigos.append(codigo)
+        rotulos.append(rotulo)
+    forma = tuple(len(r) for r in rotulos)
+    valores = np.ones(len(df), dtype=np.int64) if coluna is None else df[coluna].to_numpy()
+    if valores.dtype.kind == 'f':
+        validos &= ~np.isnan(valores)
+    if not validos.all():
+        codigos, valores = [c[validos] for c in codigos], valores[validos]
+    total = np.prod(forma, dtype=np.float64)
+    grupos = None
+    if total <= razao_densa * len(valores) + 1024:
+        total = int(total)
+        combinado = np.ravel_multi_index(codigos, forma) if codigos else np.zeros(len(valores), dtype=np.intp)
+    else:
+        # muitas combinações possíveis e poucas presentes: comprime chave a chave,
+        # de modo que o código combinado nunca passa de n · (rótulos da próxima chave)
+        combinado = codigos[0]
+        for codigo, tamanho in zip(codigos[1:], forma[1:]):
+            combinado, _ = pd.factorize(combinado * tamanho + codigo, sort=True)
+        total = int(combinado.max()) + 1 if len(combinado) else 0
+        ordem = np.argsort(combinado, kind='stable')
+        primeiras = ordem[np.searchsorted(combinado[ordem], np.arange(total))]
+        grupos = [c[primeiras] for c in codigos]
+    contagem = np.bincount(combinado, minlength=total)
+    soma = np.bincount(combinado, weights=valores, minlength=total)
+    if valores.dtype.kind in 'iub':
+        soma = soma.astype(np.int64)
+    return Agrupamento(list(chaves), rotulos, grupos, contagem, soma)
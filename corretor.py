@@ -0,0 +1,571 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Correção automática das listas em paralelo.
+#
+# Lê os cadernos (.py exportados ou .ipynb) sem executar as células, separa
+# as definições (imports, funções, atribuições) dos gráficos e das saídas, e
+# transforma cada célula com `assert_*` em um caso de teste. Cada caso roda em
+# um processo próprio, com limite de tempo, vendo apenas as definições que vêm
+# antes dele no caderno. Onde há `fork`, as definições de cada caderno rodam
+# uma única vez, em ordem, e cada caso é um fork feito logo após o seu
+# prefixo; sem `fork`, cada caso executa o prefixo de novo. As bases lidas com
+# `pd.read_csv` (ou
+# `carrega_voos`) são carregadas uma única vez e entregues aos processos via
+# memória compartilhada, sem serem lidas de novo.
+#
+# Uso:
+#
+#     python corretor.py dcc212l1.py dcc212l2.py sol.py -j 8 --tempo-limite 60 \
+#         --substitui https://.../flights.csv=/dados/flights.csv --relatorio tempos.csv
+
+import argparse
+import ast
+import contextlib
+import csv
+import json
+import multiprocessing as mp
+import os
+import re
+import signal
+import sys
+import time
+import traceback
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+import pandas as pd
+
+# os processos de correção nunca abrem janelas de gráficos
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+
+CADERNOS = ['dcc212l1.py', 'dcc212l2.py', 'sol.py']
+
+CARREGADORES = {'read_csv', 'read_parquet', 'read_feather', 'read_excel', 'carrega_voos'}
+CARREGADORES_PANDAS = {'read_csv', 'read_parquet', 'read_feather', 'read_excel'}
+GRAFICOS = {'plt', 'sns', 'plot', 'hist', 'boxplot', 'scatter', 'bar', 'kde', 'heatmap',
+            'jointplot', 'pairplot', 'distplot', 'kdeplot', 'imshow', 'legend', 'axvline',
+            'graficos', 'figura'}
+SAIDAS = {'print', 'display', 'get_ipython'}
+
+MARCADOR = re.compile(r'^# In\[[^\]]*\]:\s*$')
+
+
+# ## Leitura dos cadernos
+
+def le_celulas(caminho):
+    with open(caminho, encoding='utf-8') as f:
+        texto = f.read()
+    if caminho.endswith('.ipynb'):
+        caderno = json.loads(texto)
+        celulas = [''.join(c['source']) for c in caderno['cells'] if c['cell_type'] == 'code']
+        # comandos mágicos (%matplotlib, !pip, ...) não são Python
+        return ['\n'.join(l for l in c.split('\n') if not l.lstrip().startswith(('%', '!')))
+                for c in celulas]
+    celulas, atual = [], None
+    for linha in texto.split('\n'):
+        if MARCADOR.match(linha):
+            if atual is not None:
+                celulas.append('\n'.join(atual))
+            atual = []
+        elif atual is not None:
+            atual.append(linha)
+    if atual is not None:
+        celulas.append('\n'.join(atual))
+    return celulas
+
+
+def _nomes_chamados(no):
+    nomes = set()
+    for filho in ast.walk(no):
+        if isinstance(filho, ast.Name):
+            nomes.add(filho.id)
+        elif isinstance(filho, ast.Attribute):
+            nomes.add(filho.attr)
+    return nomes
+
+
+def _funcao_chamada(chamada):
+    func = chamada.func
+    if isinstance(func, ast.Name):
+        return func.id
+    if isinstance(func, ast.Attribute):
+        return func.attr
+    return None
+
+
+def _eh_saida(chamada):
+    return bool(_nomes_chamados(chamada.func) & GRAFICOS) or _funcao_chamada(chamada) in SAIDAS
+
+
+def _eh_verificacao(stmt):
+    if isinstance(stmt, ast.Assert):
+        return True
+    if isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Call):
+        nome = _funcao_chamada(stmt.value)
+        return nome is not None and nome.startswith('assert')
+    return False
+
+
+def _carregador(stmt):
+    if not (isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and
+            isinstance(stmt.targets[0], ast.Name) and isinstance(stmt.value, ast.Call)):
+        return None
+    return _funcao_chamada(stmt.value) if _funcao_chamada(stmt.value) in CARREGADORES else None
+
+
+def papel(stmt):
+    if isinstance(stmt, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return 'definicao'
+    if _eh_verificacao(stmt):
+        return 'verificacao'
+    if _carregador(stmt):
+        return 'dados'
+    if isinstance(stmt, (ast.Assign, ast.AnnAssign, ast.AugAssign)):
+        return 'ignorado' if _nomes_chamados(stmt.value) & GRAFICOS else 'definicao'
+    if isinstance(stmt, ast.Expr):
+        # chamadas podem alterar o estado (`df.dropna(inplace=True)`, `lista.append(x)`);
+        # expressões soltas, gráficos e impressões não
+        if not isinstance(stmt.value, ast.Call) or _eh_saida(stmt.value):
+            return 'ignorado'
+        return 'definicao'
+    if isinstance(stmt, (ast.For, ast.While, ast.If, ast.With, ast.Try)):
+        internos = [n for n in ast.walk(stmt) if n is not stmt and isinstance(n, ast.stmt)]
+        altera = any(papel(n) == 'definicao' and not isinstance(n, (ast.For, ast.While, ast.If, ast.With, ast.Try))
+                     for n in internos)
+        return 'definicao' if altera else 'ignorado'
+    return 'ignorado'
+
+
+class _Substitui(ast.NodeTransformer):
+
+    def __init__(self, substituicoes):
+        self.substituicoes = substituicoes
+
+    def visit_Constant(self, no):
+        if isinstance(no.value, str) and no.value in self.substituicoes:
+            return ast.copy_location(ast.Constant(self.substituicoes[no.value]), no)
+        return no
+
+
+def extrai_casos(caminho, substituicoes=None):
+    """Retorna (casos, cargas) de um caderno.
+
+    Cada caso é um dicionário com o nome da função testada, os comandos das
+    células anteriores (`prefixo`) e os da célula com as verificações. Cada
+    carga é um comando que lê uma base, com o prefixo necessário para o mesmo.
+    """
+    arquivo = os.path.basename(caminho)
+    celulas = []
+    for i, fonte in enumerate(le_celulas(caminho)):
+        try:
+            arvore = ast.parse(fonte)
+        except SyntaxError:
+            continue
+        if substituicoes:
+            arvore = ast.fix_missing_locations(_Substitui(substituicoes).visit(arvore))
+        celulas.append((i + 1, arvore.body))
+    funcoes = {stmt.name for _, corpo in celulas for stmt in corpo
+               if isinstance(stmt, (ast.FunctionDef, ast.ClassDef))}
+
+    casos, cargas, prefixo = [], {}, []
+    for numero, corpo in celulas:
+        papeis = [papel(stmt) for stmt in corpo]
+        if 'verificacao' in papeis:
+            testados = [n for n in _nomes_em_ordem(corpo) if n in funcoes]
+            casos.append({
+                'caderno': arquivo,
+                'nome': testados[0] if testados else f'célula {numero}',
+                'prefixo': list(prefixo),
+                'celula': [s for s, p in zip(corpo, papeis) if p in ('definicao', 'dados', 'verificacao')],
+            })
+        for stmt, p in zip(corpo, papeis):
+            if p == 'dados':
+                chave = _chave_da_carga(arquivo, stmt)
+                cargas[chave] = {'comando': stmt, 'prefixo': list(prefixo)}
+                prefixo.append(_le_base_compartilhada(stmt, chave))
+            elif p == 'definicao':
+                prefixo.append(stmt)
+    return casos, cargas
+
+
+def _nomes_em_ordem(corpo):
+    nomes = [n for stmt in corpo for n in ast.walk(stmt) if isinstance(n, ast.Name)]
+    return [n.id for n in sorted(nomes, key=lambda n: (n.lineno, n.col_offset))]
+
+
+def _chave_da_carga(arquivo, stmt):
+    fonte = ast.unparse(stmt.value)
+    # leituras do pandas não dependem do caderno; carregadores definidos no caderno sim
+    if _funcao_chamada(stmt.value) in CARREGADORES_PANDAS:
+        return fonte
+    return f'{arquivo}: {fonte}'
+
+
+def _le_base_compartilhada(stmt, chave):
+    # `df = pd.read_csv(...)` vira `df = __le_base__(chave, 'pd.read_csv(...)')`
+    novo = ast.Assign(targets=stmt.targets, value=ast.Call(
+        func=ast.Name('__le_base__', ast.Load()),
+        args=[ast.Constant(chave), ast.Constant(ast.unparse(stmt.value))], keywords=[]))
+    return ast.fix_missing_locations(ast.copy_location(novo, stmt))
+
+
+def _namespace(descritores):
+    ns = {'__name__': '__corretor__'}
+
+    def le_base(chave, fonte):
+        if chave in descritores:
+            return importa_df(descritores[chave])
+        # a base não pôde ser compartilhada: o próprio processo lê
+        return eval(fonte, ns)
+
+    ns['__le_base__'] = le_base
+    return ns
+
+
+def _programa(comandos):
+    return compile(ast.Module(body=comandos, type_ignores=[]), '<caso>', 'exec')
+
+
+# ## Memória compartilhada
+
+def _para_memoria(valores, segmentos):
+    valores = np.ascontiguousarray(valores)
+    segmento = shared_memory.SharedMemory(create=True, size=max(1, valores.nbytes))
+    np.ndarray(valores.shape, valores.dtype, buffer=segmento.buf)[...] = valores
+    segmentos.append(segmento)
+    return {'nome': segmento.name, 'dtype': valores.dtype.str, 'forma': valores.shape}
+
+
+def exporta_df(df, segmentos):
+    colunas = []
+    for nome in df.columns:
+        coluna = df[nome]
+        if isinstance(coluna.dtype, pd.CategoricalDtype):
+            colunas.append((nome, 'category', _para_memoria(coluna.cat.codes.to_numpy(), segmentos),
+                            list(coluna.cat.categories)))
+        elif isinstance(coluna.dtype, np.dtype) and coluna.dtype.kind in 'biufcmM':
+            colunas.append((nome, 'numpy', _para_memoria(coluna.to_numpy(), segmentos), None))
+        else:
+            # textos: guardamos os códigos e recriamos a coluna de objetos no processo
+            categorica = pd.Categorical(coluna)
+            colunas.append((nome, 'object', _para_memoria(categorica.codes, segmentos),
+                            list(categorica.categories)))
+    if isinstance(df.index, pd.RangeIndex):
+        indice = ('range', (df.index.start, df.index.stop, df.index.step))
+    else:
+        indice = ('valores', df.index.to_numpy())
+    return {'colunas': colunas, 'indice': indice}
+
+
+_ABERTOS = []
+
+
+def _da_memoria(descritor):
+    segmento = shared_memory.SharedMemory(name=descritor['nome'])
+    _ABERTOS.append(segmento)
+    valores = np.ndarray(descritor['forma'], np.dtype(descritor['dtype']), buffer=segmento.buf)
+    valores.flags.writeable = False
+    return valores
+
+
+def importa_df(descritor):
+    dados = {}
+    for nome, tipo, memoria, categorias in descritor['colunas']:
+        valores = _da_memoria(memoria)
+        if tipo == 'category':
+            dados[nome] = pd.Categorical.from_codes(valores, categorias)
+        elif tipo == 'object':
+            dados[nome] = np.asarray(pd.Categorical.from_codes(valores, categorias), dtype=object)
+        else:
+            dados[nome] = valores
+    tipo, valor = descritor['indice']
+    indice = pd.RangeIndex(*valor) if tipo == 'range' else pd.Index(valor)
+    return pd.DataFrame(dados, index=indice, copy=False)
+
+
+def carrega_bases(cargas):
+    """Lê cada base uma vez e exporta para a memória compartilhada."""
+    descritores, segmentos, tempos = {}, [], {}
+    for chave, carga in cargas.items():
+        inicio = time.perf_counter()
+        ns = _namespace(descritores)
+        try:
+            with _silencio():
+                exec(_programa(carga['prefixo']), ns)
+                valor = eval(compile(ast.Expression(carga['comando'].value), '<carga>', 'eval'), ns)
+            if isinstance(valor, pd.DataFrame):
+                descritores[chave] = exporta_df(valor, segmentos)
+        except Exception:
+            # cada caso que depende da base tenta ler sozinho e reporta o erro
+            pass
+        tempos[chave] = time.perf_counter() - inicio
+    return descritores, segmentos, tempos
+
+
+# ## Execução
+
+@contextlib.contextmanager
+def _silencio():
+    with open(os.devnull, 'w') as nada, contextlib.redirect_stdout(nada), contextlib.redirect_stderr(nada):
+        yield
+
+
+class _TempoEsgotado(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def _limite(segundos):
+    def estoura(*_):
+        raise _TempoEsgotado(f'mais de {segundos:g}s')
+
+    anterior = signal.signal(signal.SIGALRM, estoura)
+    signal.setitimer(signal.ITIMER_REAL, segundos)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, anterior)
+
+
+def _situacao(erro):
+    if isinstance(erro, AssertionError):
+        return {'situacao': 'falha', 'mensagem': ' '.join(str(erro).split())}
+    if isinstance(erro, _TempoEsgotado):
+        return {'situacao': 'tempo esgotado', 'mensagem': str(erro)}
+    return {'situacao': 'erro', 'mensagem': ' '.join(f'{type(erro).__name__}: {erro}'.split()),
+            'detalhe': traceback.format_exc()}
+
+
+def _trabalhador(caso, descritores, saida):
+    ns = _namespace(descritores)
+    resultado = {'situacao': 'ok', 'mensagem': '', 'preparo': 0.0, 'verificacao': 0.0}
+    try:
+        with _silencio():
+            inicio = time.perf_counter()
+            exec(_programa(caso['prefixo']), ns)
+            meio = time.perf_counter()
+            resultado['preparo'] = meio - inicio
+            try:
+                exec(_programa(caso['celula']), ns)
+            finally:
+                resultado['verificacao'] = time.perf_counter() - meio
+    except BaseException as erro:
+        resultado.update(_situacao(erro))
+    saida.send(resultado)
+    saida.close()
+
+
+def _verifica(caso, ns, saida):
+    # roda em um processo criado com fork: `ns` é uma cópia do estado do caderno
+    resultado = {'situacao': 'ok', 'mensagem': '', 'preparo': 0.0, 'verificacao': 0.0}
+    inicio = time.perf_counter()
+    try:
+        with _silencio():
+            exec(_programa(caso['celula']), ns)
+    except BaseException as erro:
+        resultado.update(_situacao(erro))
+    resultado['verificacao'] = time.perf_counter() - inicio
+    saida.send(resultado)
+    saida.close()
+
+
+def _inicia(contexto, rodando, i, alvo, *args):
+    entrada, saida = contexto.Pipe(duplex=False)
+    processo = contexto.Process(target=alvo, args=(*args, saida), daemon=True)
+    processo.start()
+    saida.close()
+    rodando[entrada] = (i, processo, time.perf_counter())
+
+
+def _colhe(rodando, tempo_limite, espera=0.05):
+    """Retorna [(i, resultado)] dos processos que terminaram ou estouraram o tempo."""
+    prontos = wait(list(rodando), timeout=espera)
+    agora = time.perf_counter()
+    colhidos = []
+    for entrada in list(rodando):
+        i, processo, inicio = rodando[entrada]
+        if entrada in prontos:
+            try:
+                resultado = entrada.recv()
+            except EOFError:
+                processo.join()
+                resultado = {'situacao': 'erro', 'preparo': 0.0, 'verificacao': 0.0,
+                             'mensagem': f'o processo terminou com código {processo.exitcode}'}
+        elif agora - inicio > tempo_limite:
+            processo.terminate()
+            resultado = {'situacao': 'tempo esgotado', 'preparo': 0.0, 'verificacao': 0.0,
+                         'mensagem': f'mais de {tempo_limite:g}s'}
+        else:
+            continue
+        processo.join()
+        entrada.close()
+        resultado['total'] = agora - inicio
+        colhidos.append((i, resultado))
+        del rodando[entrada]
+    return colhidos
+
+
+def executa_casos(casos, descritores, paralelo, tempo_limite):
+    """Roda cada caso em um processo próprio, executando de novo todo o seu prefixo."""
+    contexto = mp.get_context()
+    pendentes = list(enumerate(casos))
+    rodando = {}
+    resultados = [None] * len(casos)
+    while pendentes or rodando:
+        while pendentes and len(rodando) < paralelo:
+            i, caso = pendentes.pop(0)
+            _inicia(contexto, rodando, i, _trabalhador, caso, descritores)
+        for i, resultado in _colhe(rodando, tempo_limite):
+            resultados[i] = resultado
+    return resultados
+
+
+def _prepara_caderno(casos, descritores, vagas, tempo_limite, saida):
+    # executa as definições do caderno uma única vez, em ordem; logo depois do
+    # prefixo de cada caso, um fork roda as verificações sobre uma cópia do estado
+    contexto = mp.get_context('fork')
+    ns = _namespace(descritores)
+    rodando, resultados, preparos = {}, [None] * len(casos), [0.0] * len(casos)
+    feitos, falha = 0, None
+
+    def colhe(espera=0.05):
+        for i, resultado in _colhe(rodando, tempo_limite, espera):
+            vagas.release()
+            resultado['preparo'] = preparos[i]
+            resultado['total'] += preparos[i]
+            resultados[i] = resultado
+
+    for i, caso in enumerate(casos):
+        if falha is None:
+            # os prefixos dos casos de um caderno crescem: só rodamos o que é novo
+            inicio = time.perf_counter()
+            try:
+                with _silencio(), _limite(tempo_limite):
+                    exec(_programa(caso['prefixo'][feitos:]), ns)
+            except BaseException as erro:
+                falha = _situacao(erro)
+            preparos[i] = time.perf_counter() - inicio
+            feitos = len(caso['prefixo'])
+        if falha is not None:
+            # o prefixo de todos os casos seguintes também passa pelo comando que falhou
+            resultados[i] = {**falha, 'preparo': preparos[i], 'verificacao': 0.0, 'total': preparos[i]}
+            continue
+        while not vagas.acquire(timeout=0.05):
+            colhe(0)
+        _inicia(contexto, rodando, i, _verifica, caso, ns)
+        colhe(0)
+    while rodando:
+        colhe()
+    saida.send(resultados)
+    saida.close()
+
+
+def executa_cadernos(grupos, descritores, paralelo, tempo_limite):
+    """Roda os casos de cada caderno a partir de um único processo por caderno.
+
+    `grupos` traz, para cada caderno, a lista dos seus casos em ordem. As
+    definições são executadas uma vez por caderno, e cada caso roda em um
+    fork feito logo após o seu prefixo; `paralelo` limita os casos rodando ao
+    mesmo tempo, somando todos os cadernos.
+    """
+    contexto = mp.get_context('fork')
+    vagas = contexto.BoundedSemaphore(paralelo)
+    preparadores = []
+    for casos in grupos:
+        entrada, saida = contexto.Pipe(duplex=False)
+        # não é daemon: processos daemon não podem criar outros processos
+        processo = contexto.Process(target=_prepara_caderno,
+                                    args=(casos, descritores, vagas, tempo_limite, saida))
+        processo.start()
+        saida.close()
+        preparadores.append((casos, processo, entrada))
+    resultados = []
+    for casos, processo, entrada in preparadores:
+        try:
+            do_caderno = entrada.recv()
+        except EOFError:
+            do_caderno = [None] * len(casos)
+        processo.join()
+        entrada.close()
+        resultados.extend(resultado or {'situacao': 'erro', 'preparo': 0.0, 'verificacao': 0.0, 'total': 0.0,
+                                        'mensagem': f'o processo do caderno terminou com código {processo.exitcode}'}
+                          for resultado in do_caderno)
+    return resultados
+
+
+def corrige(cadernos, paralelo=None, tempo_limite=60.0, substituicoes=None):
+    grupos, cargas = [], {}
+    for caminho in cadernos:
+        do_caderno, cargas_do_caderno = extrai_casos(caminho, substituicoes)
+        grupos.append(do_caderno)
+        for chave, carga in cargas_do_caderno.items():
+            cargas.setdefault(chave, carga)
+    casos = [caso for do_caderno in grupos for caso in do_caderno]
+    paralelo = paralelo or os.cpu_count() or 1
+    descritores, segmentos, tempos_cargas = carrega_bases(cargas)
+    try:
+        if 'fork' in mp.get_all_start_methods():
+            resultados = executa_cadernos(grupos, descritores, paralelo, tempo_limite)
+        else:
+            resultados = executa_casos(casos, descritores, paralelo, tempo_limite)
+    finally:
+        for segmento in segmentos:
+            segmento.close()
+            segmento.unlink()
+    relatorio = [{'caderno': caso['caderno'], 'caso': caso['nome'], **resultado}
+                 for caso, resultado in zip(casos, resultados)]
+    return relatorio, tempos_cargas
+
+
+# ## Relatório
+
+COLUNAS = ['caderno', 'caso', 'situacao', 'preparo', 'verificacao', 'total', 'mensagem']
+
+
+def imprime_relatorio(relatorio, tempos_cargas, arquivo=sys.stdout):
+    for chave, tempo in tempos_cargas.items():
+        print(f'base {chave[:70]!r}: {tempo:.2f}s', file=arquivo)
+    largura = max([len(f"{r['caderno']}:{r['caso']}") for r in relatorio] + [4])
+    for r in relatorio:
+        nome = f"{r['caderno']}:{r['caso']}"
+        print(f"{nome:<{largura}}  {r['situacao']:<14}  preparo {r['preparo']:7.3f}s  "
+              f"verificação {r['verificacao']:7.3f}s  total {r['total']:7.3f}s  {r['mensagem'][:80]}",
+              file=arquivo)
+    contagem = pd.Series([r['situacao'] for r in relatorio], dtype=object).value_counts()
+    print(', '.join(f'{n} {situacao}' for situacao, n in contagem.items()), file=arquivo)
+
+
+def salva_relatorio(relatorio, caminho):
+    with open(caminho, 'w', newline='', encoding='utf-8') as f:
+        escritor = csv.DictWriter(f, fieldnames=COLUNAS, extrasaction='ignore')
+        escritor.writeheader()
+        escritor.writerows(relatorio)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Corrige as listas em paralelo.')
+    parser.add_argument('cadernos', nargs='*', default=CADERNOS,
+                        help='cadernos .py (exportados) ou .ipynb a corrigir')
+    parser.add_argument('-j', '--paralelo', type=int, default=None,
+                        help='número de processos (padrão: número de CPUs)')
+    parser.add_argument('--tempo-limite', type=float, default=60.0,
+                        help='tempo máximo de cada caso, em segundos')
+    parser.add_argument('--substitui', action='append', default=[], metavar='URL=CAMINHO',
+                        help='troca uma URL (ou qualquer texto) dos cadernos por um caminho local')
+    parser.add_argument('--relatorio', help='salva os tempos de cada caso em um CSV')
+    args = parser.parse_args(argv)
+
+    substituicoes = dict(s.split('=', 1) for s in args.substitui)
+    relatorio, tempos_cargas = corrige(args.cadernos, args.paralelo, args.tempo_limite, substituicoes)
+    imprime_relatorio(relatorio, tempos_cargas)
+    if args.relatorio:
+        salva_relatorio(relatorio, args.relatorio)
+    return 0 if all(r['situacao'] == 'ok' for r in relatorio) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
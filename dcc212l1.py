@@ -481,11 +481,107 @@ assert_equal(6, sum_of_sum_vectors(x, y))
 # __Funções:__
 # 1. `np.sum(array)` soma os elementos do array. `array.sum()` tem o mesmo efeito!
 
+# Multiplicar os vetores com `*` e depois somar cria um vetor temporário do tamanho da entrada. Além disso, `np.array` sempre copia a entrada. Abaixo usamos `np.asarray`, que não copia quando já recebemos um vetor numpy, e `np.einsum`, que multiplica e soma de uma vez só.
+# 
+# Outro cuidado é o tipo do acumulador. Vetores de inteiros pequenos (`int8`, `int32`) estouram silenciosamente ao multiplicar e somar. Por isso o acumulador pode ser escolhido:
+# 
+# 1. `'int64'`: soma exata para inteiros com sinal (padrão quando as entradas são inteiras com sinal ou booleanas);
+# 1. `'uint64'`: soma para inteiros sem sinal (padrão quando as entradas são `uint`, ou `uint` com inteiros sem negativos), sem passar valores acima de `2**63` por um acumulador com sinal;
+# 1. `'float64'`: soma em ponto flutuante (padrão para o resto);
+# 1. `'complex128'`: soma complexa (padrão quando alguma entrada é complexa);
+# 1. `'kahan'`: soma compensada em `float64` (Kahan–Babuška, que também compensa quando a parcela é maior que o total acumulado), só para entradas reais. Vetores longos são somados em pedaços, e a compensação de cada pedaço entra na soma final.
+
+# In[ ]:
+
+
+import math
+
+ACUMULADORES = ('int64', 'uint64', 'float64', 'complex128', 'kahan')
+
+
+def _acumulador_padrao(a, b):
+    tipo = np.result_type(a, b)
+    if np.issubdtype(tipo, np.unsignedinteger):
+        return 'uint64'
+    inteiros = [x for x in (a, b) if np.issubdtype(x.dtype, np.integer)]
+    if len(inteiros) == 2 and any(np.issubdtype(x.dtype, np.unsignedinteger) for x in inteiros):
+        # uint64 com int64 vira float64 no numpy: sem negativos, a soma cabe em uint64
+        if all(x.size == 0 or x.min() >= 0 for x in inteiros):
+            return 'uint64'
+        if any(x.size and x.max() >= 2 ** 63 for x in inteiros):
+            raise OverflowError('valores acima de 2**63 misturados com negativos: escolha o acumulador')
+        return 'int64'
+    if np.issubdtype(tipo, np.integer) or tipo == np.bool_:
+        return 'int64'
+    if np.issubdtype(tipo, np.complexfloating):
+        return 'complex128'
+    return 'float64'
+
+
+def _kahan_colunas(x):
+    # soma compensada (Kahan–Babuška) das colunas de x, vetorizada nas linhas;
+    # devolve o total e a compensação separados, para que a compensação não se perca
+    total = np.zeros(x.shape[0])
+    compensacao = np.zeros(x.shape[0])
+    for y in x.T:
+        t = total + y
+        compensacao += np.where(np.abs(total) >= np.abs(y), (total - t) + y, (y - t) + total)
+        total = t
+    return total, compensacao
+
+
+def _kahan(a, b):
+    # cada linha é quebrada em ~√d pedaços de ~√d elementos: o laço em Python tem
+    # ~3√d passos vetorizados (dentro dos pedaços e depois entre eles), não d
+    produtos = a.astype(np.float64) * b
+    n, d = produtos.shape
+    if n >= d:
+        total, compensacao = _kahan_colunas(produtos)
+        return total + compensacao
+    pedacos = max(1, math.isqrt(d))
+    largura = -(-d // pedacos)
+    completo = np.zeros((n, pedacos * largura))
+    completo[:, :d] = produtos
+    # em ordem de colunas, cada passo do laço lê um trecho contínuo da memória
+    blocos = np.asfortranarray(completo.reshape(n * pedacos, largura))
+    parciais, compensacoes = _kahan_colunas(blocos)
+    # os totais e as compensações dos pedaços entram juntos na soma final
+    total, compensacao = _kahan_colunas(np.concatenate([parciais.reshape(n, pedacos),
+                                                        compensacoes.reshape(n, pedacos)], axis=1))
+    return total + compensacao
+
+
+def _produtos_internos(subscritos, a, b, acumulador):
+    if acumulador is None:
+        acumulador = _acumulador_padrao(a, b)
+    if acumulador not in ACUMULADORES:
+        raise ValueError(f'acumulador deve ser um de {ACUMULADORES}, não {acumulador!r}')
+    if a.shape != b.shape:
+        raise ValueError(f'formas diferentes: {a.shape} e {b.shape}')
+    if acumulador == 'kahan':
+        if np.iscomplexobj(a) or np.iscomplexobj(b):
+            raise TypeError("o acumulador 'kahan' só soma valores reais; use 'complex128'")
+        linhas = int(np.prod(a.shape[:-1]))
+        resultado = _kahan(a.reshape(linhas, a.shape[-1]), b.reshape(linhas, b.shape[-1]))
+        return resultado.reshape(a.shape[:-1])[()]
+    if acumulador == 'uint64':
+        # inteiros com sinal só entram no acumulador sem sinal se não tiverem negativos
+        for x in (a, b):
+            if np.issubdtype(x.dtype, np.signedinteger) and x.size and x.min() < 0:
+                raise ValueError("o acumulador 'uint64' não aceita valores negativos")
+        a, b = [x.astype(np.uint64) if np.issubdtype(x.dtype, np.signedinteger) else x for x in (a, b)]
+    # 'same_kind' recusa (TypeError) truncar floats em um acumulador inteiro
+    # ou descartar a parte imaginária em um acumulador real
+    return np.einsum(subscritos, a, b, dtype=acumulador, casting='same_kind')
+
+
 # In[63]:
 
 
-def inner(array_1, array_2):
-    return np.sum(np.array(array_1) * np.array(array_2))
+def inner(array_1, array_2, acumulador=None):
+    a = np.asarray(array_1)
+    b = np.asarray(array_2)
+    return _produtos_internos('i,i->', a, b, acumulador)
 
 
 # In[64]:
@@ -496,6 +592,55 @@ x2 = np.array([10, 100, 1000])
 assert_equal(20 + 400 + 8000, inner(x1, x2))
 
 
+# Quando temos muitos pares de vetores, por exemplo as linhas de duas matrizes, chamar `inner` em um laço é lento. A função `inner_lote` recebe duas matrizes `(n, d)` (ou listas de vetores de mesmo tamanho) e retorna os `n` produtos internos com uma única chamada ao `einsum`.
+
+# In[ ]:
+
+
+def inner_lote(arrays_1, arrays_2, acumulador=None):
+    A = np.asarray(arrays_1)
+    B = np.asarray(arrays_2)
+    if A.ndim != 2:
+        raise ValueError(f'esperava uma matriz (n, d), recebi a forma {A.shape}')
+    return _produtos_internos('ij,ij->i', A, B, acumulador)
+
+
+# In[ ]:
+
+
+assert_array_equal([8420, 8420], inner_lote([x1, x1], [x2, x2]))
+
+grandes = np.full(100000, 100000, dtype=np.int32)
+assert_equal(10 ** 15, inner(grandes, grandes))
+
+A = np.random.randn(1000, 50)
+B = np.random.randn(1000, 50)
+assert_array_almost_equal((A * B).sum(axis=1), inner_lote(A, B))
+assert_array_almost_equal((A * B).sum(axis=1), inner_lote(A, B, acumulador='kahan'))
+
+longo = np.random.randn(1000000)
+assert_almost_equal(math.fsum(longo * longo), inner(longo, longo, acumulador='kahan'), decimal=8)
+
+try:
+    inner([0.5, 1.5], [1, 1], acumulador='int64')
+except TypeError:
+    pass
+else:
+    raise AssertionError('floats não podem ser truncados no acumulador int64')
+
+# a compensação sobrevive ao cancelamento catastrófico, também entre os pedaços
+assert_equal(1.0, inner([1e16, 1, -1e16], [1, 1, 1], acumulador='kahan'))
+cancela = np.zeros(10000)
+cancela[0], cancela[1:5000], cancela[5000] = 1e16, 1, -1e16
+assert_equal(4999.0, inner(cancela, np.ones(10000), acumulador='kahan'))
+
+# sem sinal e complexos escolhem o próprio acumulador
+assert_equal(2 ** 63, inner(np.array([2 ** 63], dtype=np.uint64), [1]))
+assert_equal(-3, inner(np.array([1, 2], dtype=np.uint64), [-1, -1]))
+assert_equal(np.uint64, type(inner(np.array([2 ** 63], dtype=np.uint64), np.array([1], dtype=np.uint8))))
+assert_equal(1 + 3j + 2j, inner([1, 1j], [1 + 3j, 2]))
+
+
 # ## Exercício 02
 # 
 # Implemente uma função utilizando numpy que recebe duas matrizes, multiplica as duas e retorne o valor médio das células da multiplicação. Por exemplo, ao multiplicar:
@@ -523,11 +668,57 @@ assert_equal(20 + 400 + 8000, inner(x1, x2))
 # __Dicas:__  
 # 1. Use o operador @ para multiplicar matrizes!
 
+# Para matrizes grandes (por exemplo 50k x 50k) não precisamos criar o produto. Cada célula de `A @ B` é $\sum_k A_{ik} B_{kj}$, então a soma de todas as células é $\sum_k (\sum_i A_{ik}) (\sum_j B_{kj})$. Ou seja, basta somar as colunas de `A`, as linhas de `B` e fazer um produto interno. Isto custa $O(n^2)$ em vez de $O(n^3)$.
+# 
+# As funções auxiliares abaixo leem as matrizes em blocos de linhas. Assim, podemos passar o caminho de um arquivo `.npy`, que é aberto com `np.load(..., mmap_mode='r')` (um `np.memmap`), sem carregar tudo na memória.
+
+# In[ ]:
+
+
+import os
+
+
+def _abre_matriz(X):
+    if isinstance(X, (str, os.PathLike)):
+        return np.load(X, mmap_mode='r')
+    if isinstance(X, np.ndarray):
+        return X
+    return np.asarray(X)
+
+
+def _confere_formas(A, B):
+    if A.ndim != 2 or B.ndim != 2 or A.shape[1] != B.shape[0]:
+        raise ValueError(f'formas incompatíveis para multiplicação: {A.shape} e {B.shape}')
+
+
+def _dtype_acumulador(X):
+    # inteiros são somados em int64 (exato), o resto em float64
+    if np.issubdtype(X.dtype, np.integer) or X.dtype == np.bool_:
+        return np.int64
+    return np.float64
+
+
+def _soma_em_blocos(X, axis, bloco=4096):
+    acc = _dtype_acumulador(X)
+    if axis == 0:
+        total = np.zeros(X.shape[1], dtype=acc)
+        for i in range(0, X.shape[0], bloco):
+            total += X[i:i + bloco].sum(axis=0, dtype=acc)
+        return total.astype(np.float64)
+    partes = [X[i:i + bloco].sum(axis=1, dtype=acc) for i in range(0, X.shape[0], bloco)]
+    return np.concatenate(partes).astype(np.float64)
+
+
 # In[69]:
 
 
 def medmult(X_1, X_2):
-    return np.mean(np.matmul(X_1, X_2))
+    A = _abre_matriz(X_1)
+    B = _abre_matriz(X_2)
+    _confere_formas(A, B)
+    n, m = A.shape[0], B.shape[1]
+    # média de A @ B = (somas das colunas de A) . (somas das linhas de B) / (n * m)
+    return np.dot(_soma_em_blocos(A, axis=0), _soma_em_blocos(B, axis=1)) / (n * m)
 
 
 # In[70]:
@@ -537,3 +728,39 @@ X = np.array([1, 2, 3, 4]).reshape(2, 2)
 Y = np.array([2, 1, 1, 2]).reshape(2, 2)
 assert_equal(7.5, medmult(X, Y))
 
+
+# Caso precisemos percorrer o produto de fato (por exemplo, para conferir o atalho acima ou para outras agregações), a função `matmul_em_blocos` gera o produto em ladrilhos (*tiles*) de `bloco x bloco`. Apenas um ladrilho existe na memória por vez. A `medmult_blocos` acumula a média dessa forma.
+
+# In[ ]:
+
+
+def matmul_em_blocos(X_1, X_2, bloco=1024):
+    A = _abre_matriz(X_1)
+    B = _abre_matriz(X_2)
+    _confere_formas(A, B)
+    for i in range(0, A.shape[0], bloco):
+        A_i = np.asarray(A[i:i + bloco], dtype=np.float64)
+        for j in range(0, B.shape[1], bloco):
+            B_j = np.asarray(B[:, j:j + bloco], dtype=np.float64)
+            yield i, j, A_i @ B_j
+
+
+def medmult_blocos(X_1, X_2, bloco=1024):
+    A = _abre_matriz(X_1)
+    B = _abre_matriz(X_2)
+    total = 0.0
+    for _, _, ladrilho in matmul_em_blocos(A, B, bloco):
+        total += ladrilho.sum()
+    return total / (A.shape[0] * B.shape[1])
+
+
+# In[ ]:
+
+
+assert_equal(7.5, medmult_blocos(X, Y))
+
+X = np.random.randn(300, 200)
+Y = np.random.randn(200, 100)
+assert_almost_equal(np.mean(X @ Y), medmult(X, Y))
+assert_almost_equal(np.mean(X @ Y), medmult_blocos(X, Y, bloco=64))
+
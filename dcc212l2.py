@@ -9,33 +9,24 @@
 # 
 # ## Imports Básicos
 # 
-# As três células abaixo apenas configuram nosso notebook para ficar mais parecido com os das aulas
+# As duas células abaixo apenas configuram nosso notebook para ficar mais parecido com os das aulas
 
 # In[1]:
 
 
 import numpy as np
-import matplotlib.pyplot as plt
 import pandas as pd
 
 
-# In[2]:
-
+# Os gráficos deste notebook não são desenhados na hora. Cada chamada (`hist`, `xlabel`, `df.plot.bar`, ...) é apenas anotada em uma `Figura` e o desenho só acontece quando a figura é o resultado de uma célula, ou quando chamamos `graficos.salva(pasta)`, que pode rodar em segundo plano. Assim, importar o código deste notebook para corrigir ou reaproveitar as funções não gasta tempo com gráficos. Essa camada fica em `figuras.py`, compartilhada com a Lista 03.
 
-plt.rcParams['figure.figsize']  = (16, 10)
-plt.rcParams['axes.labelsize']  = 20
-plt.rcParams['axes.titlesize']  = 20
-plt.rcParams['legend.fontsize'] = 20
-plt.rcParams['xtick.labelsize'] = 20
-plt.rcParams['ytick.labelsize'] = 20
-plt.rcParams['lines.linewidth'] = 4
+# In[2]:
 
 
-# In[3]:
+from figuras import Graficos
 
 
-plt.ion()
-plt.style.use('seaborn-colorblind')
+graficos = Graficos()
 
 
 # ## NumPy Novamente
@@ -86,11 +77,20 @@ np.median(ice_cream_v)
 # 
 # Altere a função abaixo para retornar a mediana do valor dos sortvetes e o número de elementos no array.
 
+# A mediana exata precisa de todos os valores na memória. Mesmo assim, não precisamos ordenar o vetor inteiro: `np.partition(v, i)` coloca na posição `i` o valor que estaria lá se o vetor fosse ordenado, em tempo linear. Como o pandas, ignoramos os valores faltantes (`NaN`). A função `mediana_exata` e o esboço e o serviço de medianas abaixo ficam no módulo `medianas.py`, usado também pelas outras listas.
+
+# In[ ]:
+
+
+from medianas import mediana_exata
+
+
 # In[14]:
 
 
 def median_and_size(array):
-    return (np.median(array), np.size(array))
+    valores = np.asarray(array)
+    return (mediana_exata(valores), np.size(valores))
 
 
 # Novamente, vanos carregar os módulos de testes
@@ -115,6 +115,34 @@ assert_equal(1000, median)
 assert_equal(12, size)
 
 
+# Quando as vendas chegam continuamente, não dá para guardar tudo para calcular a mediana. Uma alternativa são os esboços (*sketches*) de quantis. Abaixo usamos o esboço KLL. O mesmo guarda no máximo algo como `3 * k` valores, não importa quantos dados chegaram. Enquanto nenhum valor foi descartado a resposta é exata. Depois disso, o erro no posto do quantil é da ordem de `1 / k`.
+# 
+# O esboço mantém vários níveis. Quando um nível enche, ordenamos o mesmo e promovemos metade dos elementos (os de posição par ou ímpar, escolhidos ao acaso) para o nível de cima, onde cada elemento passa a valer o dobro. Dois esboços podem ser combinados (`junta`) nível a nível, então cada processo pode resumir uma parte dos dados.
+
+# In[ ]:
+
+
+from medianas import EsbocoKLL
+
+
+# O `ServicoMedianas` mantém um esboço por coluna numérica. A cada lote chamamos `atualiza`; serviços de processos diferentes são combinados com `junta`. Com `exato=True` os valores são guardados e a mediana sai do `mediana_exata` (use apenas quando os dados cabem na memória).
+
+# In[ ]:
+
+
+from medianas import ServicoMedianas
+
+
+# In[ ]:
+
+
+vendas = pd.DataFrame({'icecream': ice_cream_v})
+servico = ServicoMedianas().atualiza(vendas.iloc[:6])
+servico.junta(ServicoMedianas().atualiza(vendas.iloc[6:]))
+assert_equal(1000, servico.medianas()['icecream'])
+assert_equal(12, servico.tamanhos()['icecream'])
+
+
 # In[17]:
 
 
@@ -181,11 +209,76 @@ df.head()
 # Name: Jan, dtype: int64
 # ```
 
+# Cada `loc` passa por toda a maquinaria de rótulos do pandas e cria uma Series nova, com os dados copiados. Quando consultamos meses em um laço, vale a pena montar uma vez um índice `rótulo -> posição da linha` sobre a matriz numpy que guarda os dados. Quando todas as colunas têm o mesmo tipo, `df.to_numpy()` é uma visão dessa matriz (sem cópia), e `valores[i]` também é uma visão. Assim, alterar uma célula do `DataFrame` aparece na hora na consulta.
+# 
+# O índice fica guardado por `DataFrame` em `indice_de_linhas`. Antes de cada uso conferimos, só por identidade, se o `DataFrame` mudou de estrutura: o índice, as colunas ou os blocos internos do pandas (a tupla que guarda as matrizes por trás dos dados, trocada por exemplo ao adicionar uma coluna ou ao escrever com `loc`). Essa conferência não copia nem percorre os dados. Se algo mudou, o índice é reconstruído. A decisão sobre os tipos também fica guardada: quando as colunas têm tipos diferentes, os dados não estão em uma única matriz e `indice_de_linhas` retorna `None`; nesse caso as funções usam `loc` e `iloc` normalmente.
+
+# In[ ]:
+
+
+import weakref
+
+
+class IndiceLinhas:
+
+    def __init__(self, df, posicoes=None):
+        # o pandas troca a tupla de blocos sempre que troca as matrizes por trás dos dados
+        self.blocos = df._mgr.blocks
+        self.rotulos = df.index
+        self.colunas = df.columns
+        self.valores = None
+        if df.shape[1] > 0 and (df.dtypes == df.dtypes.iloc[0]).all():
+            valores = df.to_numpy()
+            if np.shares_memory(valores, df.to_numpy()):
+                self.valores = valores
+        if self.valores is not None and posicoes is None:
+            posicoes = {rotulo: i for i, rotulo in enumerate(df.index)}
+        self.posicoes = posicoes
+
+    def valido(self, df):
+        return df.index is self.rotulos and df.columns is self.colunas and df._mgr.blocks is self.blocos
+
+    def linha(self, rotulo):
+        return self.valores[self.posicoes[rotulo]]
+
+    def linhas(self, rotulos):
+        return self.valores[[self.posicoes[rotulo] for rotulo in rotulos]]
+
+    def serie(self, posicao):
+        return pd.Series(self.valores[posicao], index=self.colunas, name=self.rotulos[posicao], copy=False)
+
+
+_INDICES = {}
+
+
+def indice_de_linhas(df):
+    # None quando as colunas não formam uma única matriz (tipos diferentes)
+    chave = id(df)
+    indice = _INDICES.get(chave)
+    if indice is None:
+        weakref.finalize(df, _INDICES.pop, chave, None)
+    if indice is None or not indice.valido(df):
+        # com o mesmo índice de linhas, as posições dos rótulos continuam valendo
+        posicoes = indice.posicoes if indice is not None and indice.rotulos is df.index else None
+        indice = _INDICES[chave] = IndiceLinhas(df, posicoes)
+    return indice if indice.valores is not None else None
+
+
 # In[29]:
 
 
 def month_sales(df, month: str):
-    return df.loc['Jan']
+    indice = indice_de_linhas(df)
+    if indice is None:
+        return df.loc[month]
+    return indice.serie(indice.posicoes[month])
+
+
+def months_sales(df, months):
+    indice = indice_de_linhas(df)
+    if indice is None:
+        return df.loc[months].to_numpy()
+    return indice.linhas(months)
 
 
 # In[32]:
@@ -210,7 +303,10 @@ assert_equal(10, series.loc['coats'])
 
 
 def row_sales(df, row: int):
-    return df.iloc[row]
+    indice = indice_de_linhas(df)
+    if indice is None:
+        return df.iloc[row]
+    return indice.serie(row)
 
 
 # In[38]:
@@ -222,6 +318,40 @@ assert_equal(1000, series.loc['sunglasses'])
 assert_equal(10, series.loc['coats'])
 
 
+# Conferindo que as linhas são visões dos dados e que o índice acompanha mudanças no `DataFrame`.
+
+# In[ ]:
+
+
+assert_equal(1900, month_sales(df, 'Dez').loc['icecream'])
+assert_array_equal([[3000, 1000, 10], [1900, 900, 20]], months_sales(df, ['Jan', 'Dez']))
+
+vendas = df.copy()
+assert np.shares_memory(month_sales(vendas, 'Fev').values, vendas.to_numpy())
+vendas['hats'] = 1
+assert_equal(1, month_sales(vendas, 'Fev').loc['hats'])
+
+# com tipos diferentes não há matriz única: as funções voltam ao loc e ao iloc
+vendas['media'] = vendas['icecream'] / 2.0
+vendas['nome'] = 'loja'
+pd.testing.assert_series_equal(vendas.loc['Jan'], month_sales(vendas, 'Jan'))
+pd.testing.assert_series_equal(vendas.iloc[1], row_sales(vendas, 1))
+assert_array_equal(vendas.loc[['Jan', 'Dez']].to_numpy(), months_sales(vendas, ['Jan', 'Dez']))
+
+# consultas seguidas reaproveitam o índice (e a decisão sobre os tipos) sem reconstruir nada
+assert indice_de_linhas(df) is indice_de_linhas(df)
+month_sales(vendas, 'Jan')
+decisao = _INDICES[id(vendas)]
+month_sales(vendas, 'Fev')
+assert _INDICES[id(vendas)] is decisao
+
+# escrever com loc troca os blocos do pandas: o índice é refeito e enxerga o valor novo
+vendas = df.copy()
+month_sales(vendas, 'Jan')
+vendas.loc['Jan', 'coats'] = 7.5
+assert_equal(7.5, month_sales(vendas, 'Jan').loc['coats'])
+
+
 # ### Exercício 04 (Sem correção Automática)
 # 
 # Agora, faça um gráfico estilo o abaixo para entender a venda de produtos ao longo dos meses. Esta tarefa não tem correção automática, use o gráfico abaixo para saber se acertou ou não.
@@ -233,7 +363,7 @@ assert_equal(10, series.loc['coats'])
 # In[40]:
 
 
-df.plot.bar()
+graficos.figura('vendas_por_mes').de(df, 'plot.bar')
 
 
 # ### Exercício 05
@@ -265,17 +395,90 @@ def north_or_south():
 # 
 # Uma única chamada Pandas resolve este problema!
 
+# Calcular cada estatística separadamente percorre cada coluna oito vezes e ordena a mesma três vezes (uma para cada quartil). Abaixo construímos um resumo que lê os dados uma única vez, todas as colunas numéricas juntas, e que pode ser alimentado em pedaços (`atualiza`) e combinado com resumos calculados em outros processos (`junta`):
+# 
+# 1. Contagem, média e variância usam a atualização de Welford, na versão que combina dois grupos (Chan et al.): dados a média e a soma dos quadrados dos desvios de dois grupos, obtemos as do grupo unido sem rever os dados;
+# 1. Mínimo e máximo são exatos;
+# 1. Os quartis vêm do esboço KLL que definimos no Exercício 01. Enquanto nenhum valor foi descartado a resposta é exata (igual ao `quantile` do pandas).
+
+# In[ ]:
+
+
+class ResumoIncremental:
+
+    LINHAS = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
+    def __init__(self, k=200, semente=None):
+        self.k = k
+        self.semente = semente
+        self.colunas = None
+
+    def _inicia(self, colunas):
+        p = len(colunas)
+        self.colunas = list(colunas)
+        self.n = np.zeros(p)
+        self.media = np.zeros(p)
+        self.m2 = np.zeros(p)
+        self.minimo = np.full(p, np.inf)
+        self.maximo = np.full(p, -np.inf)
+        self.esbocos = [EsbocoKLL(self.k, self.semente) for _ in range(p)]
+
+    def _combina(self, n, media, m2, minimo, maximo):
+        total = self.n + n
+        delta = media - self.media
+        com_dados = total > 0
+        peso = np.divide(n, total, out=np.zeros_like(total), where=com_dados)
+        self.media = self.media + delta * peso
+        self.m2 = self.m2 + m2 + delta ** 2 * self.n * peso
+        self.n = total
+        self.minimo = np.minimum(self.minimo, minimo)
+        self.maximo = np.maximum(self.maximo, maximo)
+
+    def atualiza(self, df):
+        numericas = df.select_dtypes('number')
+        if self.colunas is None:
+            self._inicia(numericas.columns)
+        X = numericas[self.colunas].to_numpy(dtype=np.float64)
+        validos = ~np.isnan(X)
+        n = validos.sum(axis=0).astype(np.float64)
+        soma = np.where(validos, X, 0).sum(axis=0)
+        media = np.divide(soma, n, out=np.zeros_like(n), where=n > 0)
+        m2 = (np.where(validos, X - media, 0) ** 2).sum(axis=0)
+        self._combina(n, media, m2,
+                      np.where(validos, X, np.inf).min(axis=0, initial=np.inf),
+                      np.where(validos, X, -np.inf).max(axis=0, initial=-np.inf))
+        for j, esboco in enumerate(self.esbocos):
+            esboco.atualiza(X[validos[:, j], j])
+        return self
+
+    def junta(self, outro):
+        if self.colunas is None:
+            self._inicia(outro.colunas)
+        if outro.colunas != self.colunas:
+            raise ValueError(f'colunas diferentes: {self.colunas} e {outro.colunas}')
+        self._combina(outro.n, outro.media, outro.m2, outro.minimo, outro.maximo)
+        for esboco, do_outro in zip(self.esbocos, outro.esbocos):
+            esboco.junta(do_outro)
+        return self
+
+    def resultado(self):
+        std = np.sqrt(np.divide(self.m2, self.n - 1, out=np.full_like(self.n, np.nan), where=self.n > 1))
+        quartis = np.array([esboco.quantis([.25, .5, .75]) for esboco in self.esbocos]).reshape(-1, 3).T
+        vazio = self.n == 0
+        linhas = [self.n,
+                  np.where(vazio, np.nan, self.media),
+                  std,
+                  np.where(vazio, np.nan, self.minimo),
+                  *quartis,
+                  np.where(vazio, np.nan, self.maximo)]
+        return pd.DataFrame(linhas, index=self.LINHAS, columns=self.colunas)
+
+
 # In[99]:
 
 
 def questao6(df):
-    keys = ['icecream', 'sunglasses', 'coats']
-    new_df = pd.DataFrame()
-    for key in keys:
-        column = df[key]
-        new_df[key] = [column.count(), column.mean(), column.std(), column.min(), column.quantile(.25), column.quantile(.5), column.quantile(.75), column.max()]
-    new_df.index = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
-    return new_df
+    return ResumoIncremental().atualiza(df).resultado()
 
 
 # In[100]:
@@ -284,6 +487,18 @@ def questao6(df):
 questao6(df)
 
 
+# Conferindo com o `describe` do pandas. Abaixo também alimentamos o resumo em dois pedaços, calculados separadamente e depois combinados, como seria feito com vários processos.
+
+# In[ ]:
+
+
+assert_array_almost_equal(df.describe().values, questao6(df).values)
+
+resumo = ResumoIncremental().atualiza(df.iloc[:5])
+resumo.junta(ResumoIncremental().atualiza(df.iloc[5:]))
+assert_array_almost_equal(df.describe().values, resumo.resultado().values)
+
+
 # ## Arquivos
 # 
 # É bem mais comum fazer uso de DataFrames que já existem em arquivos. Note que o trabalho do cientista de dados nem sempre vai ter tais arquivos prontos. Em várias ocasiões, você vai ter que coletar e organizar os mesmos. Limpeza e coleta de dados é uma parte fundamental do seu trabalho. Durante a matéria, boa parte dos notebooks já vão ter dados prontos.
@@ -318,15 +533,34 @@ df.head()
 # 
 # Implemente uma função que retorna a quantidade de mortes para cada bomba. Use o `groupby`.
 
+# Observe que `df.groupby('NearestPumpID').count()` conta as linhas (casas) de cada bomba, em todas as colunas, e não soma as mortes da coluna `Count`. Além disso, quando a chave é um inteiro pequeno, como o identificador da bomba, nem precisamos de uma tabela hash: a própria chave pode ser o índice de um vetor. A função `np.bincount(chaves, weights=valores)` soma os valores de cada chave em uma única passada, $O(n)$, sem ordenar.
+# 
+# A função `agrupa`, do módulo `agrupamento.py` (compartilhado com as outras listas), usa esta ideia quando as chaves são inteiras e densas (o intervalo entre a menor e a maior chave não é muito maior do que o número de linhas). Caso contrário, por exemplo com chaves esparsas ou `float`, ela codifica as chaves com `pd.factorize` (uma tabela hash) e depois usa o `bincount` nos códigos. Como no `groupby`, chaves e valores faltantes são ignorados e as chaves saem ordenadas.
+
+# In[ ]:
+
+
+from agrupamento import agrupa_coluna
+
+
 # In[121]:
 
 
 def mortes_por_pump(df):
-    return df.groupby('NearestPumpID').count()['Count']
+    return agrupa_coluna(df, 'NearestPumpID', 'Count')['sum'].rename('Count')
 
 
-# In[122]:
+# In[ ]:
 
 
 mortes_por_pump(df)
 
+
+# In[ ]:
+
+
+esperado = df.groupby('NearestPumpID')['Count'].agg(['count', 'sum'])
+assert_array_equal(esperado.index, mortes_por_pump(df).index)
+assert_array_equal(esperado['sum'], mortes_por_pump(df))
+assert_array_equal(esperado['count'], agrupa_coluna(df, 'NearestPumpID', 'Count')['count'])
+
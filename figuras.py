@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Gráficos adiados, compartilhados pelos cadernos.
+#
+# Cada chamada feita em uma `Figura` (`hist`, `xlabel`, `figura.de(df,
+# 'plot.bar')`, ...) é apenas anotada; o matplotlib só é importado e a figura
+# só é desenhada quando ela é o resultado de uma célula ou quando chamamos
+# `Graficos.salva(pasta)`, que pode rodar em segundo plano. Os cadernos podem
+# estender a `Figura` com métodos próprios e passar a subclasse ao `Graficos`.
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+ESTILO = 'seaborn-colorblind'
+PARAMETROS_GRAFICOS = {
+    'figure.figsize': (16, 10),
+    'axes.labelsize': 20,
+    'axes.titlesize': 20,
+    'legend.fontsize': 20,
+    'xtick.labelsize': 20,
+    'ytick.labelsize': 20,
+    'lines.linewidth': 4,
+}
+
+# nomes do pyplot que nos eixos têm outro nome
+_METODOS_EIXO = {'xlabel': 'set_xlabel', 'ylabel': 'set_ylabel', 'title': 'set_title',
+                 'xlim': 'set_xlim', 'ylim': 'set_ylim'}
+
+
+class Figura:
+
+    def __init__(self, nome):
+        self.nome = nome
+        self.passos = []
+
+    def __getattr__(self, metodo):
+        # `figura.hist(...)`, `figura.xlabel(...)`: anota a chamada nos eixos
+        if metodo.startswith('_'):
+            raise AttributeError(metodo)
+
+        def anota(*args, **kwargs):
+            self.passos.append((None, _METODOS_EIXO.get(metodo, metodo), args, kwargs))
+            return self
+        return anota
+
+    def de(self, objeto, metodo, *args, **kwargs):
+        # `figura.de(df, 'plot.bar', x='Name')` desenha `df.plot.bar(x='Name', ax=eixo)`;
+        # com `metodo=None` o próprio objeto é chamado
+        self.passos.append((objeto, metodo, args, kwargs))
+        return self
+
+    def desenha(self, caminho=None, **kwargs):
+        # o matplotlib só é importado quando algo é de fato desenhado
+        import matplotlib
+        import matplotlib.style
+        from matplotlib.figure import Figure
+
+        with matplotlib.style.context(ESTILO), matplotlib.rc_context(PARAMETROS_GRAFICOS):
+            figura = Figure()
+            eixo = figura.add_subplot()
+            for objeto, metodo, args, kw in self.passos:
+                if objeto is None:
+                    getattr(eixo, metodo)(*args, **kw)
+                    continue
+                funcao = objeto
+                for parte in metodo.split('.') if metodo else []:
+                    funcao = getattr(funcao, parte)
+                funcao(*args, ax=eixo, **kw)
+            if caminho is not None:
+                figura.savefig(caminho, **kwargs)
+        return figura
+
+    def _repr_png_(self):
+        # o Jupyter desenha a figura quando ela é o resultado da célula
+        saida = io.BytesIO()
+        self.desenha(saida, format='png', bbox_inches='tight')
+        return saida.getvalue()
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.nome!r}, {len(self.passos)} passos)'
+
+
+class Graficos:
+
+    def __init__(self, classe=Figura):
+        self.classe = classe
+        self.figuras = {}
+        self._trabalhador = None
+
+    def figura(self, nome):
+        self.figuras[nome] = self.classe(nome)
+        return self.figuras[nome]
+
+    def __getitem__(self, nome):
+        return self.figuras[nome]
+
+    def salva(self, pasta, formato='png', em_segundo_plano=False):
+        if em_segundo_plano:
+            if self._trabalhador is None:
+                # um único trabalhador: o estilo do matplotlib é global
+                self._trabalhador = ThreadPoolExecutor(max_workers=1)
+            return self._trabalhador.submit(self.salva, pasta, formato)
+        os.makedirs(pasta, exist_ok=True)
+        caminhos = []
+        for nome, figura in list(self.figuras.items()):
+            caminho = os.path.join(pasta, f'{nome}.{formato}')
+            figura.desenha(caminho)
+            caminhos.append(caminho)
+        return caminhos
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Imputação de faltantes em bases grandes, compartilhada pelos cadernos.
+#
+# `Imputador.ajusta` calcula o valor de preenchimento de cada coluna (média,
+# mediana, moda ou média por grupo com `por=`) em uma única passada, pedaço a
+# pedaço, e aceita também um iterador de DataFrames. `Imputador.aplica`
+# preenche os faltantes direto nos vetores `float`, sem copiar a tabela com
+# `inplace=True`; nesse caso avisa a escrita com `versoes.marca_escrita`, para
+# que os caches guardados junto do DataFrame sejam refeitos. A mediana usa o
+# `EsbocoKLL` de `medianas.py`.
+
+import numpy as np
+import pandas as pd
+
+from medianas import EsbocoKLL
+from versoes import marca_escrita
+
+
+ESTRATEGIAS_IMPUTACAO = ('mean', 'median', 'mode')
+
+
+def _preenche_coluna(df, nome, valor, tamanho_pedaco, tabela=None, codigos=None):
+    # com `tabela`, cada linha recebe `tabela[codigos[linha]]` (média do seu grupo)
+    coluna = df[nome]
+    valores = coluna.to_numpy()
+    if valores.dtype.kind in 'iub':
+        return
+    if valores.dtype.kind != 'f':
+        # demais tipos (textos, categorias, tipos com máscara) passam pelo fillna do pandas
+        if tabela is not None:
+            valor = pd.Series(tabela[codigos], index=df.index)
+        df[nome] = coluna.fillna(valor)
+        return
+    copia = not valores.flags.writeable
+    if copia:
+        # colunas só de leitura (memmap, copy-on-write): preenchemos uma cópia da coluna
+        valores = valores.copy()
+    for ini in range(0, len(valores), tamanho_pedaco):
+        pedaco = valores[ini:ini + tamanho_pedaco]
+        faltantes = np.isnan(pedaco)
+        if tabela is None:
+            pedaco[faltantes] = valor
+        else:
+            pedaco[faltantes] = tabela[codigos[ini:ini + tamanho_pedaco][faltantes]]
+    if copia:
+        df[nome] = valores
+
+
+class Imputador:
+
+    def __init__(self, estrategia='mean', por=None, colunas=None, k=200, tamanho_pedaco=1_000_000):
+        if estrategia not in ESTRATEGIAS_IMPUTACAO:
+            raise ValueError(f'estratégia desconhecida: {estrategia!r}')
+        if por is not None and estrategia != 'mean':
+            raise ValueError('a imputação por grupo só existe para a média')
+        self.estrategia = estrategia
+        self.por = por
+        self.colunas = colunas
+        self.k = k
+        self.tamanho_pedaco = tamanho_pedaco
+        self.valores = None
+        self.por_grupo = None
+
+    def _colunas_de(self, pedaco):
+        if self.colunas is not None:
+            return list(self.colunas)
+        if self.estrategia == 'mode':
+            return [nome for nome in pedaco.columns if nome != self.por]
+        return [nome for nome in pedaco.columns
+                if nome != self.por and pd.api.types.is_numeric_dtype(pedaco[nome])
+                and not pd.api.types.is_bool_dtype(pedaco[nome])]
+
+    def ajusta(self, dados):
+        # uma única passada, pedaço a pedaço; `dados` pode ser um iterador de DataFrames
+        pedacos = [dados] if isinstance(dados, pd.DataFrame) else dados
+        colunas = None
+        somas = contagens = None
+        somas_grupo = contagens_grupo = None
+        esbocos, frequencias = {}, {}
+        for pedaco in pedacos:
+            if colunas is None:
+                colunas = self._colunas_de(pedaco)
+                somas = np.zeros(len(colunas))
+                contagens = np.zeros(len(colunas), dtype=np.int64)
+            for ini in range(0, len(pedaco), self.tamanho_pedaco):
+                parte = pedaco.iloc[ini:ini + self.tamanho_pedaco]
+                for j, nome in enumerate(colunas):
+                    if self.estrategia == 'mode':
+                        contagem = parte[nome].value_counts()
+                        anterior = frequencias.get(nome)
+                        frequencias[nome] = contagem if anterior is None else anterior.add(contagem, fill_value=0)
+                        continue
+                    valores = parte[nome].to_numpy(dtype=np.float64, na_value=np.nan)
+                    if self.estrategia == 'median':
+                        esbocos.setdefault(nome, EsbocoKLL(self.k)).atualiza(valores)
+                        continue
+                    presentes = ~np.isnan(valores)
+                    somas[j] += valores[presentes].sum()
+                    contagens[j] += np.count_nonzero(presentes)
+                if self.por is not None:
+                    grupos = parte[colunas].groupby(parte[self.por], observed=True, sort=False)
+                    soma, contagem = grupos.sum(), grupos.count()
+                    if somas_grupo is None:
+                        somas_grupo, contagens_grupo = soma, contagem
+                    else:
+                        somas_grupo = somas_grupo.add(soma, fill_value=0)
+                        contagens_grupo = contagens_grupo.add(contagem, fill_value=0)
+        colunas = colunas or []
+        if self.estrategia == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                valores = somas / contagens if colunas else []
+        elif self.estrategia == 'median':
+            valores = [esbocos[nome].quantil(0.5) if nome in esbocos else np.nan for nome in colunas]
+        else:
+            # como o `df.mode()`: entre os empatados, o menor valor
+            valores = []
+            for nome in colunas:
+                contagem = frequencias.get(nome)
+                if contagem is None or len(contagem) == 0:
+                    valores.append(np.nan)
+                else:
+                    valores.append(contagem[contagem == contagem.max()].sort_index().index[0])
+        self.valores = pd.Series(valores, index=colunas, dtype=None if self.estrategia == 'mode' else np.float64)
+        if self.por is not None and somas_grupo is not None:
+            self.por_grupo = somas_grupo / contagens_grupo.where(contagens_grupo > 0)
+        return self
+
+    def aplica(self, df, inplace=False):
+        if self.valores is None:
+            raise ValueError('o imputador ainda não foi ajustado: chame `ajusta` antes')
+        alvo = df if inplace else df.copy()
+        codigos = None
+        if self.por_grupo is not None:
+            # grupos que não apareceram no ajuste caem no código -1: a média geral
+            codigos = self.por_grupo.index.get_indexer(alvo[self.por])
+        for nome, valor in self.valores.items():
+            if nome not in alvo.columns:
+                continue
+            tabela = None
+            if codigos is not None:
+                tabela = np.append(self.por_grupo[nome].fillna(valor).to_numpy(), valor)
+            _preenche_coluna(alvo, nome, valor, self.tamanho_pedaco, tabela, codigos)
+        if inplace:
+            marca_escrita(alvo, [nome for nome in self.valores.index if nome in alvo.columns])
+        return alvo
+
+    def __repr__(self):
+        por = '' if self.por is None else f', por={self.por!r}'
+        return f'Imputador({self.estrategia!r}{por})'
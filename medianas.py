@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Medianas exatas e aproximadas, compartilhadas pelos cadernos.
+#
+# `mediana_exata` usa `np.partition`, sem ordenar o vetor inteiro, e ignora
+# `NaN` como o pandas. `EsbocoKLL` é um esboço de quantis com no máximo algo
+# como `3 * k` valores: é exato enquanto nada foi descartado e, depois disso,
+# erra o posto do quantil em algo da ordem de `1 / k`. Dois esboços podem ser
+# combinados com `junta`. `ServicoMedianas` mantém um esboço (ou, com
+# `exato=True`, os próprios valores) por coluna numérica de um `DataFrame`.
+
+import numpy as np
+import pandas as pd
+
+
+def mediana_exata(valores):
+    valores = np.asarray(valores, dtype=np.float64).ravel()
+    valores = valores[~np.isnan(valores)]
+    n = len(valores)
+    if n == 0:
+        return np.nan
+    meio = n // 2
+    if n % 2 == 1:
+        return np.partition(valores, meio)[meio]
+    parte = np.partition(valores, [meio - 1, meio])
+    return (parte[meio - 1] + parte[meio]) / 2
+
+
+class EsbocoKLL:
+
+    def __init__(self, k=200, semente=None):
+        self.k = k
+        self.n = 0
+        self.niveis = [np.empty(0)]
+        self._rng = np.random.default_rng(semente)
+
+    def _capacidade(self, h):
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.niveis) - h - 1))))
+
+    def _compacta(self):
+        h = 0
+        while h < len(self.niveis):
+            nivel = self.niveis[h]
+            if len(nivel) > self._capacidade(h):
+                if h + 1 == len(self.niveis):
+                    self.niveis.append(np.empty(0))
+                nivel = np.sort(nivel)
+                impar = len(nivel) % 2
+                promovidos = nivel[impar + self._rng.integers(2)::2]
+                self.niveis[h] = nivel[:impar]
+                self.niveis[h + 1] = np.concatenate([self.niveis[h + 1], promovidos])
+            h += 1
+
+    def atualiza(self, valores):
+        valores = np.asarray(valores, dtype=np.float64).ravel()
+        valores = valores[~np.isnan(valores)]
+        self.niveis[0] = np.concatenate([self.niveis[0], valores])
+        self.n += len(valores)
+        self._compacta()
+        return self
+
+    def junta(self, outro):
+        for h, nivel in enumerate(outro.niveis):
+            if h == len(self.niveis):
+                self.niveis.append(np.empty(0))
+            self.niveis[h] = np.concatenate([self.niveis[h], nivel])
+        self.n += outro.n
+        self._compacta()
+        return self
+
+    @property
+    def exato(self):
+        return len(self.niveis) == 1
+
+    def quantis(self, qs):
+        qs = np.asarray(qs, dtype=np.float64)
+        if self.n == 0:
+            return np.full(qs.shape, np.nan)
+        if self.exato:
+            return np.quantile(self.niveis[0], qs)
+        valores = np.concatenate(self.niveis)
+        pesos = np.concatenate([np.full(len(nivel), 2.0 ** h) for h, nivel in enumerate(self.niveis)])
+        ordem = np.argsort(valores, kind='stable')
+        valores, pesos = valores[ordem], pesos[ordem]
+        # posição do centro de cada elemento, na mesma escala do np.quantile (0 a n - 1)
+        posicoes = np.cumsum(pesos) - (pesos + 1) / 2
+        return np.interp(qs * (pesos.sum() - 1), posicoes, valores)
+
+    def quantil(self, q):
+        return self.quantis([q])[0]
+
+
+class ServicoMedianas:
+
+    def __init__(self, exato=False, k=200, semente=None):
+        self.exato = exato
+        self.k = k
+        self.semente = semente
+        self.colunas = {}
+
+    def _novo(self):
+        return [] if self.exato else EsbocoKLL(self.k, self.semente)
+
+    def atualiza(self, df):
+        for nome in df.select_dtypes('number').columns:
+            valores = df[nome].to_numpy(dtype=np.float64)
+            valores = valores[~np.isnan(valores)]
+            estado = self.colunas.setdefault(nome, self._novo())
+            if self.exato:
+                estado.append(valores)
+            else:
+                estado.atualiza(valores)
+        return self
+
+    def junta(self, outro):
+        if outro.exato != self.exato:
+            raise ValueError('não é possível juntar um serviço exato com um aproximado')
+        for nome, do_outro in outro.colunas.items():
+            estado = self.colunas.setdefault(nome, self._novo())
+            if self.exato:
+                estado.extend(do_outro)
+            else:
+                estado.junta(do_outro)
+        return self
+
+    def tamanhos(self):
+        if self.exato:
+            return pd.Series({nome: sum(map(len, partes)) for nome, partes in self.colunas.items()}, dtype=np.int64)
+        return pd.Series({nome: esboco.n for nome, esboco in self.colunas.items()}, dtype=np.int64)
+
+    def medianas(self):
+        if self.exato:
+            return pd.Series({nome: mediana_exata(np.concatenate(partes)) if partes else np.nan
+                              for nome, partes in self.colunas.items()}, dtype=np.float64)
+        return pd.Series({nome: esboco.quantil(.5) for nome, esboco in self.colunas.items()}, dtype=np.float64)
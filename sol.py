@@ -27,27 +27,95 @@ from numpy.testing import assert_array_equal
 
 
 import numpy as np
-import matplotlib.pyplot as plt
 import pandas as pd
 
 
+# Os gráficos deste notebook não são desenhados na hora. Cada chamada (`hist`, `xlabel`, `df.plot.bar`, ...) é apenas anotada em uma `Figura` e o desenho só acontece quando a figura é o resultado de uma célula, ou quando chamamos `graficos.salva(pasta)`, que pode rodar em segundo plano. Assim, importar o código deste notebook para corrigir ou reaproveitar as funções não gasta tempo com gráficos. A `Figura` e o `Graficos` ficam em `figuras.py`, compartilhados com a Lista 02; aqui a `FiguraVoos` acrescenta histogramas já contados, KDE e densidade 2D.
+
 # In[3]:
 
 
-plt.rcParams['figure.figsize']  = (16, 10)
-plt.rcParams['axes.labelsize']  = 20
-plt.rcParams['axes.titlesize']  = 20
-plt.rcParams['legend.fontsize'] = 20
-plt.rcParams['xtick.labelsize'] = 20
-plt.rcParams['ytick.labelsize'] = 20
-plt.rcParams['lines.linewidth'] = 4
+from figuras import Figura, Graficos
+
+
+# A densidade 2D agrega os pontos em uma grade de `RESOLUCAO_DENSIDADE` x `RESOLUCAO_DENSIDADE` células com um único `np.bincount`.
+
+# In[ ]:
+
+
+RESOLUCAO_DENSIDADE = 300
+
+
+def _bordas(valores, resolucao, limites, inteiros):
+    if limites is None:
+        limites = (valores.min(), valores.max())
+    inicio, fim = float(limites[0]), float(limites[1])
+    if resolucao is None:
+        resolucao = RESOLUCAO_DENSIDADE
+        # valores inteiros com poucos valores distintos: um bin por valor, sem listras vazias
+        if inteiros and fim - inicio < resolucao:
+            return np.linspace(inicio - 0.5, fim + 0.5, int(fim - inicio) + 2)
+    if inicio == fim:
+        inicio, fim = inicio - 0.5, fim + 0.5
+    return np.linspace(inicio, fim, resolucao + 1)
+
+
+def _indices_de_bins(valores, bordas):
+    n = len(bordas) - 1
+    indices = ((valores - bordas[0]) * (n / (bordas[-1] - bordas[0]))).astype(np.intp)
+    np.clip(indices, 0, n - 1, out=indices)
+    # corrige os arredondamentos nas bordas, como o np.histogram faz
+    indices -= valores < bordas[indices]
+    indices += (valores >= bordas[indices + 1]) & (indices != n - 1)
+    return indices
+
 
+def densidade_2d(x, y, resolucao=None, limites=None):
+    # mesmo resultado de np.histogram2d com bins uniformes, via um único bincount
+    x, y = np.asarray(x), np.asarray(y)
+    inteiros_x = np.issubdtype(x.dtype, np.integer)
+    inteiros_y = np.issubdtype(y.dtype, np.integer)
+    x, y = x.astype('float64'), y.astype('float64')
+    validos = np.isfinite(x) & np.isfinite(y)
+    x, y = x[validos], y[validos]
+    nx, ny = (resolucao, resolucao) if resolucao is None or np.isscalar(resolucao) else resolucao
+    limites_x, limites_y = (None, None) if limites is None else limites
+    bordas_x = _bordas(x, nx, limites_x, inteiros_x)
+    bordas_y = _bordas(y, ny, limites_y, inteiros_y)
+    nx, ny = len(bordas_x) - 1, len(bordas_y) - 1
+    dentro = (x >= bordas_x[0]) & (x <= bordas_x[-1]) & (y >= bordas_y[0]) & (y <= bordas_y[-1])
+    x, y = x[dentro], y[dentro]
+    codigos = _indices_de_bins(x, bordas_x) * ny + _indices_de_bins(y, bordas_y)
+    contagens = np.bincount(codigos, minlength=nx * ny).reshape(nx, ny)
+    return contagens, bordas_x, bordas_y
 
-# In[4]:
 
+def _desenha_densidade(x, y, ax, resolucao=None, limites=None, cmap='viridis', rotulo='Contagem'):
+    contagens, bordas_x, bordas_y = densidade_2d(x, y, resolucao, limites)
+    # células vazias ficam transparentes na escala log
+    imagem = ax.imshow(contagens.T, origin='lower', aspect='auto', interpolation='nearest',
+                       extent=(bordas_x[0], bordas_x[-1], bordas_y[0], bordas_y[-1]),
+                       norm='log', cmap=cmap)
+    ax.figure.colorbar(imagem, ax=ax, label=rotulo)
 
-plt.ion()
-plt.style.use('seaborn-colorblind')
+
+class FiguraVoos(Figura):
+
+    def histograma(self, histograma, cumulative=False, density=False, **kwargs):
+        # barras a partir das contagens já calculadas: cada borda esquerda cai no próprio bin
+        pesos = histograma.alturas(cumulative, density)
+        return self.hist(histograma.bordas[:-1], bins=histograma.bordas, weights=pesos, **kwargs)
+
+    def kde(self, valores, **kwargs):
+        # substitui o `df.plot.kde`, que avalia o núcleo em cada ponto para cada dado
+        return self.de(_desenha_kde, None, valores, **kwargs)
+
+    def densidade(self, x, y, **kwargs):
+        # agrega os pontos em uma grade e desenha uma única imagem, em vez de um marcador por ponto
+        return self.de(_desenha_densidade, None, x, y, **kwargs)
+
+
+graficos = Graficos(FiguraVoos)
 
 
 # ## Notas dos Alunos (Tutorial)
@@ -148,6 +216,71 @@ df_novo = df.fillna(df.mean())
 df_novo
 
 
+# O `df.fillna(df.mean())` passa duas vezes pelos dados: uma para as médias e outra para copiar a tabela inteira com os valores trocados. Para bases grandes, a classe `Imputador` abaixo separa as duas etapas. O `ajusta` calcula o valor de cada coluna (média, mediana, moda ou média por grupo) em uma única passada, pedaço a pedaço, e aceita também um iterador de DataFrames. O `aplica` preenche os faltantes direto nos vetores `float` do DataFrame, também em pedaços, sem copiar a tabela quando `inplace=True`. Como os valores ficam guardados, podemos ajustar em uma base e aplicar em outra sem recalcular nada. A mediana usa o esboço KLL que veremos mais abaixo, com memória limitada. O `Imputador` fica em `imputacao.py`, compartilhado com o caderno `Explorando_pandas`.
+
+# In[ ]:
+
+
+from imputacao import Imputador
+
+
+# In[ ]:
+
+
+imputador = Imputador('mean').ajusta(df)
+df_novo = imputador.aplica(df)
+df_novo
+
+
+# In[ ]:
+
+
+esperado = df.fillna(df.mean(numeric_only=True))
+pd.testing.assert_frame_equal(esperado, imputador.aplica(df))
+assert_equal(3, df.isnull().sum().sum())
+
+# ajustado em pedaços, o resultado é o mesmo
+em_pedacos = Imputador('mean', tamanho_pedaco=5).ajusta(df)
+pd.testing.assert_series_equal(imputador.valores, em_pedacos.valores)
+em_pedacos = Imputador('mean').ajusta(df.iloc[i:i + 7] for i in range(0, len(df), 7))
+pd.testing.assert_series_equal(imputador.valores, em_pedacos.valores)
+
+# no lugar: os próprios vetores do DataFrame são preenchidos
+copia = df.copy()
+assert imputador.aplica(copia, inplace=True) is copia
+pd.testing.assert_frame_equal(esperado, copia)
+
+# ajustado em uma base, aplicado em outra
+outra = pd.DataFrame({'StudyHours': [np.nan, 1.0], 'Grade': [2.0, np.nan]})
+assert_array_almost_equal([[df['StudyHours'].mean(), 2], [1, df['Grade'].mean()]],
+                          imputador.aplica(outra).to_numpy())
+
+# média por grupo; grupos novos ou sem valores usam a média geral
+exemplo = pd.DataFrame({'g': ['a', 'a', 'b', 'b', 'c'], 'x': [1.0, 3.0, np.nan, 10.0, np.nan]})
+por_grupo = Imputador('mean', por='g').ajusta(exemplo)
+assert_array_almost_equal([1, 3, 10, 10, 14 / 3], por_grupo.aplica(exemplo)['x'])
+novo = pd.DataFrame({'g': ['z', 'a', None], 'x': [np.nan, np.nan, np.nan]})
+assert_array_almost_equal([14 / 3, 2, 14 / 3], por_grupo.aplica(novo)['x'])
+
+moda = Imputador('mode').ajusta(df)
+pd.testing.assert_frame_equal(df.fillna(df.mode().iloc[0]), moda.aplica(df))
+
+
+# In[ ]:
+
+
+# a mediana usa o esboço KLL de `medianas.py`; enquanto o esboço não descarta nada, ela é exata
+mediana = Imputador('median').ajusta(df)
+pd.testing.assert_frame_equal(df.fillna(df.median(numeric_only=True)), mediana.aplica(df))
+
+# com memória limitada, o erro no posto é da ordem de 1 / k
+grande = pd.DataFrame({'x': np.random.default_rng(0).permutation(100_000).astype(float)})
+grande.iloc[::10] = np.nan
+valor = Imputador('median', k=200).ajusta(grande).valores['x']
+presentes = grande['x'].dropna()
+assert (presentes < valor).mean() - 0.02 <= 0.5 <= (presentes <= valor).mean() + 0.02
+
+
 # In[15]:
 
 
@@ -223,12 +356,188 @@ df.query('Grade >= 60')
 df.query('Grade >= 60 and StudyHours <= 14')
 
 
+# A cada chamada, o `query` lê a expressão de novo e monta um vetor booleano do tamanho da tabela para cada cláusula. Abaixo, `compila` lê a expressão uma única vez e devolve uma `Consulta` reutilizável (expressões repetidas nem são lidas de novo). Em um `and`, cada cláusula só avalia as linhas que passaram pelas anteriores, e se nenhuma sobrar as demais nem são avaliadas. Em um `or`, cada cláusula só olha as linhas ainda não aceitas. Valores podem ser passados como parâmetros (`:nome`), sem montar a string com `f'...'`.
+
+# In[ ]:
+
+
+import ast
+import functools
+import io
+import operator
+import tokenize
+
+
+_PREFIXO_PARAMETRO = '__parametro_'
+_BOOLEANOS = {'&': 'and', '|': 'or'}
+_COMPARACOES = {ast.Eq: operator.eq, ast.NotEq: operator.ne, ast.Lt: operator.lt,
+                ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge}
+_ARITMETICAS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+                ast.Div: operator.truediv, ast.FloorDiv: operator.floordiv,
+                ast.Mod: operator.mod, ast.Pow: operator.pow}
+
+
+def _troca_parametros(expressao):
+    # `:nome` vira um identificador comum, que o ast consegue ler; `&` e `|` viram
+    # `and` e `or`, como no `df.query`, para que `a > 1 & b < 2` junte as duas comparações
+    tokens = list(tokenize.generate_tokens(io.StringIO(expressao).readline))
+    saida, parametros = [], []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if (token.type == tokenize.OP and token.string == ':'
+                and i + 1 < len(tokens) and tokens[i + 1].type == tokenize.NAME):
+            parametros.append(tokens[i + 1].string)
+            saida.append((tokenize.NAME, _PREFIXO_PARAMETRO + tokens[i + 1].string))
+            i += 2
+            continue
+        if token.type == tokenize.OP and token.string in _BOOLEANOS:
+            saida.append((tokenize.NAME, _BOOLEANOS[token.string]))
+        else:
+            saida.append((token.type, token.string))
+        i += 1
+    return tokenize.untokenize(saida), tuple(dict.fromkeys(parametros))
+
+
+def _restantes(linhas, selecionadas, n):
+    # `linhas` e `selecionadas` são posições ordenadas; None representa todas as linhas
+    mascara = np.ones(n if linhas is None else len(linhas), dtype=bool)
+    mascara[selecionadas if linhas is None else np.searchsorted(linhas, selecionadas)] = False
+    return mascara
+
+
+class Consulta:
+
+    def __init__(self, expressao):
+        self.expressao = expressao
+        codigo, self.parametros = _troca_parametros(expressao)
+        self.colunas = set()
+        self._predicado = self._compila_predicado(ast.parse(codigo.strip(), mode='eval').body)
+
+    def _compila_predicado(self, no):
+        # cada predicado recebe as linhas ainda candidatas e devolve as que passam
+        if isinstance(no, ast.BoolOp):
+            conjuncao = isinstance(no.op, ast.And)
+            partes = [self._compila_predicado(parte) for parte in no.values]
+            return self._e(partes) if conjuncao else self._ou(partes)
+        if isinstance(no, ast.UnaryOp) and isinstance(no.op, (ast.Not, ast.Invert)):
+            parte = self._compila_predicado(no.operand)
+
+            def nao(tabela, linhas):
+                mascara = _restantes(linhas, parte(tabela, linhas), tabela.n)
+                return np.flatnonzero(mascara) if linhas is None else linhas[mascara]
+            return nao
+        valor = self._compila_valor(no)
+
+        def filtra(tabela, linhas):
+            mascara = np.asarray(valor(tabela, linhas), dtype=bool)
+            if mascara.ndim == 0:
+                mascara = np.full(tabela.n if linhas is None else len(linhas), bool(mascara))
+            return np.flatnonzero(mascara) if linhas is None else linhas[mascara]
+        return filtra
+
+    @staticmethod
+    def _e(partes):
+        def e(tabela, linhas):
+            # cada cláusula só olha as linhas que passaram pelas anteriores
+            for parte in partes:
+                linhas = parte(tabela, linhas)
+                if len(linhas) == 0:
+                    break
+            return linhas
+        return e
+
+    @staticmethod
+    def _ou(partes):
+        def ou(tabela, linhas):
+            # cada cláusula só olha as linhas que ainda não foram aceitas
+            aceitas = []
+            for parte in partes:
+                selecionadas = parte(tabela, linhas)
+                aceitas.append(selecionadas)
+                mascara = _restantes(linhas, selecionadas, tabela.n)
+                linhas = np.flatnonzero(mascara) if linhas is None else linhas[mascara]
+                if len(linhas) == 0:
+                    break
+            return np.sort(np.concatenate(aceitas))
+        return ou
+
+    def _compila_valor(self, no):
+        if isinstance(no, ast.Constant):
+            return lambda tabela, linhas: no.value
+        if isinstance(no, ast.Name):
+            if no.id.startswith(_PREFIXO_PARAMETRO):
+                nome = no.id[len(_PREFIXO_PARAMETRO):]
+                return lambda tabela, linhas: tabela.parametros[nome]
+            self.colunas.add(no.id)
+            return lambda tabela, linhas: tabela.coluna(no.id, linhas)
+        if isinstance(no, ast.Compare):
+            termos = [self._compila_valor(termo) for termo in [no.left] + no.comparators]
+            comparacoes = []
+            for op in no.ops:
+                if type(op) not in _COMPARACOES:
+                    raise ValueError(f'comparação não suportada: {ast.unparse(no)}')
+                comparacoes.append(_COMPARACOES[type(op)])
+
+            def compara(tabela, linhas):
+                valores = [termo(tabela, linhas) for termo in termos]
+                resultado = comparacoes[0](valores[0], valores[1])
+                for i in range(1, len(comparacoes)):
+                    resultado = resultado & comparacoes[i](valores[i], valores[i + 1])
+                return resultado
+            return compara
+        if isinstance(no, ast.BinOp) and type(no.op) in _ARITMETICAS:
+            esquerda, direita = self._compila_valor(no.left), self._compila_valor(no.right)
+            funcao = _ARITMETICAS[type(no.op)]
+            return lambda tabela, linhas: funcao(esquerda(tabela, linhas), direita(tabela, linhas))
+        if isinstance(no, ast.UnaryOp) and isinstance(no.op, ast.USub):
+            operando = self._compila_valor(no.operand)
+            return lambda tabela, linhas: -operando(tabela, linhas)
+        raise ValueError(f'expressão não suportada: {ast.unparse(no)}')
+
+    def linhas(self, df, **parametros):
+        faltando = set(self.parametros) - set(parametros)
+        if faltando:
+            raise ValueError(f'parâmetros sem valor: {sorted(faltando)}')
+        faltando = self.colunas - set(df.columns)
+        if faltando:
+            raise KeyError(f'colunas inexistentes: {sorted(faltando)}')
+        return self._predicado(_Tabela(df, parametros), None)
+
+    def __call__(self, df, **parametros):
+        return df.iloc[self.linhas(df, **parametros)]
+
+    def __repr__(self):
+        return f'Consulta({self.expressao!r})'
+
+
+class _Tabela:
+
+    def __init__(self, df, parametros):
+        self.df = df
+        self.n = len(df)
+        self.parametros = parametros
+        self._colunas = {}
+
+    def coluna(self, nome, linhas):
+        if nome not in self._colunas:
+            self._colunas[nome] = self.df[nome].to_numpy()
+        valores = self._colunas[nome]
+        return valores if linhas is None else valores[linhas]
+
+
+@functools.lru_cache(maxsize=128)
+def compila(expressao):
+    return Consulta(expressao)
+
+
 # Todo retorno, ou do índice booleano ou da query são outros DataFrames. Então, podemos chamar métodos como tirar a média dos alunos.
 
 # In[24]:
 
 
-above_60_low_hours = df.query('Grade >= 60 and StudyHours <= 14')
+poucas_horas = compila('Grade >= 60 and StudyHours <= :horas')
+above_60_low_hours = poucas_horas(df, horas=14)
 type(above_60_low_hours)
 
 
@@ -252,7 +561,194 @@ df[df['Grade'] >= mean]
 # In[27]:
 
 
-df.query(f'Grade >= {mean}')
+compila('Grade >= :mean')(df, mean=mean)
+
+
+# In[ ]:
+
+
+pd.testing.assert_frame_equal(df.query(f'Grade >= {mean}'), compila('Grade >= :mean')(df, mean=mean))
+pd.testing.assert_frame_equal(df.query('Grade >= 60 and StudyHours <= 14'), above_60_low_hours)
+assert compila('Grade >= :mean') is compila('Grade >= :mean')
+
+for expressao in ['Name == "Skye"', 'Grade >= 60 or StudyHours < 8', 'not (Grade < 50) and StudyHours > 10',
+                  '(Grade > 30) & (Grade < 70) | (StudyHours == 1)', 'Grade * 2 - 10 > StudyHours * 5',
+                  '40 < Grade <= 70', 'Grade > 1000 and Name == "Skye"', '~(StudyHours >= 10)',
+                  'Grade > 30 & Grade < 70', 'Grade < 30 | StudyHours >= 14 & Grade > 60']:
+    pd.testing.assert_frame_equal(df.query(expressao), compila(expressao)(df))
+
+assert_array_equal(np.flatnonzero(df['Grade'] >= 60), compila('Grade >= :nota')(df, nota=60).index)
+try:
+    compila('Grade >= :nota')(df)
+    assert False
+except ValueError:
+    pass
+
+
+# Cada filtro como `df['Grade'] >= mean` passa pela coluna inteira, e cada `sort_values` ordena tudo de novo. Quando a mesma coluna é consultada muitas vezes, vale guardar a ordem da coluna uma única vez. O `indice_ordenado(df, coluna)` guarda a permutação do `argsort` junto do DataFrame e a reaproveita enquanto a coluna não mudar. Para saber se mudou, sem percorrer a coluna a cada consulta, guardamos um carimbo de versão dela (`versoes.py`): o vetor por trás da coluna, comparado por identidade, e um contador de escritas no lugar. Como `df.loc[...] = ...` escreve no vetor existente, quem escreve assim chama `marca_escrita(df, colunas)`; o `Imputador.aplica(inplace=True)` já faz isso. Com ela, faixas de valores saem de duas buscas binárias, os `k` maiores e menores são uma fatia, e postos e percentis são uma busca binária. Ao anexar linhas com `anexa_linhas`, só o lote novo é ordenado e intercalado com o índice existente.
+
+# In[ ]:
+
+
+import weakref
+
+from versoes import carimbo, marca_escrita, vale
+
+
+class IndiceOrdenado:
+
+    def __init__(self, valores, inicio=0):
+        valores = np.asarray(valores)
+        faltantes = pd.isna(valores)
+        presentes = np.flatnonzero(~faltantes)
+        # ordenação estável: empates ficam na ordem das linhas
+        ordem = presentes[np.argsort(valores[presentes], kind='stable')]
+        self.ordem = ordem + inicio
+        self.ordenados = valores[ordem]
+        self.faltantes = np.flatnonzero(faltantes) + inicio
+        self.n = inicio + len(valores)
+        self.carimbo = None
+        self._decrescente = None
+
+    @classmethod
+    def de(cls, df, coluna):
+        indice = cls(df[coluna].to_numpy())
+        indice.carimbo = carimbo(df, [coluna])
+        return indice
+
+    def valido(self, df, coluna):
+        # O(1): mesmo vetor e nenhuma escrita marcada desde que o índice foi feito
+        return len(df) == self.n and vale(self.carimbo, df)
+
+    def anexa(self, valores):
+        # ordena só o lote novo e intercala com o índice atual: O(n + k log k), sem reordenar tudo
+        lote = IndiceOrdenado(valores, inicio=self.n)
+        novo = IndiceOrdenado.__new__(IndiceOrdenado)
+        onde = np.searchsorted(self.ordenados, lote.ordenados, 'right')
+        novo.ordenados = np.insert(self.ordenados, onde, lote.ordenados)
+        novo.ordem = np.insert(self.ordem, onde, lote.ordem)
+        novo.faltantes = np.concatenate([self.faltantes, lote.faltantes])
+        novo.n = lote.n
+        novo.carimbo = None
+        novo._decrescente = None
+        return novo
+
+    def entre(self, minimo=None, maximo=None, inclui_minimo=True, inclui_maximo=True):
+        # posições das linhas com minimo <= valor <= maximo, em ordem de valor
+        ini = 0 if minimo is None else np.searchsorted(self.ordenados, minimo, 'left' if inclui_minimo else 'right')
+        fim = len(self.ordenados) if maximo is None else np.searchsorted(self.ordenados, maximo, 'right' if inclui_maximo else 'left')
+        return self.ordem[ini:max(ini, fim)]
+
+    def conta_entre(self, minimo=None, maximo=None, inclui_minimo=True, inclui_maximo=True):
+        return len(self.entre(minimo, maximo, inclui_minimo, inclui_maximo))
+
+    def menores(self, k):
+        return self.ordem[:k]
+
+    def maiores(self, k):
+        # como o nlargest(keep='first'): empates na fronteira ficam com as primeiras linhas
+        n = len(self.ordenados)
+        k = min(k, n)
+        if k == 0:
+            return self.ordem[:0]
+        fronteira = self.ordenados[n - k]
+        acima = np.searchsorted(self.ordenados, fronteira, 'right')
+        empatados = np.searchsorted(self.ordenados, fronteira, 'left')
+        escolhidos = np.concatenate([self.ordem[acima:], self.ordem[empatados:empatados + k - (n - acima)]])
+        valores = np.concatenate([self.ordenados[acima:], self.ordenados[empatados:empatados + k - (n - acima)]])
+        return escolhidos[np.lexsort((escolhidos, -valores))]
+
+    def posicoes(self, ascendente=True):
+        # permutação completa, como o sort_values(kind='stable'): faltantes no fim
+        if ascendente:
+            return np.concatenate([self.ordem, self.faltantes])
+        if self._decrescente is None:
+            invertidos = len(self.ordenados) - 1 - np.argsort(self.ordenados[::-1], kind='stable')[::-1]
+            self._decrescente = np.concatenate([self.ordem[invertidos], self.faltantes])
+        return self._decrescente
+
+    def posto(self, valor):
+        # posição (a partir de 1) que o valor teria, contando os menores
+        return int(np.searchsorted(self.ordenados, valor, 'left')) + 1
+
+    def percentil(self, valor):
+        # porcentagem dos valores menores ou iguais
+        return 100 * np.searchsorted(self.ordenados, valor, 'right') / len(self.ordenados)
+
+    def quantil(self, q):
+        return np.quantile(self.ordenados, q) if len(self.ordenados) else np.nan
+
+
+_INDICES_ORDENADOS = {}
+
+
+def indice_ordenado(df, coluna):
+    chave = (id(df), coluna)
+    indice = _INDICES_ORDENADOS.get(chave)
+    if chave not in _INDICES_ORDENADOS:
+        weakref.finalize(df, _INDICES_ORDENADOS.pop, chave, None)
+    if indice is None or not indice.valido(df, coluna):
+        indice = _INDICES_ORDENADOS[chave] = IndiceOrdenado.de(df, coluna)
+    return indice
+
+
+def anexa_linhas(df, novas):
+    # concatena e leva junto os índices ordenados já calculados para `df`
+    resultado = pd.concat([df, novas], ignore_index=isinstance(df.index, pd.RangeIndex))
+    for (chave, coluna), indice in list(_INDICES_ORDENADOS.items()):
+        if chave == id(df) and indice.valido(df, coluna):
+            novo = indice.anexa(novas[coluna].to_numpy())
+            novo.carimbo = carimbo(resultado, [coluna])
+            _INDICES_ORDENADOS[(id(resultado), coluna)] = novo
+            weakref.finalize(resultado, _INDICES_ORDENADOS.pop, (id(resultado), coluna), None)
+    return resultado
+
+
+# In[ ]:
+
+
+indice_notas = indice_ordenado(df, 'Grade')
+df.iloc[np.sort(indice_notas.entre(mean))]
+
+
+# In[ ]:
+
+
+pd.testing.assert_frame_equal(df[df['Grade'] >= mean], df.iloc[np.sort(indice_notas.entre(mean))])
+pd.testing.assert_frame_equal(df[(df['Grade'] > 40) & (df['Grade'] < 60)],
+                              df.iloc[np.sort(indice_notas.entre(40, 60, False, False))])
+assert indice_ordenado(df, 'Grade') is indice_notas
+assert_equal((df['Grade'] <= 50).sum(), indice_notas.conta_entre(maximo=50))
+
+pd.testing.assert_frame_equal(df.nlargest(5, 'Grade'), df.iloc[indice_notas.maiores(5)])
+pd.testing.assert_frame_equal(df.nsmallest(5, 'Grade'), df.iloc[indice_notas.menores(5)])
+empates = pd.DataFrame({'x': [3, 1, 3, 2, 3, 1]})
+assert_array_equal(empates.nlargest(2, 'x').index, IndiceOrdenado.de(empates, 'x').maiores(2))
+assert_array_equal(empates.sort_values('x', ascending=False, kind='stable').index,
+                   IndiceOrdenado.de(empates, 'x').posicoes(ascendente=False))
+
+assert_equal(int(df['Grade'].rank(method='min')[df['Grade'].idxmax()]), indice_notas.posto(df['Grade'].max()))
+assert_almost_equal(100 * (df['Grade'] <= 50).mean() / df['Grade'].notna().mean(), indice_notas.percentil(50))
+assert_almost_equal(df['Grade'].quantile(0.3), indice_notas.quantil(0.3))
+
+# anexar linhas só intercala o lote novo
+maior = anexa_linhas(df, pd.DataFrame({'Name': ['A', 'B'], 'StudyHours': [1.0, 2.0], 'Grade': [99.0, np.nan]}))
+anexado = indice_ordenado(maior, 'Grade')
+assert_array_equal(IndiceOrdenado.de(maior, 'Grade').posicoes(), anexado.posicoes())
+assert_array_equal(np.argsort(maior['Grade'].to_numpy(), kind='stable'), anexado.posicoes())
+
+# escritas no lugar não trocam o vetor: marcadas com `marca_escrita`, o índice é refeito
+editado = df.copy()
+indice_ordenado(editado, 'Grade')
+editado.loc[editado['Grade'].idxmax(), 'Grade'] = -1.0
+marca_escrita(editado, ['Grade'])
+pd.testing.assert_frame_equal(editado.nsmallest(3, 'Grade'), editado.iloc[indice_ordenado(editado, 'Grade').menores(3)])
+editado.loc[editado.index[:2], 'StudyHours'] = np.nan
+antes = indice_ordenado(editado, 'StudyHours')
+Imputador('mean').ajusta(editado).aplica(editado, inplace=True)
+assert indice_ordenado(editado, 'StudyHours') is not antes
+pd.testing.assert_frame_equal(editado[editado['StudyHours'] >= 10],
+                              editado.iloc[np.sort(indice_ordenado(editado, 'StudyHours').entre(10))])
 
 
 # Os DataFrames são incrivelmente versáteis e facilitam a manipulação de dados. Muitas operações DataFrame retornam uma nova cópia do DataFrame; portanto, se quiser modificar um DataFrame, mas manter a variável existente, você precisará atribuir o resultado da operação à variável existente. Por exemplo, o código a seguir classifica os dados do aluno em ordem decrescente de nota e atribui o DataFrame classificado resultante à variável `df_students`. 
@@ -261,22 +757,121 @@ df.query(f'Grade >= {mean}')
 
 
 # Re-ordena os dados por nota
-df_students = df.sort_values('Grade', ascending=False)
+df_students = df.iloc[indice_ordenado(df, 'Grade').posicoes(ascendente=False)]
 df_students
 
 
+# In[ ]:
+
+
+pd.testing.assert_frame_equal(df.sort_values('Grade', ascending=False, kind='stable'), df_students)
+
+
 # ### Visualizando dados com Matplotlib
 # 
 # Os DataFrames fornecem uma ótima maneira de explorar e analisar dados tabulares, mas uma imagem vale mil palavras. A biblioteca [Matplotlib](matplotlib.org) fornece a base para a plotagem de visualizações de dados.
 # 
 # Vamos começar com um histograma de notas. Observe como também colocamos uma linha preta em cada barra `edgecolor='k'` e setamos rótulos ao X e Y (para sabermos qual eixo mostra quais dados).
+# 
+# Abaixo vamos desenhar o mesmo histograma de algumas formas diferentes. Para não recalcular os bins a cada gráfico, a classe `Histograma` conta os dados uma única vez. Como os bins têm a mesma largura, o bin de cada valor sai de uma conta (`(x - inicio) / largura`), sem busca nas bordas. A cumulativa, a densidade e os quantis saem das contagens guardadas. Novos dados podem ser somados com `atualiza`.
+
+# In[ ]:
+
+
+class Histograma:
+
+    def __init__(self, bordas):
+        self.bordas = np.asarray(bordas, dtype='float64')
+        self.contagens = np.zeros(len(self.bordas) - 1, dtype='int64')
+        self.fora = 0
+
+    @classmethod
+    def de(cls, valores, bins=10):
+        # mesmas bordas do np.histogram: `bins` bins iguais entre o mínimo e o máximo
+        valores = np.asarray(valores, dtype='float64')
+        valores = valores[~np.isnan(valores)]
+        histograma = cls(_bordas(valores, bins, None, False))
+        return histograma.atualiza(valores)
+
+    @property
+    def total(self):
+        return int(self.contagens.sum())
+
+    def atualiza(self, lote):
+        lote = np.asarray(lote, dtype='float64')
+        lote = lote[~np.isnan(lote)]
+        dentro = (lote >= self.bordas[0]) & (lote <= self.bordas[-1])
+        # os bins são fixos: valores fora deles são apenas contados
+        self.fora += int(len(lote) - dentro.sum())
+        indices = _indices_de_bins(lote[dentro], self.bordas)
+        self.contagens += np.bincount(indices, minlength=len(self.contagens))
+        return self
+
+    def cumulativa(self):
+        return np.cumsum(self.contagens)
+
+    def densidade(self):
+        return self.contagens / (self.total * np.diff(self.bordas))
+
+    def alturas(self, cumulative=False, density=False):
+        # mesmas alturas do plt.hist com os mesmos argumentos
+        if cumulative:
+            acumulado = self.cumulativa()
+            return acumulado / self.total if density else acumulado
+        return self.densidade() if density else self.contagens
+
+    def quantil(self, q):
+        # inverte a cumulativa, supondo os valores espalhados por igual dentro de cada bin
+        q = np.asarray(q, dtype='float64')
+        acumulado = self.cumulativa()
+        alvo = q * self.total
+        indices = np.where(alvo > 0, np.searchsorted(acumulado, alvo, 'left'),
+                           np.searchsorted(acumulado, 0, 'right'))
+        indices = np.minimum(indices, len(self.contagens) - 1)
+        antes = acumulado[indices] - self.contagens[indices]
+        fracao = np.clip((alvo - antes) / self.contagens[indices], 0, 1)
+        larguras = np.diff(self.bordas)[indices]
+        return self.bordas[indices] + fracao * larguras
+
+    def __repr__(self):
+        return f'Histograma({len(self.contagens)} bins, {self.total} valores)'
+
+
+# In[ ]:
+
+
+notas = df_students['Grade'].dropna().to_numpy()
+histograma = Histograma.de(notas)
+
+esperado, bordas = np.histogram(notas)
+assert_array_equal(esperado, histograma.contagens)
+assert_array_almost_equal(bordas, histograma.bordas)
+assert_array_almost_equal(np.histogram(notas, density=True)[0], histograma.densidade())
+assert_array_equal(np.cumsum(esperado), histograma.alturas(cumulative=True))
+assert_almost_equal(1, histograma.alturas(cumulative=True, density=True)[-1])
+
+# em lotes, com os mesmos bins, as contagens são as mesmas
+em_lotes = Histograma(histograma.bordas)
+for lote in np.array_split(notas, 4):
+    em_lotes.atualiza(lote)
+assert_array_equal(histograma.contagens, em_lotes.contagens)
+em_lotes.atualiza([-1, 1000, np.nan])
+assert_equal(2, em_lotes.fora)
+assert_equal(len(notas), em_lotes.total)
+
+assert_almost_equal(histograma.bordas[0], histograma.quantil(0))
+assert_almost_equal(histograma.bordas[-1], histograma.quantil(1))
+assert abs(histograma.quantil(0.5) - np.median(notas)) <= np.diff(histograma.bordas).max()
+
 
 # In[29]:
 
 
-plt.hist(df_students['Grade'], edgecolor='k')
-plt.xlabel('Grade')
-plt.ylabel('Num. Students')
+hist_notas = Histograma.de(df_students['Grade'])
+(graficos.figura('notas_hist')
+    .histograma(hist_notas, edgecolor='k')
+    .xlabel('Grade')
+    .ylabel('Num. Students'))
 
 
 # Observe como as notas concentram em 50. Às vezes é mais simples interpretar a função cumulativa dos dados.  Vamos fazer este gráfico de uma forma diferente da que vimos em sala de aula. Alterando um pouco a chamada `hist` podemos pegar a cumulativa.
@@ -284,9 +879,10 @@ plt.ylabel('Num. Students')
 # In[30]:
 
 
-plt.hist(df_students['Grade'], edgecolor='k', cumulative=True)
-plt.xlabel('Grade - x')
-plt.ylabel('Num. Students with Grade <= x')
+(graficos.figura('notas_cumulativa')
+    .histograma(hist_notas, edgecolor='k', cumulative=True)
+    .xlabel('Grade - x')
+    .ylabel('Num. Students with Grade <= x'))
 
 
 # Agora, `density=True` transforma este plot em uma função cumulativa de probabilidade.
@@ -294,9 +890,10 @@ plt.ylabel('Num. Students with Grade <= x')
 # In[31]:
 
 
-plt.hist(df_students['Grade'], edgecolor='k', cumulative=True, density=True)
-plt.xlabel('Grade - x')
-plt.ylabel('Frac. Students with Grade <= x')
+(graficos.figura('notas_cdf')
+    .histograma(hist_notas, edgecolor='k', cumulative=True, density=True)
+    .xlabel('Grade - x')
+    .ylabel('Frac. Students with Grade <= x'))
 
 
 # Observe que 50% dos alunos (0.5 no eixo-y) tem nota menor ou igual à mais ou menos 47~50 (eixo-x). Isto pode ser verificado com a chamada median abaixo. Outro exemplo, tente entender no gráfico, 20% dos alunos (eixo-y) tem nota menor ou igual à mais ou menos 30.
@@ -307,12 +904,20 @@ plt.ylabel('Frac. Students with Grade <= x')
 df_students['Grade'].median()
 
 
+# A mesma leitura pode ser feita direto do histograma, sem voltar aos dados.
+
+# In[ ]:
+
+
+hist_notas.quantil([0.2, 0.5])
+
+
 # Até agora, você usou métodos do Matplotlib.pyplot para plotar gráficos. No entanto, muitos pacotes, incluindo Pandas, fornecem métodos que abstraem as funções Matplotlib simplificando sua vida. Por exemplo, o DataFrame fornece seus próprios métodos para plotar dados, conforme mostrado no exemplo a seguir para plotar um gráfico de barras de horas de estudo. 
 
 # In[33]:
 
 
-df_students.plot.bar(x='Name', y='Grade', edgecolor='k')
+graficos.figura('notas_barras').de(df_students, 'plot.bar', x='Name', y='Grade', edgecolor='k')
 
 
 # Ou o mesmo histograma de antes.
@@ -320,19 +925,105 @@ df_students.plot.bar(x='Name', y='Grade', edgecolor='k')
 # In[34]:
 
 
-df_students.plot.hist(y='Grade', edgecolor='k')
-plt.xlabel('Grade - x')
-plt.ylabel('Num. Students')
+(graficos.figura('notas_hist_pandas')
+    .de(df_students, 'plot.hist', y='Grade', edgecolor='k')
+    .xlabel('Grade - x')
+    .ylabel('Num. Students'))
 
 
 # Como também uma versão contínua do histograma. Esta é chamada de Kernel Density Estimation (vimos rapidamente em sala de aula).
+# 
+# O `plot.kde` do pandas usa o `gaussian_kde` do scipy, que soma a contribuição de cada dado em cada ponto da grade: são `n * g` contas, inviável para centenas de milhares de voos. Abaixo, os dados são primeiro distribuídos em uma grade regular (cada valor divide seu peso entre os dois pontos vizinhos) e depois a grade é convoluída com o núcleo gaussiano via FFT. O custo fica em `O(n + g log g)`. A largura de banda segue as mesmas regras do scipy (Scott ou Silverman) e os dados podem ter pesos.
+
+# In[ ]:
+
+
+def largura_de_banda(valores, pesos=None, regra='scott'):
+    valores = np.asarray(valores, dtype='float64')
+    pesos = np.ones(len(valores)) if pesos is None else np.asarray(pesos, dtype='float64')
+    pesos = pesos / pesos.sum()
+    n_efetivo = 1 / np.sum(pesos ** 2)
+    if regra == 'scott':
+        fator = n_efetivo ** (-1 / 5)
+    elif regra == 'silverman':
+        fator = (n_efetivo * 3 / 4) ** (-1 / 5)
+    elif np.isscalar(regra) and not isinstance(regra, str):
+        # como no scipy, um número é o fator que multiplica o desvio padrão
+        fator = float(regra)
+    else:
+        raise ValueError(f'regra de largura de banda desconhecida: {regra!r}')
+    return np.sqrt(np.cov(valores, aweights=pesos)) * fator
+
+
+def kde_binada(valores, pesos=None, regra='scott', pontos=1000, corte=5):
+    valores = np.asarray(valores, dtype='float64')
+    pesos = np.ones(len(valores)) if pesos is None else np.asarray(pesos, dtype='float64')
+    validos = ~np.isnan(valores) & ~np.isnan(pesos)
+    valores, pesos = valores[validos], pesos[validos]
+    largura = largura_de_banda(valores, pesos, regra)
+    if not largura > 0:
+        raise ValueError('os dados não variam: a largura de banda é zero')
+
+    # mesma grade do pandas: a amplitude dos dados com meia amplitude de folga em cada lado
+    minimo, maximo = valores.min(), valores.max()
+    folga = 0.5 * (maximo - minimo)
+    grade = np.linspace(minimo - folga, maximo + folga, pontos)
+    passo = grade[1] - grade[0]
+
+    # binning linear: cada valor divide seu peso entre os dois pontos vizinhos da grade
+    posicoes = (valores - grade[0]) / passo
+    esquerda = np.clip(np.floor(posicoes).astype(np.intp), 0, pontos - 2)
+    fracao = posicoes - esquerda
+    massa = (np.bincount(esquerda, pesos * (1 - fracao), minlength=pontos)
+             + np.bincount(esquerda + 1, pesos * fracao, minlength=pontos))
+
+    # o núcleo é cortado em `corte` larguras de banda
+    alcance = min(pontos - 1, int(np.ceil(corte * largura / passo)))
+    deslocamentos = np.arange(-alcance, alcance + 1) * passo
+    nucleo = np.exp(-0.5 * (deslocamentos / largura) ** 2) / (largura * np.sqrt(2 * np.pi))
+    tamanho = 1 << int(np.ceil(np.log2(pontos + 2 * alcance)))
+    convolucao = np.fft.irfft(np.fft.rfft(massa, tamanho) * np.fft.rfft(nucleo, tamanho), tamanho)
+    densidade = convolucao[alcance:alcance + pontos] / pesos.sum()
+    return grade, np.maximum(densidade, 0)
+
+
+def _desenha_kde(valores, ax, pesos=None, regra='scott', pontos=1000, **kwargs):
+    grade, densidade = kde_binada(valores, pesos, regra, pontos)
+    kwargs.setdefault('label', getattr(valores, 'name', None))
+    ax.plot(grade, densidade, **kwargs)
+    if kwargs['label'] is not None:
+        ax.legend()
+
+
+# In[ ]:
+
+
+def assert_kde_como_scipy(df):
+    # o scipy só é importado por esta verificação
+    from scipy.stats import gaussian_kde
+
+    grade, densidade = kde_binada(df['Grade'])
+    notas = df['Grade'].dropna()
+    assert_array_almost_equal(gaussian_kde(notas)(grade), densidade, decimal=5)
+    assert_almost_equal(1, densidade.sum() * (grade[1] - grade[0]), decimal=3)
+
+    horas = df.loc[notas.index, 'StudyHours']
+    grade, densidade = kde_binada(notas, pesos=horas, regra='silverman')
+    esperado = gaussian_kde(notas, bw_method='silverman', weights=horas)(grade)
+    assert_array_almost_equal(esperado, densidade, decimal=5)
+    assert_almost_equal(gaussian_kde(notas, bw_method=0.3).factor * notas.std(), largura_de_banda(notas, regra=0.3))
+
+
+assert_kde_como_scipy(df_students)
+
 
 # In[35]:
 
 
-df_students.plot.kde(y='Grade')
-plt.xlabel('Grade - x')
-plt.ylabel('Density')
+(graficos.figura('notas_kde')
+    .kde(df_students['Grade'])
+    .xlabel('Grade - x')
+    .ylabel('Density'))
 
 
 # ### Estatísticas
@@ -388,20 +1079,22 @@ print(min_, max_, mean, median, mode, sep=', ')
 # In[40]:
 
 
+figura = graficos.figura('notas_estatisticas')
+
 # Histograma
-plt.hist(data, edgecolor='k')
-plt.xlabel('Grade')
-plt.ylabel('Num. Students')
+figura.histograma(Histograma.de(data), edgecolor='k')
+figura.xlabel('Grade')
+figura.ylabel('Num. Students')
 
 # Linhas para cada estatística
-plt.axvline(x=min_, color = 'gray', linestyle='dashed', linewidth = 2, label='min')
-plt.axvline(x=mean, color = 'cyan', linestyle='dashed', linewidth = 2, label='mean')
-plt.axvline(x=median, color = 'red', linestyle='dashed', linewidth = 2, label='median')
-plt.axvline(x=mode, color = 'yellow', linestyle='dashed', linewidth = 2, label='mode')
-plt.axvline(x=max_, color = 'gray', linestyle='dashed', linewidth = 2, label='max')
+figura.axvline(x=min_, color = 'gray', linestyle='dashed', linewidth = 2, label='min')
+figura.axvline(x=mean, color = 'cyan', linestyle='dashed', linewidth = 2, label='mean')
+figura.axvline(x=median, color = 'red', linestyle='dashed', linewidth = 2, label='median')
+figura.axvline(x=mode, color = 'yellow', linestyle='dashed', linewidth = 2, label='mode')
+figura.axvline(x=max_, color = 'gray', linestyle='dashed', linewidth = 2, label='max')
 
 # Adiciona uma legenda
-plt.legend()
+figura.legend()
 
 
 # ### Medidas de variância
@@ -469,10 +1162,100 @@ df
 # 
 # A "caixa" mostra o primeiro e terceiro quartil. A linha no meio mostra o segundo, a mediana. Portanto, a caixa se estende dos valores dos quartil de Q1 a Q3 dos dados, com uma linha na mediana (Q2). Os bigodes se estendem das bordas da caixa para mostrar a extensão dos dados. Por padrão, eles estendem não mais do que 1,5 * IQR (IQR = Q3 - Q1) das bordas da caixa, terminando no ponto de dados mais distante dentro desse intervalo. Valores fora desta faix são plotados como pontos separados. 
 
+# Para desenhar, o `df.boxplot(by=...)` ordena os valores de cada grupo separadamente. Abaixo calculamos as estatísticas de todos os grupos de uma vez: separamos os dados por grupo em um único vetor, cada grupo vira uma fatia contígua e cada fatia é ordenada no lugar. Os quartis saem direto das posições na fatia e os bigodes de uma busca binária. O resultado pode ser reaproveitado sem desenhar nada, ou passado para o `bxp` do matplotlib, que desenha as caixas sem recalcular. Nas figuras, `_desenha_boxplot` só calcula as estatísticas quando a figura é desenhada, e a comparação com o `boxplot_stats` do matplotlib importa o matplotlib apenas dentro da verificação.
+
+# In[ ]:
+
+
+def _percentis_ordenados(valores, inicios, tamanhos, p):
+    # interpolação linear, como o np.percentile, em cada fatia já ordenada
+    posicoes = inicios + (tamanhos - 1) * p
+    baixo = np.floor(posicoes).astype(np.intp)
+    alto = np.minimum(baixo + 1, inicios + tamanhos - 1)
+    return valores[baixo] + (valores[alto] - valores[baixo]) * (posicoes - baixo)
+
+
+def estatisticas_boxplot(df, coluna, por, whis=1.5, com_outliers=True):
+    valores = df[coluna].to_numpy(dtype='float64')
+    codigos, grupos = pd.factorize(df[por], sort=True)
+    validos = (codigos >= 0) & ~np.isnan(valores)
+    valores, codigos = valores[validos], codigos[validos]
+
+    tamanhos = np.bincount(codigos, minlength=len(grupos))
+    somas = np.bincount(codigos, weights=valores, minlength=len(grupos))
+    inicios = np.cumsum(tamanhos) - tamanhos
+
+    # separa os grupos (ordenação estável de inteiros pequenos é um radix sort)
+    # e depois ordena cada fatia no lugar
+    codigos = codigos.astype(np.min_scalar_type(len(grupos)))
+    valores = valores[np.argsort(codigos, kind='stable')]
+    for inicio, tamanho in zip(inicios, tamanhos):
+        valores[inicio:inicio + tamanho].sort()
+    presentes = tamanhos > 0
+    grupos, inicios, tamanhos, somas = grupos[presentes], inicios[presentes], tamanhos[presentes], somas[presentes]
+
+    q1 = _percentis_ordenados(valores, inicios, tamanhos, 0.25)
+    medianas = _percentis_ordenados(valores, inicios, tamanhos, 0.5)
+    q3 = _percentis_ordenados(valores, inicios, tamanhos, 0.75)
+    iqr = q3 - q1
+
+    resultado = []
+    for i, grupo in enumerate(grupos):
+        x = valores[inicios[i]:inicios[i] + tamanhos[i]]
+        # mesmas regras do matplotlib.cbook.boxplot_stats
+        lo = np.searchsorted(x, q1[i] - whis * iqr[i], 'left')
+        hi = np.searchsorted(x, q3[i] + whis * iqr[i], 'right')
+        whislo = x[lo] if lo < len(x) and x[lo] <= q1[i] else q1[i]
+        whishi = x[hi - 1] if hi > 0 and x[hi - 1] >= q3[i] else q3[i]
+        estatisticas = {
+            'label': str(grupo),
+            'n': int(tamanhos[i]),
+            'mean': somas[i] / tamanhos[i],
+            'med': medianas[i], 'q1': q1[i], 'q3': q3[i], 'iqr': iqr[i],
+            'cilo': medianas[i] - 1.57 * iqr[i] / np.sqrt(tamanhos[i]),
+            'cihi': medianas[i] + 1.57 * iqr[i] / np.sqrt(tamanhos[i]),
+            'whislo': whislo, 'whishi': whishi,
+            'fliers': np.empty(0),
+        }
+        if com_outliers:
+            estatisticas['fliers'] = np.concatenate((x[:np.searchsorted(x, whislo, 'left')],
+                                                     x[np.searchsorted(x, whishi, 'right'):]))
+        resultado.append(estatisticas)
+    return resultado
+
+
+def _desenha_boxplot(df, coluna, por, ax, whis=1.5, com_outliers=True, **kwargs):
+    # as estatísticas só são calculadas quando a figura é desenhada
+    ax.bxp(estatisticas_boxplot(df, coluna, por, whis, com_outliers), **kwargs)
+
+
 # In[45]:
 
 
-df.boxplot(column='StudyHours', by='Passed', grid=False)
+(graficos.figura('horas_por_aprovacao')
+    .de(_desenha_boxplot, None, df, 'StudyHours', 'Passed')
+    .title('StudyHours')
+    .xlabel('Passed'))
+
+
+# In[ ]:
+
+
+def assert_boxplot_como_matplotlib(df, coluna, por):
+    # o matplotlib só é importado por esta verificação
+    from matplotlib.cbook import boxplot_stats
+
+    estatisticas = estatisticas_boxplot(df, coluna, por)
+    grupos = [g[coluna].dropna().to_numpy() for _, g in df.groupby(por)]
+    for esperado, calculado in zip(boxplot_stats(grupos), estatisticas):
+        for chave in ['mean', 'med', 'q1', 'q3', 'iqr', 'cilo', 'cihi', 'whislo', 'whishi']:
+            assert_almost_equal(esperado[chave], calculado[chave])
+        assert_array_almost_equal(np.sort(esperado['fliers']), calculado['fliers'])
+    assert_equal([str(g) for g, _ in df.groupby(por)], [e['label'] for e in estatisticas])
+    assert_equal(df[coluna].notna().sum(), sum(e['n'] for e in estatisticas))
+
+
+assert_boxplot_como_matplotlib(df, 'StudyHours', 'Passed')
 
 
 # Observe que, como esperado, alunos que passam estudam mais. Os quartis, portanto a distribuição dos dados, são mais altos. Para observar os valores podemos fazer um groupby.
@@ -494,21 +1277,148 @@ df.groupby('Passed')['StudyHours'].describe()
 # In[47]:
 
 
-plt.scatter(df.StudyHours, df.Grade, edgecolor='k', alpha=0.75)
-plt.xlabel('Hours')
-plt.ylabel('Grade')
+(graficos.figura('horas_vs_notas')
+    .scatter(df.StudyHours, df.Grade, edgecolor='k', alpha=0.75)
+    .xlabel('Hours')
+    .ylabel('Grade'))
 
 
 # ## Exercícios (Flight Data)
 # 
 # Eu espero que o tutorial acima tenha sido uma boa revisão de análise exploratória de dados. Agora é com você! Nesta lista, você explorará um conjunto de dados do mundo real contendo dados de voos do Departamento de Transporte dos EUA.
 # 
-# Vamos começar carregando e visualizando os dados. 
+# Vamos começar carregando e visualizando os dados.
+
+# Ler o CSV inteiro a cada execução é lento: são ~270 mil linhas e as colunas de texto (companhia, aeroportos, cidades, estados) repetem os mesmos poucos valores milhares de vezes. Por isso, abaixo:
+# 
+# 1. Lemos o arquivo em pedaços (`chunksize`) com tipos compactos: `category` para os textos, inteiros pequenos para mês, dia e indicadores, `float32` para o indicador com dados faltantes (`DepDel15`). Os atrasos são minutos inteiros e sem faltantes, então `int16` é exato e menor do que `float32`;
+# 1. Salvamos cada coluna em um arquivo `.npy` numa pasta de cache cujo nome é o hash (SHA-1) do CSV;
+# 1. Nas próximas execuções abrimos os `.npy` com `mmap_mode='r'`, sem parsear o texto de novo.
+# 
+# O caminho pode ser um arquivo local (definido pela variável de ambiente `VOOS_CSV`). Caso o arquivo não exista, lemos da URL, sem cache.
+
+# In[ ]:
+
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from pandas.api.types import union_categoricals
+
+
+URL_VOOS = 'https://raw.githubusercontent.com/icd-ufmg/icd-ufmg.github.io/master/listas/l3/flights.csv'
+
+TIPOS_VOOS = {
+    'Year': np.int16, 'Month': np.int8, 'DayofMonth': np.int8, 'DayOfWeek': np.int8,
+    'Carrier': 'category',
+    'OriginAirportID': np.int16, 'OriginAirportName': 'category',
+    'OriginCity': 'category', 'OriginState': 'category',
+    'DestAirportID': np.int16, 'DestAirportName': 'category',
+    'DestCity': 'category', 'DestState': 'category',
+    'CRSDepTime': np.int16, 'DepDelay': np.int16, 'DepDel15': np.float32,
+    'CRSArrTime': np.int16, 'ArrDelay': np.int16, 'ArrDel15': np.int8,
+    'Cancelled': np.int8,
+}
+
+VERSAO_CACHE = 1
+
+
+def _hash_arquivo(caminho, bloco=1 << 20):
+    h = hashlib.sha1()
+    with open(caminho, 'rb') as f:
+        for parte in iter(lambda: f.read(bloco), b''):
+            h.update(parte)
+    return h.hexdigest()
+
+
+def le_csv_em_pedacos(caminho, tipos, tamanho_pedaco=100_000):
+    colunas = {}
+    for pedaco in pd.read_csv(caminho, dtype=tipos, chunksize=tamanho_pedaco):
+        for nome in pedaco.columns:
+            coluna = pedaco[nome]
+            if coluna.dtype == object:
+                coluna = coluna.astype('category')
+            colunas.setdefault(nome, []).append(coluna.array if isinstance(coluna.dtype, pd.CategoricalDtype)
+                                                else coluna.to_numpy())
+    dados = {}
+    for nome, partes in colunas.items():
+        if isinstance(partes[0], pd.Categorical):
+            dados[nome] = union_categoricals(partes)
+        else:
+            dados[nome] = np.concatenate(partes)
+    return pd.DataFrame(dados, copy=False)
+
+
+def _salva_cache(df, pasta):
+    os.makedirs(os.path.dirname(pasta), exist_ok=True)
+    temporaria = tempfile.mkdtemp(dir=os.path.dirname(pasta))
+    try:
+        colunas = []
+        for i, nome in enumerate(df.columns):
+            coluna = df[nome]
+            if isinstance(coluna.dtype, pd.CategoricalDtype):
+                categorias = np.asarray(coluna.cat.categories)
+                if categorias.dtype == object:
+                    categorias = categorias.astype(str)
+                np.save(os.path.join(temporaria, f'{i}.codigos.npy'), coluna.cat.codes.to_numpy())
+                np.save(os.path.join(temporaria, f'{i}.categorias.npy'), categorias)
+                colunas.append([nome, 'category'])
+            else:
+                np.save(os.path.join(temporaria, f'{i}.npy'), coluna.to_numpy())
+                colunas.append([nome, str(coluna.dtype)])
+        with open(os.path.join(temporaria, 'colunas.json'), 'w') as f:
+            json.dump({'versao': VERSAO_CACHE, 'colunas': colunas}, f)
+        try:
+            os.replace(temporaria, pasta)
+        except OSError:  # outro processo escreveu o mesmo cache antes
+            pass
+    finally:
+        # depois do replace a pasta temporária não existe mais; em qualquer falha, ela é apagada
+        shutil.rmtree(temporaria, ignore_errors=True)
+
+
+def _le_cache(pasta):
+    with open(os.path.join(pasta, 'colunas.json')) as f:
+        meta = json.load(f)
+    dados = {}
+    for i, (nome, tipo) in enumerate(meta['colunas']):
+        if tipo == 'category':
+            codigos = np.load(os.path.join(pasta, f'{i}.codigos.npy'), mmap_mode='r')
+            categorias = np.load(os.path.join(pasta, f'{i}.categorias.npy'))
+            dados[nome] = pd.Categorical.from_codes(codigos, categorias)
+        else:
+            dados[nome] = np.load(os.path.join(pasta, f'{i}.npy'), mmap_mode='r')
+    return pd.DataFrame(dados, copy=False)
+
+
+def carrega_voos(caminho, pasta_cache='.cache_voos', tipos=TIPOS_VOOS, tamanho_pedaco=100_000):
+    if not os.path.exists(caminho):
+        return le_csv_em_pedacos(caminho, tipos, tamanho_pedaco)
+    pasta = os.path.join(pasta_cache, f'{_hash_arquivo(caminho)}-v{VERSAO_CACHE}')
+    if not os.path.exists(os.path.join(pasta, 'colunas.json')):
+        _salva_cache(le_csv_em_pedacos(caminho, tipos, tamanho_pedaco), pasta)
+    return _le_cache(pasta)
+
 
 # In[48]:
 
 
-df = pd.read_csv('https://raw.githubusercontent.com/icd-ufmg/icd-ufmg.github.io/master/listas/l3/flights.csv')
+df = carrega_voos(os.environ.get('VOOS_CSV', URL_VOOS))
+
+
+# In[ ]:
+
+
+# quando outro processo já escreveu o cache, a pasta temporária não fica para trás
+with tempfile.TemporaryDirectory() as pasta_teste:
+    destino = os.path.join(pasta_teste, 'voos')
+    _salva_cache(df.head(100), destino)
+    _salva_cache(df.head(100), destino)
+    assert os.listdir(pasta_teste) == ['voos']
+    pd.testing.assert_frame_equal(df.head(100), _le_cache(destino))
 
 
 # O conjunto de dados contém observações de voos domésticos dos EUA em 2013 e consiste nos seguintes campos:
@@ -543,45 +1453,124 @@ df.head()
 # 
 # Conte a quantidade de dados faltantes na tabela. Isto é, em TODAS as células. O método retorna apenas um número.
 
+# A chamada `df.isna()` cria uma tabela booleana do tamanho dos dados inteiros. Em bases com dezenas de milhões de linhas isto são gigabytes de memória temporária. A função `conta_faltantes` abaixo percorre os dados em pedaços de linhas e, em uma única passada, calcula:
+# 
+# 1. a quantidade de faltantes por coluna;
+# 1. o total de faltantes;
+# 1. as posições das linhas sem nenhum faltante (usadas pelo `drop_missing` abaixo).
+# 
+# Quem só precisa das contagens, como o `count_missing`, passa `posicoes=False`: aí nenhum vetor do tamanho da base é montado, só as contagens de cada pedaço são somadas.
+# 
+# Para cada coluna olhamos direto a representação interna do pandas: colunas inteiras ou booleanas não guardam faltantes e são puladas, colunas `float` usam `np.isnan`, colunas `category` usam o código `-1` e os tipos com máscara (`Int64`, `boolean`, ...) usam a própria máscara. Apenas a máscara de um pedaço existe por vez. A entrada pode ser um `DataFrame` (inclusive um aberto do cache em `memmap`) ou um iterador de `DataFrame`s, como o retornado por `pd.read_csv(..., chunksize=...)`.
+
+# In[ ]:
+
+
+def _valores_da_coluna(coluna):
+    if isinstance(coluna.dtype, np.dtype):
+        return coluna.to_numpy()
+    return coluna.array
+
+
+def _mascara_faltantes(valores, ini, fim):
+    # None indica que o tipo da coluna não admite faltantes
+    if isinstance(valores, np.ndarray):
+        tipo = valores.dtype.kind
+        if tipo in 'iub':
+            return None
+        if tipo in 'fc':
+            return np.isnan(valores[ini:fim])
+        if tipo in 'mM':
+            return np.isnat(valores[ini:fim])
+        return pd.isna(valores[ini:fim])
+    if isinstance(valores, pd.Categorical):
+        return valores.codes[ini:fim] == -1
+    return np.asarray(valores[ini:fim].isna())
+
+
+def conta_faltantes(dados, tamanho_pedaco=1_000_000, posicoes=True):
+    # com posicoes=False só as contagens são acumuladas: nenhum vetor do tamanho da base é montado
+    pedacos = [dados] if isinstance(dados, pd.DataFrame) else dados
+    por_coluna = None
+    completas = []
+    deslocamento = 0
+    for pedaco in pedacos:
+        if por_coluna is None:
+            por_coluna = pd.Series(0, index=pedaco.columns, dtype=np.int64)
+        valores = [_valores_da_coluna(pedaco[nome]) for nome in pedaco.columns]
+        for ini in range(0, len(pedaco), tamanho_pedaco):
+            fim = min(ini + tamanho_pedaco, len(pedaco))
+            linha_completa = np.ones(fim - ini, dtype=bool) if posicoes else None
+            for j, coluna in enumerate(valores):
+                faltantes = _mascara_faltantes(coluna, ini, fim)
+                if faltantes is None:
+                    continue
+                por_coluna.iloc[j] += np.count_nonzero(faltantes)
+                if posicoes:
+                    linha_completa &= ~faltantes
+            if posicoes:
+                completas.append(np.flatnonzero(linha_completa) + (deslocamento + ini))
+        deslocamento += len(pedaco)
+    if por_coluna is None:
+        por_coluna = pd.Series(dtype=np.int64)
+    if not posicoes:
+        return por_coluna, int(por_coluna.sum()), None
+    completas = np.concatenate(completas) if completas else np.empty(0, dtype=np.int64)
+    return por_coluna, int(por_coluna.sum()), completas
+
+
 # In[50]:
 
 
 def count_missing(df) -> int:
-    return df.isna().sum().sum()
+    return conta_faltantes(df, posicoes=False)[1]
 
 
 # In[51]:
 
 
 assert_equal(2761, count_missing(df))
+assert conta_faltantes(df.head(1000), tamanho_pedaco=300, posicoes=False)[2] is None
+pd.testing.assert_series_equal(df.head(1000).isna().sum(), conta_faltantes(df.head(1000), tamanho_pedaco=300, posicoes=False)[0])
 
 
 # ### Exercício 2
 # 
 # Crie um novo DataFrame sem as linhas com dados faltantes
 
+# O `dropna` monta uma máscara booleana do tamanho da tabela inteira para achar as linhas completas. Como `conta_faltantes` já calculou as posições dessas linhas em pedaços, `drop_missing` só precisa de um `take`. O resultado é um `DataFrame` comum, com os mesmos rótulos de linha do `dropna`.
+
 # In[52]:
 
 
 def drop_missing(df):
-    return df.dropna()
+    return df.take(conta_faltantes(df)[2])
 
 
 # In[53]:
 
 
 assert_equal(269179, drop_missing(df).shape[0])
+pd.testing.assert_frame_equal(df.head(2000).dropna(), drop_missing(df.head(2000)))
 
 
 # ### Exercício 3
 # 
 # Retorne a mediana de TODAS as colunas numéricas do DataFrame
 
+# Abaixo usamos o mesmo serviço de medianas da Lista 02, importado do módulo `medianas.py`. No modo exato (`exato=True`), cada mediana sai de um `np.partition`, sem ordenar a coluna. No modo aproximado, cada coluna numérica tem um esboço KLL de tamanho limitado, que pode ser atualizado a cada lote de voos (`atualiza`) e combinado entre processos (`junta`).
+
+# In[ ]:
+
+
+from medianas import ServicoMedianas
+
+
 # In[54]:
 
 
 def all_median(df):
-    return df.median()
+    return ServicoMedianas(exato=True).atualiza(df).medianas()
 
 
 # In[55]:
@@ -591,6 +1580,18 @@ assert_equal(2013, all_median(df)['Year'])
 assert_equal(7, all_median(df)['Month'])
 
 
+# Para dados que chegam em lotes, usamos o modo aproximado:
+
+# In[ ]:
+
+
+servico = ServicoMedianas()
+for ini in range(0, len(df), 50_000):
+    servico.atualiza(df.iloc[ini:ini + 50_000])
+assert_equal(2013, servico.medianas()['Year'])
+assert_equal(7, servico.medianas()['Month'])
+
+
 # ### Exercício 4
 # 
 # Quais são os atrasos médios (médios) de partida e chegada? Retorne uma tupla.
@@ -619,22 +1620,105 @@ assert_almost_equal(6.496649996322718, delay(df)[1])
 # 
 # Indique qual rota tem o maior tempo de voo em MÉDIA. Use a coluna OriginAirportName e DestinationAirportName. Retorne uma tupla `(OriginAirportName, DestinationAirportName)`. Lembre-se de não considerar voos cancelados!
 
+# Os horários `CRSDepTime` e `CRSArrTime` estão no formato HHMM (por exemplo, 1539 é 15:39). Então, antes de subtrair, convertemos para minutos desde a meia-noite. Voos que chegam depois da meia-noite têm chegada "menor" do que a partida, por isso tomamos a diferença módulo 1440 (minutos em um dia).
+# 
+# Para agregar por rota sem ordenar a tabela:
+# 
+# 1. Codificamos cada aeroporto de origem e de destino em inteiros densos com `pd.factorize` (uma tabela hash, $O(n)$);
+# 1. Juntamos os dois códigos em uma única chave inteira `origem * n_destinos + destino`;
+# 1. Usamos a chave como índice de vetores: `np.bincount` soma e conta, `np.maximum.at` pega o máximo;
+# 1. Escolhemos as `k` maiores médias com `np.argpartition`, também $O(n)$.
+# 
+# Nada disso altera o `DataFrame` recebido.
+
+# In[ ]:
+
+
+def hhmm_para_minutos(hhmm):
+    hhmm = np.asarray(hhmm, dtype=np.int32)
+    return (hhmm // 100) * 60 + hhmm % 100
+
+
+def _primeira_ocorrencia(codigos, n_codigos):
+    # o np.unique devolve a posição da primeira ocorrência de cada código; atribuir com
+    # índices repetidos não garante qual escrita fica
+    primeira = np.empty(n_codigos, dtype=np.int64)
+    presentes, posicoes = np.unique(codigos, return_index=True)
+    primeira[presentes] = posicoes
+    return primeira
+
+
+def estatisticas_rotas(df, origem='OriginAirportID', destino='DestAirportID'):
+    ativos = np.flatnonzero(df['Cancelled'].to_numpy() == 0)
+    partida = hhmm_para_minutos(df['CRSDepTime'].to_numpy()[ativos])
+    chegada = hhmm_para_minutos(df['CRSArrTime'].to_numpy()[ativos])
+    duracao = (chegada - partida) % (24 * 60)
+
+    codigos_o, aeroportos_o = pd.factorize(df[origem].to_numpy()[ativos])
+    codigos_d, aeroportos_d = pd.factorize(df[destino].to_numpy()[ativos])
+    n_rotas = len(aeroportos_o) * len(aeroportos_d)
+    chave = codigos_o.astype(np.int64) * len(aeroportos_d) + codigos_d
+
+    contagem = np.bincount(chave, minlength=n_rotas)
+    soma = np.bincount(chave, weights=duracao, minlength=n_rotas)
+    maximo = np.full(n_rotas, -1, dtype=np.int64)
+    np.maximum.at(maximo, chave, duracao)
+
+    rotas = np.flatnonzero(contagem)
+    linhas = ativos[_primeira_ocorrencia(chave, n_rotas)[rotas]]
+    return pd.DataFrame({
+        origem: aeroportos_o[rotas // len(aeroportos_d)],
+        destino: aeroportos_d[rotas % len(aeroportos_d)],
+        'OriginAirportName': df['OriginAirportName'].to_numpy()[linhas],
+        'DestAirportName': df['DestAirportName'].to_numpy()[linhas],
+        'count': contagem[rotas],
+        'mean': soma[rotas] / contagem[rotas],
+        'max': maximo[rotas],
+    })
+
+
+def rotas_mais_longas(df, k=1, coluna='mean'):
+    rotas = estatisticas_rotas(df)
+    valores = rotas[coluna].to_numpy()
+    k = min(k, len(valores))
+    if k == 0:
+        return rotas.iloc[:0]
+    maiores = np.argpartition(-valores, k - 1)[:k]
+    maiores = maiores[np.argsort(-valores[maiores], kind='stable')]
+    return rotas.iloc[maiores].reset_index(drop=True)
+
+
 # In[59]:
 
 
 def high_delay(df):
-    df['Delay'] = df['CRSArrTime'] - df['CRSDepTime']
-    df['Delay'] = df['Delay'].count()
-    df = df.sort_values(by=['Delay'])
-    return (df.iloc[0]['OriginAirportName'], df.iloc[0]['DestAirportName'])
+    rotas = rotas_mais_longas(df, k=1)
+    if rotas.empty:
+        raise ValueError('high_delay: não há voos não cancelados para comparar as rotas')
+    rota = rotas.iloc[0]
+    return (rota['OriginAirportName'], rota['DestAirportName'])
 
 
-# In[60]:
+# In[ ]:
 
 
 high_delay(df)
 
 
+# In[ ]:
+
+
+assert estatisticas_rotas(df.iloc[:0]).empty
+assert rotas_mais_longas(df[df['Cancelled'] == 1]).empty
+for sem_voos in [df.iloc[:0], df[df['Cancelled'] == 1]]:
+    try:
+        high_delay(sem_voos)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('high_delay deveria recusar uma base sem voos')
+
+
 # ### Exercício 6
 # 
 # Faça um boxplot dos atrasos de saída por dia da semana!
@@ -648,7 +1732,10 @@ high_delay(df)
 # In[63]:
 
 
-df.boxplot(column='DepDelay', by='DayOfWeek', grid=False, showfliers=False)
+(graficos.figura('atrasos_por_dia')
+    .de(_desenha_boxplot, None, df, 'DepDelay', 'DayOfWeek', com_outliers=False, showfliers=False)
+    .title('DepDelay')
+    .xlabel('DayOfWeek'))
 
 
 # ### Exercício 7
@@ -660,15 +1747,38 @@ df.boxplot(column='DepDelay', by='DayOfWeek', grid=False, showfliers=False)
 # *Saída esperada*
 # 
 # ![](https://raw.githubusercontent.com/icd-ufmg/icd-ufmg.github.io/master/listas/l3/plot2.png)
+# 
+# Com centenas de milhares de voos, um `scatter` desenha um marcador por ponto e fica muito lento. Em vez disso, contamos quantos voos caem em cada célula de uma grade (um histograma 2D) e desenhamos a grade como uma única imagem, com cores em escala log. O custo do desenho não depende mais do número de voos.
 
 # In[69]:
 
 
-df.loc[df['Cancelled'] == 0].plot.scatter(x='DepDelay', y='ArrDelay', )
+voos = df.loc[df['Cancelled'] == 0, ['DepDelay', 'ArrDelay']]
+(graficos.figura('atrasos')
+    .densidade(voos['DepDelay'], voos['ArrDelay'], rotulo='Num. voos')
+    .xlabel('DepDelay')
+    .ylabel('ArrDelay'))
 
 
 # In[ ]:
 
 
+contagens, bordas_x, bordas_y = densidade_2d(voos['DepDelay'], voos['ArrDelay'], resolucao=300)
+esperado, esperado_x, esperado_y = np.histogram2d(voos['DepDelay'], voos['ArrDelay'], bins=300)
+assert_array_equal(esperado, contagens)
+assert_array_almost_equal(esperado_x, bordas_x)
+assert_array_almost_equal(esperado_y, bordas_y)
+assert_equal(len(voos), contagens.sum())
+
+# atrasos são inteiros: por padrão cada bin guarda um único valor
+contagens, bordas_x, _ = densidade_2d(voos['DepDelay'], voos['ArrDelay'])
+assert_array_equal(np.diff(bordas_x), 1)
+assert_array_equal(voos['DepDelay'].value_counts().sort_index().to_numpy(),
+                   contagens.sum(axis=1)[contagens.sum(axis=1) > 0])
+
+contagens, _, _ = densidade_2d([0, 1, 2, np.nan], [5, 5, 50, 1], resolucao=(2, 3), limites=((0, 2), (0, 10)))
+assert_array_equal([[0, 1, 0], [0, 1, 0]], contagens)
 
 
+# In[ ]:
+
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Versões de colunas, compartilhadas pelos cadernos.
+#
+# Caches guardados junto de um DataFrame (índices ordenados, correlações,
+# colunas derivadas) precisam saber se as colunas de que dependem mudaram, sem
+# percorrer os dados a cada consulta. O `carimbo` de uma coluna junta o vetor
+# que guarda os seus dados, comparado por identidade (trocar a coluna com
+# `df['x'] = ...` troca o vetor), e um contador de escritas no lugar. Escritas
+# no lugar (`df.loc[...] = ...`, `valores[i] = ...`) não trocam o vetor, então
+# quem escreve avisa com `marca_escrita(df, colunas)`; o
+# `Imputador.aplica(inplace=True)` já avisa. Conferir um carimbo com `vale`
+# custa O(1) por coluna, qualquer que seja o número de linhas.
+
+import weakref
+
+import numpy as np
+
+
+_ESCRITAS = {}
+
+
+def _vetor(df, coluna):
+    # o `values` de uma coluna numpy é uma visão do bloco do pandas: subimos até ele
+    valores = df[coluna].values
+    while isinstance(valores, np.ndarray) and isinstance(valores.base, np.ndarray):
+        valores = valores.base
+    return valores
+
+
+def _referencia(vetor):
+    # referência fraca: o carimbo não segura vetores antigos na memória
+    try:
+        return weakref.ref(vetor)
+    except TypeError:
+        return lambda: vetor
+
+
+def marca_escrita(df, colunas=None):
+    chave = id(df)
+    if chave not in _ESCRITAS:
+        _ESCRITAS[chave] = {}
+        weakref.finalize(df, _ESCRITAS.pop, chave, None)
+    contadores = _ESCRITAS[chave]
+    for coluna in df.columns if colunas is None else colunas:
+        contadores[coluna] = contadores.get(coluna, 0) + 1
+
+
+def carimbo(df, colunas):
+    escritas = _ESCRITAS.get(id(df), {})
+    return (len(df),) + tuple((coluna, _referencia(_vetor(df, coluna)), escritas.get(coluna, 0))
+                              for coluna in colunas)
+
+
+def vale(guardado, df):
+    # o carimbo guardado ainda descreve `df`? só compara tamanhos, identidades e contadores
+    if guardado is None or guardado[0] != len(df):
+        return False
+    escritas = _ESCRITAS.get(id(df), {})
+    return all(coluna in df.columns and referencia() is _vetor(df, coluna) and escritas.get(coluna, 0) == n
+               for coluna, referencia, n in guardado[1:])
+